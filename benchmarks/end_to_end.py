@@ -0,0 +1,222 @@
+"""
+End-to-end benchmark of classification, comparison and evaluation, offline.
+
+Usage (from the repository root):
+    python -m benchmarks.end_to_end --sizes small medium
+    python -m benchmarks.end_to_end --sizes small --baseline benchmarks/results/<earlier run>.json
+
+For each size a synthetic categories tree is generated (see
+`benchmarks.synthetic_tree`) and classified against a `StubLMServer` with the
+given latency distribution, per-token delays, error rate and concurrency
+limit. `classification()` is timed per keyword (segments/sec and request
+latency percentiles from the client's telemetry), then
+`compare_all_keywords_for_models`, `generate_model_comparisons` and (when
+matplotlib_venn is installed) `generate_model_venn_diagrams` are timed on the
+result. Every run is saved to `benchmarks/results/<time>_<commit>.json`
+so runs from different commits can be compared with `--baseline`.
+"""
+import os
+import json
+import time
+import argparse
+import tempfile
+import importlib.util
+import platform
+import subprocess
+import contextlib
+import pandas as pd
+from classifier.lm_interface import LMStudioClient
+from classifier.run import classification
+from processing.compare import compare_all_keywords_for_models
+from classifier.evaluation import generate_model_comparisons, generate_model_venn_diagrams
+from processing.merge import merge_classified_and_unclassified
+from benchmarks.stub_server import StubLMServer
+from benchmarks.synthetic_tree import SIZES, generate_tree, synthetic_answer
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+MODEL_NAME = "stub-model"
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                check=True, cwd=os.path.dirname(RESULTS_DIR)).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True,
+                               text=True, cwd=os.path.dirname(RESULTS_DIR)).stdout.strip()
+        return f"{commit}-dirty" if dirty else commit
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+@contextlib.contextmanager
+def quiet(verbose):
+    # The per-segment progress lines would otherwise dominate the timings
+    if verbose:
+        yield
+        return
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+def _timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start
+
+def run_size(size, server_options, max_workers=8, batch_size=1, stream=False, prompt_layout="legacy",
+             workdir=None, verbose=False):
+    """
+    Benchmarks one synthetic tree size.
+
+    Returns:
+        List[dict]: One row per benchmark ("classification", "compare",
+        "evaluate") with its timings.
+    """
+    prompt_path = os.path.abspath("prompt.txt")
+    with tempfile.TemporaryDirectory(dir=workdir) as root:
+        tree = generate_tree(root, size, prompt_path=prompt_path)
+        base_dir = tree["base_dir"]
+        with quiet(verbose):
+            merge_classified_and_unclassified(base_dir)
+
+        rows = []
+        previous_dir = os.getcwd()
+        # prompt.txt and lookup_dictionaries.json are read from the working directory
+        os.chdir(root)
+        try:
+            with StubLMServer(answer_fn=synthetic_answer(tree["codes"]), models=[MODEL_NAME],
+                              **server_options) as server, \
+                    LMStudioClient(server.url, pool_size=max_workers, backoff_base=0.05,
+                                   backoff_max=0.5, stream=stream) as client:
+                before = client.telemetry.snapshot()
+                segments = 0
+                start = time.perf_counter()
+                with quiet(verbose):
+                    for keyword in tree["keywords"]:
+                        summary = classification(
+                            base_dir, keyword, MODEL_NAME, max_workers=max_workers, client=client,
+                            batch_size=batch_size, prompt_layout=prompt_layout
+                        )
+                        segments += summary["total"]
+                seconds = time.perf_counter() - start
+
+                latency = client.telemetry.histogram("request_seconds", since=before)
+                rows.append({
+                    "benchmark": "classification",
+                    "size": size,
+                    "segments": segments,
+                    "seconds": seconds,
+                    "segments_per_sec": segments / seconds,
+                    "requests": client.telemetry.count("requests_total", since=before, status="ok"),
+                    "retries": client.telemetry.count("requests_total", since=before, status="retry"),
+                    "errors": client.telemetry.count("requests_total", since=before, status="error"),
+                    "latency_p50_ms": latency.quantile(0.5) * 1000 if latency else None,
+                    "latency_p95_ms": latency.quantile(0.95) * 1000 if latency else None,
+                    "server_peak_concurrency": server.peak_active,
+                })
+
+            with quiet(verbose):
+                rows.append({"benchmark": "compare", "size": size, "segments": segments,
+                             "seconds": _timed(compare_all_keywords_for_models, base_dir, [MODEL_NAME])})
+            with quiet(verbose):
+                rows.append({"benchmark": "evaluate", "size": size, "segments": segments,
+                             "seconds": _timed(generate_model_comparisons, [MODEL_NAME], base_dir,
+                                               os.path.join(root, "evaluation"))})
+            if importlib.util.find_spec("matplotlib_venn") is None:
+                print(f"⚠️ [{size}] Skipping generate_model_venn_diagrams: matplotlib_venn is not installed")
+            else:
+                with quiet(verbose):
+                    rows.append({"benchmark": "venn", "size": size, "segments": segments,
+                                 "seconds": _timed(generate_model_venn_diagrams, [MODEL_NAME], base_dir,
+                                                   os.path.join(root, "evaluation"))})
+        finally:
+            os.chdir(previous_dir)
+    return rows
+
+def run(sizes=("small",), max_workers=8, batch_size=1, stream=False, prompt_layout="legacy",
+        latency_ms=20.0, latency_sigma=0.5, prefill_ms_per_token=0.02, decode_ms_per_token=1.0,
+        error_rate=0.0, max_concurrency=4, seed=0, workdir=None, verbose=False):
+    """
+    Runs the benchmark for every size and returns the results with run metadata.
+
+    Returns:
+        dict: `meta` (commit, time, Python, settings) and `results` (rows of `run_size`).
+    """
+    server_options = {
+        "latency_ms": latency_ms, "latency_sigma": latency_sigma,
+        "prefill_ms_per_token": prefill_ms_per_token, "decode_ms_per_token": decode_ms_per_token,
+        "error_rate": error_rate, "max_concurrency": max_concurrency, "seed": seed,
+    }
+    rows = []
+    for size in sizes:
+        print(f"⏱️ Benchmarking '{size}' ({SIZES[size]})")
+        rows.extend(run_size(size, server_options, max_workers, batch_size, stream, prompt_layout,
+                             workdir, verbose))
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "settings": {"sizes": list(sizes), "max_workers": max_workers, "batch_size": batch_size,
+                         "stream": stream, "prompt_layout": prompt_layout, **server_options},
+        },
+        "results": rows,
+    }
+
+def save_results(run_result, results_dir=RESULTS_DIR):
+    os.makedirs(results_dir, exist_ok=True)
+    stamp = run_result["meta"]["time"].replace(":", "").replace("-", "")
+    path = os.path.join(results_dir, f"{stamp}_{run_result['meta']['commit']}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(run_result, f, indent=2)
+    return path
+
+def compare_results(baseline, current):
+    """
+    Lines up two runs by (benchmark, size).
+
+    Returns:
+        pd.DataFrame: Baseline and current seconds and segments/sec, with the
+        change in percent (positive = slower for seconds, faster for segments/sec).
+    """
+    def frame(run_result):
+        return pd.DataFrame(run_result["results"]).set_index(["benchmark", "size"])
+
+    base, cur = frame(baseline), frame(current)
+    metrics = [m for m in ("seconds", "segments_per_sec", "latency_p95_ms") if m in cur.columns]
+    table = base[metrics].join(cur[metrics], lsuffix="_base", rsuffix="_now", how="inner")
+    for metric in metrics:
+        table[f"{metric}_change_%"] = (table[f"{metric}_now"] / table[f"{metric}_base"] - 1) * 100
+    return table.round(2)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=["small"], help="Tree sizes to run")
+    parser.add_argument("--workers", type=int, default=8, help="Concurrent requests (max_workers)")
+    parser.add_argument("--batch-size", type=int, default=1, help="Segments per request")
+    parser.add_argument("--stream", action="store_true", help="Stream answers")
+    parser.add_argument("--layout", default="legacy", help="Prompt layout")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Median per-request overhead")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="Log-normal shape of the overhead")
+    parser.add_argument("--prefill-ms", type=float, default=0.02, help="Simulated prefill ms per uncached token")
+    parser.add_argument("--decode-ms", type=float, default=1.0, help="Simulated ms per generated token")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests that fail with 503")
+    parser.add_argument("--max-concurrency", type=int, default=4, help="Parallel generation slots of the stub")
+    parser.add_argument("--baseline", help="Earlier results JSON to compare against")
+    parser.add_argument("--no-save", action="store_true", help="Do not write the results file")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline's progress output")
+    args = parser.parse_args()
+
+    run_result = run(
+        args.sizes, args.workers, args.batch_size, args.stream, args.layout, args.latency_ms,
+        args.latency_sigma, args.prefill_ms, args.decode_ms, args.error_rate, args.max_concurrency,
+        verbose=args.verbose
+    )
+    print(pd.DataFrame(run_result["results"]).set_index(["benchmark", "size"]).round(2).to_string())
+    if not args.no_save:
+        print(f"💾 Results saved to {save_results(run_result)}")
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"\n📊 Against {baseline['meta']['commit']} ({baseline['meta']['time']}):")
+        print(compare_results(baseline, run_result).to_string())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Time-to-first-token for each prompt layout against a local stand-in server.
+
+Usage (from the repository root):
+    python -m benchmarks.prefix_cache --codes 150 --segments 40
+
+The stub simulates prefill cost for every prompt token not covered by its KV
+prefix cache, so the layouts differ only in how much of each prompt has to be
+prefilled again for every segment.
+"""
+import time
+import random
+import argparse
+import statistics
+import requests
+import pandas as pd
+from utils.prompt import KeywordPrompt, PROMPT_LAYOUTS, get_guidance_table, load_prompt
+from classifier.lm_interface import chat_endpoint
+from benchmarks.stub_server import StubLMServer
+from benchmarks.synthetic_tree import WORDS, synthetic_guidance
+
+def synthetic_segments(n_segments, seed=1):
+    rng = random.Random(seed)
+    return [(1000 + i, " ".join(rng.choices(WORDS, k=40))) for i in range(n_segments)]
+
+def time_to_first_token(session, server_url, prompt, model_name="stub-model"):
+    if isinstance(prompt, str):
+        url, body = server_url, {"prompt": prompt}
+    else:
+        url, body = chat_endpoint(server_url), {"messages": prompt}
+    start = time.perf_counter()
+    with session.post(url, json={"model": model_name, "stream": True, **body}, stream=True) as response:
+        for line in response.iter_lines():
+            if line.startswith(b"data:"):
+                return time.perf_counter() - start
+    return time.perf_counter() - start
+
+def run(n_codes=150, n_segments=40, prefill_ms_per_token=0.5, instruction_path="prompt.txt"):
+    guidance_string = get_guidance_table(synthetic_guidance(n_codes))
+    instruction_text = load_prompt(instruction_path)
+    segments = synthetic_segments(n_segments)
+
+    rows = []
+    for layout in PROMPT_LAYOUTS:
+        keyword_prompt = KeywordPrompt(guidance_string, instruction_text, layout)
+        # A fresh server per layout so no layout benefits from another's cache
+        with StubLMServer(prefill_ms_per_token=prefill_ms_per_token) as server, requests.Session() as session:
+            ttfts = [
+                time_to_first_token(session, server.url, keyword_prompt.single(segment_id, text))
+                for segment_id, text in segments
+            ]
+        # The first request always pays the full prefill; report it separately
+        warm = ttfts[1:] or ttfts
+        rows.append({
+            "layout": layout,
+            "cold_ttft_ms": ttfts[0] * 1000,
+            "mean_ttft_ms": statistics.mean(warm) * 1000,
+            "p95_ttft_ms": sorted(warm)[int(0.95 * (len(warm) - 1))] * 1000,
+        })
+    return pd.DataFrame(rows).set_index("layout").round(1)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--codes", type=int, default=150, help="Guidance rows in the synthetic keyword")
+    parser.add_argument("--segments", type=int, default=40, help="Segments classified per layout")
+    parser.add_argument("--prefill-ms", type=float, default=0.5, help="Simulated prefill ms per uncached token")
+    args = parser.parse_args()
+
+    print(run(args.codes, args.segments, args.prefill_ms))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+import re
+import json
+import time
+import zlib
+import random
+import threading
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Same rough ratio the classifier uses to size batches
+CHARS_PER_TOKEN = 4
+
+def default_answer(prompt_text):
+    """Answers like a well-behaved model: a JSON object for batched prompts, a list otherwise."""
+    if "JSON object" in prompt_text:
+        segment_ids = re.findall(r"Segment ID: (\S+)", prompt_text)
+        return json.dumps({segment_id: ["A"] for segment_id in segment_ids})
+    return '["A"]'
+
+def hashed_embedding(text, dim=64):
+    """Deterministic bag-of-words embedding: each word adds 1 to a hashed dimension."""
+    vector = [0.0] * dim
+    for word in re.findall(r"[a-z0-9]+", text.lower()):
+        vector[zlib.crc32(word.encode("utf-8")) % dim] += 1.0
+    return vector
+
+def common_prefix_length(a, b):
+    # Binary search on slice equality keeps the comparison in C
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        mid = (low + high + 1) // 2
+        if a[:mid] == b[:mid]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+class StubLMServer:
+    """
+    Local stand-in for an OpenAI-compatible LM Studio server.
+
+    Serves /v1/completions, /v1/chat/completions, /v1/embeddings (hashed
+    bag-of-words vectors, so similar texts get similar vectors) and
+    /v1/models. Latency is simulated as prefill time for every prompt token
+    that is not covered by the server's KV prefix cache, plus a fixed delay
+    per generated token.
+    The prefix cache remembers the last `prefix_cache_slots` prompts and
+    reuses the longest common prefix, like llama.cpp's slot cache.
+    Each generation request also waits a random overhead drawn from a
+    log-normal distribution, fails with `error_status` at `error_rate`, and
+    at most `max_concurrency` requests generate at once; the rest queue, as
+    on a server with that many parallel slots.
+
+    Args:
+        port (int): Port to bind; 0 picks a free one.
+        prefill_ms_per_token (float): Simulated prefill cost per uncached token.
+        decode_ms_per_token (float): Simulated cost per generated token.
+        prefix_cache_slots (int): Number of prompts kept for prefix reuse (0 disables it).
+        answer_fn (Callable[[str], str]): Produces the response text for a prompt.
+        models (List[str]): Model IDs reported by /v1/models.
+        latency_ms (float): Median of the per-request overhead.
+        latency_sigma (float): Log-normal shape of the overhead; 0 makes it
+            fixed, 1 gives a heavy tail (p95 about 5x the median).
+        error_rate (float): Share of generation requests that fail.
+        error_status (int): HTTP status of the simulated failures.
+        max_concurrency (int, optional): Requests generating at once.
+        seed (int): Seed for latency and error draws.
+    """
+
+    def __init__(self, port=0, prefill_ms_per_token=0.5, decode_ms_per_token=5.0,
+                 prefix_cache_slots=4, answer_fn=default_answer, models=("stub-model",),
+                 latency_ms=0.0, latency_sigma=0.0, error_rate=0.0, error_status=503,
+                 max_concurrency=None, seed=0):
+        self.prefill_ms_per_token = prefill_ms_per_token
+        self.decode_ms_per_token = decode_ms_per_token
+        self.answer_fn = answer_fn
+        self.models = list(models)
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.request_count = 0
+        self.error_count = 0
+        self.active = 0
+        self.peak_active = 0
+        self._rng = random.Random(seed)
+        self._generation_slots = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        self._slots = deque(maxlen=prefix_cache_slots) if prefix_cache_slots else None
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/v1/completions"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def uncached_tokens(self, prompt_text):
+        """Returns how many prompt tokens need prefill, and records the prompt in the cache."""
+        with self._lock:
+            self.request_count += 1
+            if self._slots is None:
+                return len(prompt_text) // CHARS_PER_TOKEN + 1
+            reused = max((common_prefix_length(cached, prompt_text) for cached in self._slots), default=0)
+            self._slots.append(prompt_text)
+        return (len(prompt_text) - reused) // CHARS_PER_TOKEN + 1
+
+    def draw_overhead(self):
+        """Returns (seconds of overhead, whether the request fails) for one request."""
+        with self._lock:
+            seconds = 0.0
+            if self.latency_ms:
+                seconds = self.latency_ms / 1000 * self._rng.lognormvariate(0, self.latency_sigma)
+            failed = self._rng.random() < self.error_rate
+            if failed:
+                self.error_count += 1
+        return seconds, failed
+
+    def _generation(self):
+        server = self
+
+        class Generation:
+            # Holds one of the server's parallel slots and tracks how many are busy
+            def __enter__(self):
+                if server._generation_slots is not None:
+                    server._generation_slots.acquire()
+                with server._lock:
+                    server.active += 1
+                    server.peak_active = max(server.peak_active, server.active)
+
+            def __exit__(self, *exc_info):
+                with server._lock:
+                    server.active -= 1
+                if server._generation_slots is not None:
+                    server._generation_slots.release()
+
+        return Generation()
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def handle(self):
+                try:
+                    super().handle()
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client closed the connection (a cancelled stream, or a
+                    # pooled keep-alive connection dropped after an error)
+                    self.close_connection = True
+
+            def _send_json(self, status, body):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path.rstrip("/").endswith("/v1/models"):
+                    self._send_json(200, {"data": [{"id": model} for model in server.models]})
+                else:
+                    self._send_json(404, {"error": "not found"})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length))
+                if self.path.rstrip("/").endswith("/embeddings"):
+                    inputs = request.get("input", [])
+                    inputs = [inputs] if isinstance(inputs, str) else inputs
+                    with server._lock:
+                        server.request_count += 1
+                    data = [
+                        {"object": "embedding", "index": i, "embedding": hashed_embedding(text)}
+                        for i, text in enumerate(inputs)
+                    ]
+                    self._send_json(200, {"data": data, "model": request.get("model")})
+                    return
+                is_chat = self.path.rstrip("/").endswith("/chat/completions")
+                if is_chat:
+                    # Flatten messages the way a chat template would
+                    prompt_text = "".join(
+                        f"<|{m['role']}|>\n{m['content']}\n" for m in request.get("messages", [])
+                    )
+                else:
+                    prompt_text = request.get("prompt", "")
+
+                overhead, failed = server.draw_overhead()
+                time.sleep(overhead)
+                if failed:
+                    self._send_json(server.error_status, {"error": "simulated failure"})
+                    return
+
+                with server._generation():
+                    time.sleep(server.uncached_tokens(prompt_text) * server.prefill_ms_per_token / 1000)
+                    answer = server.answer_fn(prompt_text)
+                    tokens = [answer[i:i + CHARS_PER_TOKEN] for i in range(0, len(answer), CHARS_PER_TOKEN)]
+                    usage = {
+                        "prompt_tokens": len(prompt_text) // CHARS_PER_TOKEN + 1,
+                        "completion_tokens": len(tokens),
+                    }
+
+                    if request.get("stream"):
+                        self._stream(tokens, is_chat, usage)
+                        return
+
+                    time.sleep(len(tokens) * server.decode_ms_per_token / 1000)
+                choice = {"message": {"role": "assistant", "content": answer}} if is_chat else {"text": answer}
+                choice["finish_reason"] = "stop"
+                self._send_json(200, {"choices": [choice], "usage": usage})
+
+            def _stream(self, tokens, is_chat, usage):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                try:
+                    for token in tokens:
+                        choice = {"delta": {"content": token}} if is_chat else {"text": token}
+                        self.wfile.write(f"data: {json.dumps({'choices': [choice]})}\n\n".encode("utf-8"))
+                        self.wfile.flush()
+                        time.sleep(server.decode_ms_per_token / 1000)
+                    final = {"choices": [{"finish_reason": "stop"}], "usage": usage}
+                    self.wfile.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # Client cancelled the generation
+
+        return Handler
@@ -0,0 +1,139 @@
+"""
+Synthetic categories trees for offline benchmarks.
+
+Usage (from the repository root):
+    python -m benchmarks.synthetic_tree /tmp/bench --size medium
+
+Writes `<root>/categories/<keyword>/` folders with `_classified.csv`,
+`_unclassified.csv` and `_guidance.csv` files, plus `lookup_dictionaries.json`
+and `prompt.txt` in `<root>`, so the pipeline can run from `<root>` exactly as
+it does from the repository. Every segment's true codes are a deterministic
+function of its ID (`true_codes`), and `synthetic_answer` answers like a model
+that gets most of them right, so comparisons produce realistic TP/FP/FN mixes.
+"""
+import os
+import re
+import json
+import zlib
+import random
+import shutil
+import argparse
+import pandas as pd
+
+WORDS = "peace ceasefire election land reform police justice refugees women power sharing".split()
+# keywords, segments per keyword, guidance codes per keyword
+SIZES = {
+    "small": {"keywords": 2, "segments": 200, "codes": 30},
+    "medium": {"keywords": 4, "segments": 2_000, "codes": 80},
+    "large": {"keywords": 8, "segments": 20_000, "codes": 150},
+}
+LABELLED_FRACTION = 0.5
+MAX_CODES_PER_SEGMENT = 3
+
+def synthetic_guidance(n_codes, seed=0):
+    rng = random.Random(seed)
+    return pd.DataFrame({
+        "Code": [f"Code{i}" for i in range(n_codes)],
+        "Descriptor": [" ".join(rng.choices(WORDS, k=6)) for _ in range(n_codes)],
+        "Include": [" ".join(rng.choices(WORDS, k=10)) for _ in range(n_codes)],
+        "Exclude": [" ".join(rng.choices(WORDS, k=8)) if i % 3 else None for i in range(n_codes)],
+    })
+
+def true_codes(segment_id, n_codes):
+    """The codes a perfect model would give a segment (0 to 3 of them)."""
+    rng = random.Random(zlib.crc32(str(segment_id).encode("utf-8")))
+    k = rng.randint(0, min(MAX_CODES_PER_SEGMENT, n_codes))
+    return [f"Code{i}" for i in sorted(rng.sample(range(n_codes), k))]
+
+def synthetic_answer(n_codes, accuracy=0.8):
+    """
+    Returns a stub `answer_fn` that keeps each true code with probability
+    `accuracy` and otherwise swaps it for a wrong one, deterministically per
+    segment. Batched prompts get a JSON object keyed by Segment ID.
+    """
+    def noisy_codes(segment_id):
+        rng = random.Random(zlib.crc32(f"answer:{segment_id}".encode("utf-8")))
+        return [
+            code if rng.random() < accuracy else f"Code{rng.randrange(n_codes)}"
+            for code in true_codes(segment_id, n_codes)
+        ]
+
+    def answer(prompt_text):
+        segment_ids = re.findall(r"Segment ID: (\S+)", prompt_text)
+        if "JSON object" in prompt_text:
+            return json.dumps({segment_id: noisy_codes(segment_id) for segment_id in segment_ids})
+        # Few-shot examples come first; the segment to classify is the last one
+        return json.dumps(noisy_codes(segment_ids[-1]) if segment_ids else [])
+
+    return answer
+
+def generate_tree(root, size="small", seed=0, prompt_path="prompt.txt"):
+    """
+    Writes a synthetic categories tree under `root`.
+
+    Args:
+        root (str): Folder to create; `categories/`, the lookup JSON and
+            `prompt.txt` are written inside it.
+        size (str or dict): A key of SIZES, or a dict with `keywords`,
+            `segments` and `codes`.
+        seed (int): Seed for texts and guidance.
+        prompt_path (str): Instruction text copied into the tree.
+
+    Returns:
+        dict: `base_dir` (the categories folder), `keywords`, `segments`
+        (per keyword) and `codes` (per keyword).
+    """
+    spec = SIZES[size] if isinstance(size, str) else size
+    n_keywords, n_segments, n_codes = spec["keywords"], spec["segments"], spec["codes"]
+    base_dir = os.path.join(root, "categories")
+    os.makedirs(base_dir, exist_ok=True)
+    rng = random.Random(seed)
+
+    lookup = {"translation": {f"Code{i}": f"Label {i}" for i in range(n_codes)}}
+    with open(os.path.join(root, "lookup_dictionaries.json"), "w", encoding="utf-8") as f:
+        json.dump(lookup, f, indent=2)
+    shutil.copyfile(prompt_path, os.path.join(root, "prompt.txt"))
+
+    keywords = [f"kw{i:02d}" for i in range(n_keywords)]
+    for k, keyword in enumerate(keywords):
+        folder = os.path.join(base_dir, keyword)
+        os.makedirs(folder, exist_ok=True)
+        guidance = synthetic_guidance(n_codes, seed=seed + k)
+        guidance.to_csv(os.path.join(folder, f"{keyword}_guidance.csv"), index=False)
+        descriptors = dict(zip(guidance["Code"], guidance["Descriptor"]))
+
+        segment_ids = [(k + 1) * 10_000_000 + i for i in range(n_segments)]
+        codes = [true_codes(segment_id, n_codes) for segment_id in segment_ids]
+        # Texts mention their codes' descriptors so retrieval has something to find
+        texts = [
+            " ".join(rng.choices(WORDS, k=20) + [descriptors[code] for code in segment_codes])
+            for segment_codes in codes
+        ]
+        labels = [str([lookup["translation"][code] for code in segment_codes]) for segment_codes in codes]
+
+        n_labelled = int(n_segments * LABELLED_FRACTION)
+        pd.DataFrame({
+            "segment_id": segment_ids[:n_labelled],
+            "segment_text": texts[:n_labelled],
+            "auto_issues": labels[:n_labelled],
+        }).to_csv(os.path.join(folder, f"{keyword}_classified.csv"), index=False)
+        pd.DataFrame({
+            "segment_id": segment_ids[n_labelled:],
+            "segment_text": texts[n_labelled:],
+            "issues": labels[n_labelled:],
+        }).to_csv(os.path.join(folder, f"{keyword}_unclassified.csv"), index=False)
+
+    return {"base_dir": base_dir, "keywords": keywords, "segments": n_segments, "codes": n_codes}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("root", help="Folder to write the tree into")
+    parser.add_argument("--size", choices=list(SIZES), default="small", help="Preset tree size")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for texts and guidance")
+    args = parser.parse_args()
+    tree = generate_tree(args.root, args.size, args.seed)
+    print(f"🌱 Wrote {len(tree['keywords'])} keywords x {tree['segments']} segments "
+          f"({tree['codes']} codes) to {tree['base_dir']}")
+
+if __name__ == "__main__":
+    main()
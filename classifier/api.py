@@ -0,0 +1,272 @@
+"""
+Library API for classifying segments that do not live in a categories tree.
+
+`classification()` reads a keyword's table and writes a CSV; `SegmentClassifier`
+instead takes any iterable (or async iterable) of (segment_id, segment_text)
+pairs and yields the answers, so another service can embed the classifier
+without writing temporary folders. It runs the same engine as the CSV path
+(`classify_segments`), with the same prompts, batching, dedup and parsing.
+
+Usage:
+    with SegmentClassifier(guidance_df, "model-name") as classifier:
+        for segment_id, segment_text, codes in classifier.classify(pairs):
+            ...
+
+    async for segment_id, segment_text, codes in classifier.aclassify(async_pairs):
+        ...
+"""
+import queue
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from utils.prompt import KeywordPrompt, get_guidance_table, load_prompt
+from classifier.lm_interface import LMStudioClient
+from classifier.pipeline import classify_segments
+from classifier.retrieval import GuidanceRetriever
+from classifier.dedup import DedupStats
+from classifier.utils import ParseStats
+
+_DONE = object()
+# How often a thread blocked on the read-ahead queue checks for cancellation
+_POLL_SECONDS = 0.1
+
+class _AsyncSource:
+    """
+    Iterates an async iterator from a worker thread by running each
+    `__anext__` on the event loop. `cancel` stops it, including a fetch
+    that is still waiting on the source.
+    """
+
+    def __init__(self, aiterator, loop):
+        self.aiterator = aiterator
+        self.loop = loop
+        self.stopped = threading.Event()
+        self.fetch = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.stopped.is_set():
+            raise StopIteration
+        self.fetch = asyncio.run_coroutine_threadsafe(self.aiterator.__anext__(), self.loop)
+        try:
+            return self.fetch.result()
+        except StopAsyncIteration:
+            raise StopIteration from None
+
+    def cancel(self):
+        self.stopped.set()
+        if self.fetch is not None:
+            self.fetch.cancel()
+
+class _Prefetch:
+    """
+    Reads a source on a daemon thread into a bounded queue.
+
+    The engine only reads segments that have already arrived (`ready`), so a
+    source that trickles in never holds back finished answers, and the
+    queue's bound pauses the reader while the model is behind.
+    """
+
+    def __init__(self, segments, maxsize):
+        self.queue = queue.Queue(maxsize)
+        self.stopped = threading.Event()
+        self.cancel_source = getattr(segments, "cancel", None)
+        # Started by the first read, so a generator that is never iterated reads nothing
+        self.thread = threading.Thread(target=self._read, args=(segments,), daemon=True,
+                                       name="classify-reader")
+
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=_POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _read(self, segments):
+        try:
+            for segment in segments:
+                if not self._put(segment):
+                    return
+        except BaseException as e:
+            if not self.stopped.is_set():
+                self._put(e)
+            return
+        self._put(_DONE)
+
+    def ready(self):
+        return not self.queue.empty()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.thread.ident is None:
+            self.thread.start()
+        while True:
+            try:
+                item = self.queue.get(timeout=_POLL_SECONDS)
+                break
+            except queue.Empty:
+                if self.stopped.is_set():
+                    raise StopIteration from None
+        if item is _DONE:
+            self.queue.put(_DONE)
+            raise StopIteration
+        if isinstance(item, BaseException):
+            raise item
+        return item
+
+    def stop(self):
+        self.stopped.set()
+        if self.cancel_source is not None:
+            self.cancel_source()
+
+class SegmentClassifier:
+    """
+    Classifies segments from any source against one guidance table and model.
+
+    The `KeywordPrompt`, the optional `GuidanceRetriever`, the client and the
+    request pool are built once here and reused by every `classify` and
+    `aclassify` call, so calls only pay for their segments. Calls running at
+    the same time share the pool, so at most `max_workers` requests are in
+    flight across all of them.
+
+    Each call reads its input on a background thread into a bounded queue, so
+    a slow model pauses the reading of the source instead of buffering it
+    (backpressure), and a slow source never holds back answers that are
+    already in. Stopping early (`close()` on the generator, breaking out of the loop or
+    cancelling the async task) cancels the segments that have not been sent.
+
+    Args:
+        guidance_df (pd.DataFrame): Guidance table with `Code`, `Descriptor`,
+            `Include` and `Exclude` columns.
+        model_name (str): Name of the model loaded in LM Studio.
+        instruction_text (str, optional): Instruction text; read from
+            `instruction_path` when omitted.
+        instruction_path (str): Instruction file used when `instruction_text` is omitted.
+        prompt_layout (str): "legacy", "prefix" or "chat" (see `KeywordPrompt`).
+        client (LMStudioClient, optional): Shared client; a new one is created
+            (and closed by `close`) when omitted.
+        max_workers (int): Maximum number of concurrent requests.
+        batch_size (int): Segments packed into each request.
+        dedup (bool): Send each unique normalized text once per call.
+        structured (bool): Restrict answers to the guidance codes.
+        top_k_codes (int, optional): Only send each batch's top-K candidate
+            guidance rows (see `GuidanceRetriever`).
+        retrieval_method (str): "bm25", "embedding" or "hybrid".
+        embedding_model (str, optional): Embedding model for the embedding
+            retrieval methods.
+        retrieval_cache_dir (str, optional): Where guidance embeddings are cached.
+    """
+
+    def __init__(self, guidance_df, model_name, instruction_text=None, instruction_path="prompt.txt",
+                 prompt_layout="legacy", client=None, max_workers=4, batch_size=1, dedup=True,
+                 structured=False, top_k_codes=None, retrieval_method="bm25", embedding_model=None,
+                 retrieval_cache_dir=None):
+        if not isinstance(batch_size, int) or batch_size < 1:
+            raise ValueError("batch_size must be a positive integer")
+        if instruction_text is None:
+            instruction_text = load_prompt(instruction_path)
+
+        self.model_name = model_name
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        self.dedup = dedup
+        self.structured = structured
+        self.keyword_prompt = KeywordPrompt(
+            get_guidance_table(guidance_df), instruction_text, prompt_layout,
+            codes=guidance_df['Code'].dropna().astype(str)
+        )
+        self.owns_client = client is None
+        self.client = client if client is not None else LMStudioClient(pool_size=max_workers)
+        self.retriever = None
+        if top_k_codes:
+            self.retriever = GuidanceRetriever(
+                guidance_df, top_k=top_k_codes, method=retrieval_method, client=self.client,
+                embedding_model=embedding_model, cache_dir=retrieval_cache_dir
+            )
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="classify")
+        # Cumulative over every call
+        self.dedup_stats = DedupStats()
+        self.parse_stats = ParseStats()
+
+    def classify(self, segments, ordered=False):
+        """
+        Classifies (segment_id, segment_text) pairs as they are read from `segments`.
+
+        Args:
+            segments (Iterable[Tuple]): Pairs to classify; consumed lazily.
+            ordered (bool): Yield in input order instead of as results complete.
+
+        Yields:
+            Tuple: (segment_id, segment_text, response) where response is a
+            list of codes or "ERROR".
+        """
+        return self._run(self._prefetch(segments), ordered)
+
+    def _prefetch(self, segments):
+        # Same bound as the engine's read-ahead window
+        return _Prefetch(segments, self.max_workers * 4 * self.batch_size)
+
+    def _run(self, source, ordered):
+        try:
+            yield from classify_segments(
+                source, self.model_name, self.keyword_prompt, self.client, self.executor,
+                max_workers=self.max_workers, batch_size=self.batch_size, dedup=self.dedup,
+                dedup_stats=self.dedup_stats, structured=self.structured, parse_stats=self.parse_stats,
+                retriever=self.retriever, ordered=ordered
+            )
+        finally:
+            source.stop()
+
+    async def aclassify(self, segments, ordered=False):
+        """
+        Async version of `classify`; `segments` may be an iterable or an async iterable.
+
+        The engine runs on a worker thread, so the event loop is never blocked
+        on a request. Cancelling the consuming task stops reading `segments`
+        and cancels every segment that has not been sent yet.
+
+        Yields:
+            Tuple: (segment_id, segment_text, response), as in `classify`.
+        """
+        loop = asyncio.get_running_loop()
+        if hasattr(segments, "__aiter__"):
+            segments = _AsyncSource(segments.__aiter__(), loop)
+        source = self._prefetch(segments)
+        results = self._run(source, ordered)
+        # One thread per call, so the generator is always resumed from the same thread
+        driver = ThreadPoolExecutor(max_workers=1, thread_name_prefix="classify-driver")
+        try:
+            while True:
+                result = await loop.run_in_executor(driver, next, results, _DONE)
+                if result is _DONE:
+                    return
+                yield result
+        finally:
+            # Stop reading first, so a `next` waiting on the source returns
+            source.stop()
+            # Runs once any `next` still in progress returns
+            driver.submit(results.close)
+            driver.shutdown(wait=False)
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        if self.owns_client:
+            self.client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
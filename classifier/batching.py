@@ -0,0 +1,160 @@
+import json
+import requests
+from classifier.utils import extract_batch_from_response, parse_code_list
+
+# Rough tokens-per-character ratio for English text with most tokenizers
+CHARS_PER_TOKEN = 4
+# Output budget per segment in a batched answer: `"<id>": [...codes...], `
+OUTPUT_TOKENS_PER_SEGMENT = 32
+# Retry budget for an unparseable single answer when the keyword's codes are unknown
+RETRY_MAX_TOKENS = 256
+
+def answer_token_cap(codes, slack_tokens=16):
+    """
+    Upper bound on the tokens a single-segment answer needs: the JSON list of
+    every valid code, plus some slack for whitespace and tokenizer variance.
+    """
+    return len(json.dumps(list(codes))) // CHARS_PER_TOKEN + slack_tokens
+
+def estimate_tokens(prompt):
+    """Estimates the token count of a prompt string or list of chat messages."""
+    if not isinstance(prompt, str):
+        prompt = "".join(message["content"] for message in prompt)
+    return len(prompt) // CHARS_PER_TOKEN + 1
+
+def auto_batch_size(keyword_prompt, avg_segment_chars, context_tokens=8192, max_batch_size=32):
+    """
+    Picks how many segments fit in one request within a context-length budget.
+
+    Args:
+        keyword_prompt (KeywordPrompt): Prepared prompt for the keyword.
+        avg_segment_chars (float): Average length of the segment texts.
+        context_tokens (int): Context window of the loaded model.
+        max_batch_size (int): Upper bound on the batch size.
+
+    Returns:
+        int: Batch size of at least 1.
+    """
+    prefix_tokens = estimate_tokens(keyword_prompt.batch([]))
+    per_segment = avg_segment_chars / CHARS_PER_TOKEN + 16 + OUTPUT_TOKENS_PER_SEGMENT
+    available = context_tokens - prefix_tokens
+    return max(1, min(max_batch_size, int(available // per_segment)))
+
+def classify_single(segment_id, segment_text, model_name, keyword_prompt, client,
+                    structured=False, parse_stats=None, examples=None):
+    """
+    Classifies one segment, retrying once if the answer cannot be parsed.
+
+    The retry drops the newline stop sequence and doubles the token budget,
+    which recovers answers that start with a blank line or were cut off.
+    When the client streams, the first attempt is capped at
+    `answer_token_cap` tokens for the keyword's codes.
+
+    Args:
+        segment_id: Segment ID.
+        segment_text (str): Segment text.
+        model_name (str): Model to run.
+        keyword_prompt (KeywordPrompt): Prepared prompt for the keyword.
+        client (LMStudioClient): Shared client.
+        structured (bool): Constrain the answer to the keyword's codes with
+            `response_format` and drop any code that is not valid.
+        parse_stats (ParseStats, optional): Counters for retries and invalid codes.
+        examples (List[Tuple], optional): (text, codes) few-shot examples.
+
+    Returns:
+        List[str] or "ERROR"
+    """
+    prompt = keyword_prompt.single(segment_id, segment_text, examples)
+    valid_codes = keyword_prompt.valid_codes or None
+    cap = answer_token_cap(keyword_prompt.codes) if keyword_prompt.codes else None
+    attempts = [
+        {"stop": ("\n", "</s>"), "max_tokens": cap if client.stream else None},
+        {"stop": ("</s>",), "max_tokens": 2 * cap if cap else RETRY_MAX_TOKENS},
+    ]
+    response_format = keyword_prompt.response_format() if structured and keyword_prompt.codes else None
+
+    for attempt, options in enumerate(attempts):
+        try:
+            response = client.complete(prompt, model_name, response_format=response_format, **options)
+        except requests.exceptions.RequestException as e:
+            print("❌ Request error:", e)
+            return "ERROR"
+        codes, invalid = parse_code_list(response, valid_codes, strict=structured)
+        if codes is not None:
+            if parse_stats is not None:
+                parse_stats.record(invalid, retried=attempt > 0)
+            return codes
+
+    if parse_stats is not None:
+        parse_stats.record(retried=True, unparseable=True)
+    print(f"⚠️ Unparseable answer for Segment ID {segment_id}: {response[:80]!r}")
+    return "ERROR"
+
+def classify_batch(batch, model_name, keyword_prompt, client, structured=False, parse_stats=None,
+                   retriever=None, shortcut=None):
+    """
+    Classifies a batch of segments with a single request.
+
+    Segments the model leaves out, or answers with something that is not a
+    list of codes, are retried one by one with `classify_single`.
+
+    Args:
+        batch (List[Tuple]): (segment_id, segment_text) pairs.
+        model_name (str): Model to run.
+        keyword_prompt (KeywordPrompt): Prepared prompt for the keyword.
+        client (LMStudioClient): Shared client.
+        structured (bool): Constrain answers to the keyword's codes with
+            `response_format` and drop any code that is not valid.
+        parse_stats (ParseStats, optional): Counters for retries and invalid codes.
+        retriever (GuidanceRetriever, optional): Narrows the guidance table to
+            the batch's candidate codes.
+        shortcut (NeighbourShortcut, optional): Supplies few-shot examples for
+            single-segment requests.
+
+    Returns:
+        List: One response (list of codes or "ERROR") per segment, in batch order.
+    """
+    if retriever is not None:
+        keyword_prompt = retriever.narrow(keyword_prompt, [segment_text for _, segment_text in batch])
+
+    answers = {}
+    if len(batch) > 1:
+        prompt = keyword_prompt.batch(batch)
+        segment_ids = [segment_id for segment_id, _ in batch]
+        response_format = (
+            keyword_prompt.response_format(segment_ids) if structured and keyword_prompt.codes else None
+        )
+        try:
+            response = client.complete(
+                prompt, model_name,
+                stop=("</s>",),
+                max_tokens=OUTPUT_TOKENS_PER_SEGMENT * len(batch) + 16,
+                response_format=response_format
+            )
+            answers = extract_batch_from_response(response, segment_ids)
+        except requests.exceptions.RequestException as e:
+            print(f"❌ Batch request error, falling back to single segments: {e}")
+
+        valid_codes = keyword_prompt.valid_codes
+        for key, codes in answers.items():
+            invalid = [code for code in codes if code not in valid_codes] if valid_codes else []
+            if structured and invalid:
+                answers[key] = [code for code in codes if code in valid_codes]
+            if parse_stats is not None:
+                parse_stats.record(invalid)
+
+        missing = len(batch) - len(answers)
+        if missing:
+            print(f"↩️ {missing}/{len(batch)} segments missing from batch answer, retrying individually")
+
+    results = []
+    for segment_id, segment_text in batch:
+        codes = answers.get(str(segment_id))
+        if codes is None:
+            codes = classify_single(
+                segment_id, segment_text, model_name, keyword_prompt, client,
+                structured=structured, parse_stats=parse_stats,
+                examples=shortcut.examples(segment_id) if shortcut is not None else None
+            )
+        results.append(codes)
+    return results
@@ -0,0 +1,173 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+# Raw responses keyed by prompt, and parsed answers keyed by dedup key
+TABLES = ("responses", "answers")
+
+class ResponseCache:
+    """
+    Persistent content-addressed cache of raw LM responses, stored in SQLite.
+
+    Entries are keyed by a SHA-256 of (model name, full prompt, sampling
+    params), so a rerun with byte-identical prompts skips the network. The
+    database runs in WAL mode with one connection per thread, which makes it
+    safe to share between worker threads and between concurrent processes.
+
+    Deduplication stores each segment's parsed answer under its dedup key in
+    a separate `answers` table (`get_answer` / `put_answer`) with its own
+    hit/miss counters, so it never double-counts the prompt-level hit rate.
+
+    Args:
+        path (str): Location of the SQLite database file.
+    """
+
+    def __init__(self, path="lm_cache.sqlite"):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.answer_hits = 0
+        self.answer_misses = 0
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+
+        folder = os.path.dirname(os.path.abspath(path))
+        os.makedirs(folder, exist_ok=True)
+        with self._connection() as conn:
+            for table in TABLES:
+                conn.execute(
+                    f"""CREATE TABLE IF NOT EXISTS {table} (
+                        key TEXT PRIMARY KEY,
+                        model TEXT NOT NULL,
+                        response TEXT NOT NULL,
+                        created_at REAL NOT NULL,
+                        accessed_at REAL NOT NULL
+                    )"""
+                )
+                conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_accessed ON {table} (accessed_at)")
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def make_key(model_name, prompt, params=None):
+        """Hashes the model, prompt and sampling params into a cache key."""
+        blob = json.dumps([model_name, prompt, params or {}], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def _get(self, table, key):
+        conn = self._connection()
+        row = conn.execute(f"SELECT response FROM {table} WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        with conn:
+            conn.execute(f"UPDATE {table} SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        return row[0]
+
+    def _put(self, table, key, model_name, response):
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO {table} (key, model, response, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, model_name, response, now, now)
+            )
+
+    def get(self, key):
+        """Returns the cached response text for `key`, or None on a miss."""
+        response = self._get("responses", key)
+        with self._stats_lock:
+            if response is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return response
+
+    def put(self, key, model_name, response):
+        self._put("responses", key, model_name, response)
+
+    def get_answer(self, key):
+        """Returns the stored answer (JSON text) for a dedup key, or None on a miss."""
+        answer = self._get("answers", key)
+        with self._stats_lock:
+            if answer is None:
+                self.answer_misses += 1
+            else:
+                self.answer_hits += 1
+        return answer
+
+    def put_answer(self, key, model_name, answer):
+        self._put("answers", key, model_name, answer)
+
+    def stats(self):
+        """
+        Returns hit/miss counters for this instance plus the size of the store.
+
+        Returns:
+            dict: hits, misses, hit_rate, entries and size_bytes for prompt
+            responses, plus answer_hits, answer_misses, answer_hit_rate and
+            answer_entries for the dedup answers.
+        """
+        conn = self._connection()
+        entries, size = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(response) + LENGTH(key)), 0) FROM responses"
+        ).fetchone()
+        answer_entries, answer_size = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(response) + LENGTH(key)), 0) FROM answers"
+        ).fetchone()
+        lookups = self.hits + self.misses
+        answer_lookups = self.answer_hits + self.answer_misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "answer_hits": self.answer_hits,
+            "answer_misses": self.answer_misses,
+            "answer_hit_rate": self.answer_hits / answer_lookups if answer_lookups else 0.0,
+            "answer_entries": answer_entries,
+            "size_bytes": size + answer_size,
+        }
+
+    def evict(self, max_age=None, max_entries=None):
+        """
+        Removes stale entries from both tables.
+
+        Args:
+            max_age (float, optional): Drop entries not accessed for this many seconds.
+            max_entries (int, optional): Keep only the most recently accessed
+                entries of each table.
+
+        Returns:
+            int: Number of entries removed.
+        """
+        removed = 0
+        with self._connection() as conn:
+            for table in TABLES:
+                if max_age is not None:
+                    cursor = conn.execute(
+                        f"DELETE FROM {table} WHERE accessed_at < ?", (time.time() - max_age,)
+                    )
+                    removed += cursor.rowcount
+                if max_entries is not None:
+                    cursor = conn.execute(
+                        f"DELETE FROM {table} WHERE key NOT IN "
+                        f"(SELECT key FROM {table} ORDER BY accessed_at DESC LIMIT ?)",
+                        (max_entries,)
+                    )
+                    removed += cursor.rowcount
+        return removed
+
+    def clear(self):
+        with self._connection() as conn:
+            for table in TABLES:
+                conn.execute(f"DELETE FROM {table}")
@@ -0,0 +1,223 @@
+import os
+import csv
+import heapq
+import pandas as pd
+from utils.storage import CHUNK_ROWS, TableWriter, iter_table, scan_csv_dtypes
+
+OUTPUT_COLUMNS = ["Segment ID", "Segment Text", "Response"]
+
+def partial_output_path(output_file):
+    """Path of the in-progress file that is renamed to `output_file` when a run completes."""
+    return f"{output_file}.partial"
+
+def finalize_checkpoint(partial_file, output_file, order=None, chunksize=CHUNK_ROWS):
+    """
+    Promotes a finished checkpoint to the final output. CSV outputs are a
+    rename; other formats are streamed through `utils.storage.TableWriter`
+    one chunk at a time, typed as a whole-file read would type them.
+
+    Args:
+        partial_file (str): Finished checkpoint CSV.
+        output_file (str): .csv or .parquet output.
+        order (Iterable, optional): Segment IDs in input order. A resumed run
+            appends the rows it retried after the ones already written, so
+            when given, the rows are first put back in this order (see
+            `sort_checkpoint`).
+        chunksize (int): Rows per chunk when converting.
+    """
+    if order is not None:
+        sort_checkpoint(partial_file, order)
+    if output_file.endswith(".csv"):
+        os.replace(partial_file, output_file)
+        return
+    dtypes = scan_csv_dtypes(partial_file, chunksize)
+    read_dtypes = {col: dtype or "object" for col, dtype in dtypes.items()}
+    with TableWriter(output_file, dtypes=dtypes) as writer:
+        for chunk in iter_table(partial_file, chunksize=chunksize, dtype=read_dtypes):
+            writer.write(chunk)
+        if writer.rows == 0:
+            # A header-only checkpoint still gives a (typed, empty) table
+            writer.write(pd.read_csv(partial_file, dtype=read_dtypes))
+    os.remove(partial_file)
+
+def _records(f):
+    """
+    Reads a checkpoint opened in binary mode one CSV record at a time,
+    yielding (row, raw bytes). csv.reader pulls exactly the lines of one
+    record before yielding it, so the raw bytes always end at a record
+    boundary, even when a quoted Segment Text spans several lines.
+    """
+    raw = []
+
+    def lines():
+        for line in f:
+            raw.append(line)
+            yield line.decode("utf-8", errors="replace")
+
+    reader = csv.reader(lines(), strict=True)
+    while True:
+        try:
+            row = next(reader)
+        except StopIteration:
+            return
+        except csv.Error:
+            # End of file inside a quoted field
+            return
+        record = b"".join(raw)
+        raw.clear()
+        yield row, record
+
+def _complete_records(f):
+    """
+    Yields (index, row, raw bytes) for each record up to the first one cut
+    off by a hard kill; index 0 is the header.
+    """
+    for i, (row, record) in enumerate(_records(f)):
+        # A record is complete only once its terminating newline was written
+        if not record.endswith(b"\n") or (i and len(row) != len(OUTPUT_COLUMNS)):
+            return
+        yield i, row, record
+
+def load_completed_ids(path):
+    """
+    Reads the Segment IDs already written to a checkpoint file.
+
+    The file is cut back to the end of its last complete CSV record, so a row
+    cut off by a hard kill (even inside a quoted multi-line Segment Text) is
+    dropped and appending continues from a clean record boundary. Rows whose
+    Response is "ERROR" are removed too, so a resumed run retries them. The
+    file is scanned one record at a time, so only the ids are kept in memory.
+
+    Args:
+        path (str): Checkpoint CSV written by `CheckpointWriter`.
+
+    Returns:
+        set[str]: Segment IDs (as strings) that already have a response.
+    """
+    if not os.path.exists(path):
+        return set()
+
+    completed = set()
+    errors = 0
+    complete_end = 0
+    with open(path, "rb") as f:
+        for i, row, record in _complete_records(f):
+            complete_end += len(record)
+            if i == 0:
+                continue
+            segment_id, _, response = row
+            if response == "ERROR":
+                errors += 1
+            else:
+                completed.add(segment_id)
+    size = os.path.getsize(path)
+
+    if errors:
+        # ERROR rows are dropped from the middle, so copy the kept records to a new file
+        tmp_path = f"{path}.tmp"
+        with open(path, "rb") as f, open(tmp_path, "wb") as out:
+            for i, row, record in _complete_records(f):
+                if i == 0 or row[2] != "ERROR":
+                    out.write(record)
+        os.replace(tmp_path, path)
+    elif complete_end != size:
+        with open(path, "rb+") as f:
+            f.truncate(complete_end)
+    return completed
+
+def sort_checkpoint(path, order):
+    """
+    Puts a checkpoint's rows in input order.
+
+    Each run (the first and every resume) appends its rows in input order,
+    so the file is a few ordered stretches, one per run. They are found in
+    one pass and merged back together by reading every stretch at once, so
+    only the position of each Segment ID is held in memory, never the rows.
+    Rows whose Segment ID is not in `order` keep their place after the rest.
+
+    Args:
+        path (str): Checkpoint CSV written by `CheckpointWriter`.
+        order (Iterable): Segment IDs in input order.
+    """
+    positions = {str(segment_id): i for i, segment_id in enumerate(order)}
+    unknown = len(positions)
+
+    header = b""
+    starts = []
+    offset = 0
+    previous = None
+    with open(path, "rb") as f:
+        for i, row, record in _complete_records(f):
+            if i == 0:
+                header = record
+            else:
+                position = positions.get(row[0], unknown)
+                if previous is None or position < previous:
+                    starts.append(offset)
+                previous = position
+            offset += len(record)
+    if len(starts) <= 1:
+        return
+
+    def stretch(start, end):
+        with open(path, "rb") as f:
+            f.seek(start)
+            for row, record in _records(f):
+                yield positions.get(row[0], unknown), record
+                start += len(record)
+                if start >= end:
+                    return
+
+    stretches = [stretch(start, end) for start, end in zip(starts, starts[1:] + [offset])]
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as out:
+        out.write(header)
+        for _, record in heapq.merge(*stretches, key=lambda item: item[0]):
+            out.write(record)
+    os.replace(tmp_path, path)
+
+class CheckpointWriter:
+    """
+    Appends classification results to a CSV as they complete.
+
+    Rows are written in the same format as `DataFrame.to_csv` produces for the
+    final output, and the file is flushed to disk every `flush_every` rows.
+
+    Args:
+        path (str): Checkpoint CSV to append to; a header is written if it is new.
+        flush_every (int): Number of rows between flushes.
+    """
+
+    def __init__(self, path, flush_every=20):
+        self.path = path
+        self.flush_every = flush_every
+        self._unflushed = 0
+
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, "a", newline="", encoding="utf-8")
+        self._writer = csv.DictWriter(self._file, fieldnames=OUTPUT_COLUMNS, lineterminator="\n")
+        if is_new:
+            self._writer.writeheader()
+            self.flush()
+
+    def write(self, row):
+        self._writer.writerow(row)
+        self._unflushed += 1
+        if self._unflushed >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unflushed = 0
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,105 @@
+import os
+import pickle
+import numpy as np
+import pandas as pd
+from utils.formatting import safe_eval
+from utils.storage import find_table, read_table, table_exists
+
+CACHE_DIR_NAME = ".eval_cache"
+
+# Parsed comparison frames keyed by path, with the (mtime_ns, size) they were read at
+_memory_cache = {}
+
+COMPARISON_COLUMNS = ["segment_id", "issue_type", "TP", "FP", "FN", "llm_response", "manual_response"]
+
+def comparison_stem(keyword, model_name):
+    return f"{keyword}_comparison_{model_name}"
+
+def _label_count(value):
+    parsed = safe_eval(value)
+    return len(parsed) if isinstance(parsed, list) else 0
+
+def _list_lengths(column):
+    # Parquet tables already hold lists
+    if column.map(lambda value: isinstance(value, list)).any():
+        return column.map(lambda value: len(value) if isinstance(value, list) else 0).to_numpy(dtype=np.int16)
+    # Parse each distinct list string once; most cells repeat ("[]", "['']", ...)
+    lengths = {value: _label_count(value) for value in column.dropna().unique()}
+    return column.map(lengths).fillna(0).to_numpy(dtype=np.int16)
+
+def parse_comparison(df):
+    """
+    Reduces a comparison CSV to the compact columns the evaluation reports use.
+
+    Returns:
+        pd.DataFrame: segment_id, is_auto, is_issues (bool), TP/FP/FN (int32)
+        and llm_len/manual_len (number of labels in each list).
+    """
+    return pd.DataFrame({
+        "segment_id": df["segment_id"].to_numpy(),
+        "is_auto": (df["issue_type"] == "auto_issues").to_numpy(),
+        "is_issues": (df["issue_type"] == "issues").to_numpy(),
+        "TP": df["TP"].fillna(0).to_numpy(dtype=np.int32),
+        "FP": df["FP"].fillna(0).to_numpy(dtype=np.int32),
+        "FN": df["FN"].fillna(0).to_numpy(dtype=np.int32),
+        "llm_len": _list_lengths(df["llm_response"]),
+        "manual_len": _list_lengths(df["manual_response"]),
+    })
+
+def load_comparison(path, disk_cache=True):
+    """
+    Loads and parses a `_comparison_{model}` table (.csv or .parquet) once.
+
+    The parsed frame is kept in memory and, with `disk_cache`, pickled under
+    `<keyword folder>/.eval_cache/`. Both copies are invalidated when the
+    CSV's modification time or size changes.
+
+    Args:
+        path (str): Path to the comparison table.
+        disk_cache (bool): Persist parsed frames between processes.
+
+    Returns:
+        pd.DataFrame: Output of `parse_comparison`.
+    """
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+
+    cached = _memory_cache.get(path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    cache_file = os.path.join(os.path.dirname(path), CACHE_DIR_NAME, os.path.basename(path) + ".pkl")
+    if disk_cache and os.path.exists(cache_file):
+        try:
+            with open(cache_file, "rb") as f:
+                cached = pickle.load(f)
+            if cached[0] == signature:
+                _memory_cache[path] = cached
+                return cached[1]
+        except Exception:
+            pass  # Corrupt or incompatible cache; rebuild it below
+
+    frame = parse_comparison(read_table(path, columns=COMPARISON_COLUMNS))
+    _memory_cache[path] = (signature, frame)
+    if disk_cache:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with open(cache_file, "wb") as f:
+            pickle.dump((signature, frame), f, protocol=pickle.HIGHEST_PROTOCOL)
+    return frame
+
+def load_keyword_comparisons(base_dir, keyword, model_names, disk_cache=True):
+    """
+    Loads the parsed comparison for each model of a keyword.
+
+    Returns:
+        dict: model name -> parsed frame, for the models whose file exists.
+    """
+    frames = {}
+    folder = os.path.join(base_dir, keyword)
+    for model in model_names:
+        stem = comparison_stem(keyword, model)
+        if not table_exists(folder, stem):
+            print(f"⚠️ Missing file: {os.path.join(folder, stem)}.csv")
+            continue
+        frames[model] = load_comparison(find_table(folder, stem), disk_cache)
+    return frames
@@ -0,0 +1,40 @@
+import re
+import hashlib
+import unicodedata
+
+_WHITESPACE = re.compile(r"\s+")
+
+def normalize_text(text):
+    """Normalizes segment text so trivially different copies hash the same (NFKC, collapsed whitespace)."""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", str(text))).strip()
+
+def dedup_key(segment_text, prompt_fingerprint, model_name):
+    """
+    Hashes a segment together with the guidance and model it is classified under.
+
+    Two segments with the same key are guaranteed to be sent the same
+    instructions and guidance by the same model, so one answer serves both.
+
+    Args:
+        segment_text (str): Raw segment text.
+        prompt_fingerprint (str): `KeywordPrompt.fingerprint` of the keyword.
+        model_name (str): Model used for classification.
+    """
+    blob = "\x1f".join([model_name, prompt_fingerprint, normalize_text(segment_text)])
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+class DedupStats:
+    """Counts segments seen versus segments actually sent to the model."""
+
+    def __init__(self):
+        self.total = 0
+        self.unique = 0
+
+    @property
+    def ratio(self):
+        """Fraction of segments served by another segment's answer."""
+        return 1 - self.unique / self.total if self.total else 0.0
+
+    def summary(self):
+        return (f"{self.unique}/{self.total} unique segments sent "
+                f"({self.ratio:.1%} answered by deduplication)")
@@ -0,0 +1,49 @@
+import os
+import hashlib
+import numpy as np
+
+def embed_texts(client, texts, model_name, batch_size=64):
+    """
+    Embeds texts with the server's /v1/embeddings endpoint.
+
+    Args:
+        client (LMStudioClient): Shared client.
+        texts (List[str]): Texts to embed.
+        model_name (str): Embedding model loaded in LM Studio.
+        batch_size (int): Texts sent per request.
+
+    Returns:
+        np.ndarray: float32 matrix of L2-normalized embeddings, one row per text.
+    """
+    rows = []
+    for start in range(0, len(texts), batch_size):
+        rows.extend(client.embed(list(texts[start:start + batch_size]), model_name))
+    vectors = np.asarray(rows, dtype=np.float32).reshape(len(texts), -1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
+
+def embeddings_key(texts, model_name):
+    digest = hashlib.sha256(model_name.encode("utf-8"))
+    for text in texts:
+        digest.update(b"\x1f" + str(text).encode("utf-8"))
+    return digest.hexdigest()[:24]
+
+def cached_embeddings(client, texts, model_name, cache_dir, batch_size=64):
+    """
+    Embeds texts once and keeps the matrix as a .npy file in `cache_dir`.
+
+    The file name is a hash of the model and every text, so any change to the
+    texts produces a new file. Cached matrices are opened memory-mapped.
+
+    Returns:
+        np.ndarray: Read-only (memory-mapped) matrix of normalized embeddings.
+    """
+    path = os.path.join(cache_dir, f"{embeddings_key(texts, model_name)}.npy")
+    if not os.path.exists(path):
+        vectors = embed_texts(client, texts, model_name, batch_size)
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, vectors)
+        os.replace(tmp_path, path)
+    return np.load(path, mmap_mode="r")
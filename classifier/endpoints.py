@@ -0,0 +1,156 @@
+import time
+import threading
+import requests
+
+def normalize_base_url(server_url):
+    """Reduces any server URL (host, /v1, /v1/completions, ...) to its `.../v1` base."""
+    url = server_url.rstrip("/")
+    for suffix in ("/chat/completions", "/completions", "/models"):
+        if url.endswith(suffix):
+            url = url[:-len(suffix)]
+            break
+    if not url.endswith("/v1"):
+        url += "/v1"
+    return url
+
+class Endpoint:
+    """One OpenAI-compatible server and its routing state."""
+
+    def __init__(self, server_url):
+        self.base_url = normalize_base_url(server_url)
+        self.outstanding = 0
+        self.failures = 0
+        self.down_until = 0.0
+        self.models = None  # None until /v1/models has been read
+        self.checked_at = 0.0
+
+    def url(self, path):
+        return f"{self.base_url}/{path}"
+
+    def is_up(self, now):
+        return now >= self.down_until
+
+    def __repr__(self):
+        return f"Endpoint({self.base_url}, outstanding={self.outstanding}, failures={self.failures})"
+
+class EndpointPool:
+    """
+    Spreads requests across several LM Studio / OpenAI-compatible servers.
+
+    Each request goes to the healthy server with the fewest requests in
+    flight among those whose /v1/models lists the requested model. A server
+    that fails `failure_threshold` requests in a row, or whose model list
+    cannot be read, is taken out of rotation for `cooldown` seconds and
+    probed again afterwards.
+
+    Args:
+        server_urls (List[str]): Server URLs (any of host, /v1 or /v1/completions form).
+        cooldown (float): Seconds a failing server stays out of rotation.
+        failure_threshold (int): Consecutive failures before a server is taken out.
+        models_ttl (float): Seconds between /v1/models refreshes per server.
+        health_timeout (float): Timeout for /v1/models probes.
+    """
+
+    def __init__(self, server_urls, cooldown=30.0, failure_threshold=2, models_ttl=60.0, health_timeout=5.0):
+        if not server_urls:
+            raise ValueError("EndpointPool needs at least one server URL")
+        self.endpoints = [Endpoint(url) for url in server_urls]
+        self.cooldown = cooldown
+        self.failure_threshold = failure_threshold
+        self.models_ttl = models_ttl
+        self.health_timeout = health_timeout
+        self._lock = threading.Lock()
+        self._probe_lock = threading.Lock()
+
+    def probe(self, endpoint, session=None):
+        """Reads /v1/models from a server; marks it down if that fails."""
+        getter = session.get if session is not None else requests.get
+        try:
+            response = getter(endpoint.url("models"), timeout=self.health_timeout)
+            response.raise_for_status()
+            models = {model["id"] for model in response.json().get("data", [])}
+        except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+            with self._lock:
+                endpoint.down_until = time.monotonic() + self.cooldown
+                endpoint.checked_at = time.monotonic()
+            print(f"⚠️ Endpoint {endpoint.base_url} failed health check: {e}")
+            return False
+
+        with self._lock:
+            endpoint.models = models
+            endpoint.failures = 0
+            endpoint.down_until = 0.0
+            endpoint.checked_at = time.monotonic()
+        return True
+
+    def refresh(self, session=None, force=False):
+        """
+        Probes every server whose model list is stale, or whose cooldown has
+        just expired (or all of them, with `force`). Only one thread probes at
+        a time; the others carry on with the current state unless no server
+        has been probed yet.
+        """
+        initial = all(endpoint.models is None for endpoint in self.endpoints)
+        if not self._probe_lock.acquire(blocking=initial or force):
+            return
+        try:
+            now = time.monotonic()
+            for endpoint in self.endpoints:
+                if not force and not endpoint.is_up(now):
+                    continue  # Still cooling down
+                stale = endpoint.models is None or now - endpoint.checked_at >= self.models_ttl
+                recovering = endpoint.down_until > 0
+                if force or stale or recovering:
+                    self.probe(endpoint, session)
+        finally:
+            self._probe_lock.release()
+
+    def acquire(self, model_name, session=None):
+        """
+        Picks the least-loaded healthy server for `model_name` and counts the
+        request as outstanding on it. Pair every call with `release`.
+
+        Raises:
+            requests.exceptions.ConnectionError: If no healthy server offers the
+                model; callers treat it as transient and retry later.
+        """
+        self.refresh(session)
+        with self._lock:
+            now = time.monotonic()
+            candidates = [
+                endpoint for endpoint in self.endpoints
+                if endpoint.is_up(now) and endpoint.models is not None and model_name in endpoint.models
+            ]
+            if not candidates:
+                raise requests.exceptions.ConnectionError(
+                    f"No healthy endpoint is serving model '{model_name}'"
+                )
+            endpoint = min(candidates, key=lambda e: (e.outstanding, e.failures))
+            endpoint.outstanding += 1
+            return endpoint
+
+    def release(self, endpoint, success):
+        with self._lock:
+            endpoint.outstanding -= 1
+            if success:
+                endpoint.failures = 0
+                return
+            endpoint.failures += 1
+            if endpoint.failures >= self.failure_threshold:
+                endpoint.down_until = time.monotonic() + self.cooldown
+                print(f"🚧 Endpoint {endpoint.base_url} out of rotation for {self.cooldown:.0f}s")
+
+    def status(self):
+        """Returns a snapshot of each server's routing state."""
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    "url": endpoint.base_url,
+                    "up": endpoint.is_up(now),
+                    "outstanding": endpoint.outstanding,
+                    "failures": endpoint.failures,
+                    "models": sorted(endpoint.models or []),
+                }
+                for endpoint in self.endpoints
+            ]
@@ -1,9 +1,29 @@
+"""
+Cross-model comparison tables and Venn diagrams.
+
+The plotting stack (matplotlib, matplotlib_venn) and IPython are only
+imported where they are used, so the tables can be generated on headless
+machines without them. Figures are drawn on an Agg canvas, never through
+pyplot, so rendering works in worker processes without a display.
+"""
 import os
+from itertools import repeat
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
-import ast
-from IPython.display import display
-import matplotlib.pyplot as plt
-from matplotlib_venn import venn2
+from classifier.comparison_data import load_keyword_comparisons
+
+def _show(df):
+    # Rich output in notebooks; plain text where IPython is not installed
+    try:
+        from IPython.display import display
+    except ImportError:
+        print(df.to_string())
+        return
+    display(df)
+
+def _keywords(base_dir):
+    return [keyword for keyword in os.listdir(base_dir) if os.path.isdir(os.path.join(base_dir, keyword))]
 
 def generate_model_comparisons(model_names, base_dir, output_dir):
     os.makedirs(output_dir, exist_ok=True)
@@ -28,22 +48,18 @@ def generate_model_comparisons(model_names, base_dir, output_dir):
         baseline_auto_TP = None
         baseline_issues_TP = None
 
-        for model in model_names:
-            file_path = os.path.join(keyword_path, f"{keyword}_comparison_{model}.csv")
-            if not os.path.exists(file_path):
-                print(f"⚠️ Missing file: {file_path}")
-                continue
+        for model, df in load_keyword_comparisons(base_dir, keyword, model_names).items():
+            auto = df["is_auto"].to_numpy()
+            issues = df["is_issues"].to_numpy()
+            llm_empty = df["llm_len"].to_numpy() == 0
+            manual_empty = df["manual_len"].to_numpy() == 0
 
-            df = pd.read_csv(file_path)
+            auto_TP, auto_FP, auto_FN = (int(df[col].to_numpy()[auto].sum()) for col in ("TP", "FP", "FN"))
+            auto_BL = int(df["manual_len"].to_numpy()[auto].sum())
 
-            auto_issues_df = df[df["issue_type"] == "auto_issues"]
-            auto_TP, auto_FP, auto_FN = auto_issues_df[["TP", "FP", "FN"]].sum()
-            auto_BL = auto_issues_df["manual_response"].apply(ast.literal_eval).apply(len).sum()
-
-            issues_df = df[df["issue_type"] == "issues"]
-            issues_TP = issues_df["llm_response"].apply(lambda x: ast.literal_eval(x) == []).sum()
-            issues_FP, _ = issues_df[["FP", "FN"]].sum()
-            issues_BL = issues_df["manual_response"].apply(lambda x: ast.literal_eval(x) == []).sum()
+            issues_TP = int((issues & llm_empty).sum())
+            issues_FP = int(df["FP"].to_numpy()[issues].sum())
+            issues_BL = int((issues & manual_empty).sum())
 
             if model == model_names[0]:
                 baseline_auto_TP = auto_BL
@@ -85,7 +101,7 @@ def generate_model_comparisons(model_names, base_dir, output_dir):
         df_comparison = df_comparison[["baseline"] + model_names]
         df_comparison.to_csv(os.path.join(output_dir, f"{keyword}_model_comparison.csv"))
 
-        display(df_comparison)
+        _show(df_comparison)
         print("—" * 50)
 
     # Create and save TOTAL summary
@@ -94,75 +110,96 @@ def generate_model_comparisons(model_names, base_dir, output_dir):
         total_df = total_df[["baseline"] + model_names]  # Ensure column order
         total_df.to_csv(os.path.join(output_dir, "TOTAL_model_comparison.csv"))
         print(f"\n✅ TOTAL summary saved to {output_dir}/TOTAL_model_comparison.csv")
-        display(total_df)
-
-def generate_model_venn_diagrams(model_names, base_dir, output_dir):
+        _show(total_df)
+
+def _use_agg():
+    # matplotlib_venn imports pyplot; keep workers on the non-interactive backend
+    import matplotlib
+    matplotlib.use("Agg")
+
+def render_keyword_venn(base_dir, keyword, model_names, output_dir):
+    """
+    Draws one keyword's grid of Venn diagrams (classified and unclassified
+    rows, one column per model) and saves it as a PNG.
+
+    Returns:
+        str: Path of the saved figure.
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib_venn import venn2
+
+    # Prepare all model data for this keyword
+    venn_data = {
+        "classified": [],
+        "unclassified": []
+    }
+
+    for model, df in load_keyword_comparisons(base_dir, keyword, model_names).items():
+        segment_ids = df["segment_id"].to_numpy()
+        auto = df["is_auto"].to_numpy()
+        issues = df["is_issues"].to_numpy()
+        llm_any = df["llm_len"].to_numpy() > 0
+        manual_any = df["manual_len"].to_numpy() > 0
+
+        # Baseline
+        BL_classified = set(segment_ids[auto])
+        BL_unclassified = set(segment_ids[issues])
+
+        # Model outcomes
+        TP = set(segment_ids[auto & llm_any & manual_any])
+        TN = set(segment_ids[issues & ~llm_any & ~manual_any])
+        FP = set(segment_ids[~manual_any & llm_any])
+        FN = set(segment_ids[manual_any & ~llm_any])
+
+        venn_data["classified"].append((BL_classified, TP.union(FP), model))
+        venn_data["unclassified"].append((BL_unclassified, TN.union(FN), model))
+
+    # Create grid of subplots (2 rows: classified/unclassified, N columns for N models)
+    fig = Figure(figsize=(6 * len(model_names), 10))
+    FigureCanvasAgg(fig)
+    axes = fig.subplots(2, len(model_names), squeeze=False)
+
+    for col, (bl_set, model_set, model_name) in enumerate(venn_data["classified"]):
+        venn2([bl_set, model_set], set_labels=("BL_classified", "TP ∪ FP"), ax=axes[0, col])
+        axes[0, col].set_title(f"{model_name} — Classified")
+
+    for col, (bl_set, model_set, model_name) in enumerate(venn_data["unclassified"]):
+        venn2([bl_set, model_set], set_labels=("BL_unclassified", "TN ∪ FN"), ax=axes[1, col])
+        axes[1, col].set_title(f"{model_name} — Unclassified")
+
+    fig.tight_layout()
+    plot_path = os.path.join(output_dir, f"{keyword}_venn_comparison_grid.png")
+    fig.savefig(plot_path)
+    return plot_path
+
+def generate_model_venn_diagrams(model_names, base_dir, output_dir, max_processes=None):
+    """
+    Saves a Venn diagram grid per keyword, rendering keywords in parallel.
+
+    Args:
+        model_names (List[str]): Models to compare.
+        base_dir (str): Path to the categories folder.
+        output_dir (str): Where the PNGs are written.
+        max_processes (int, optional): Worker processes; 1 renders in this process.
+    """
     os.makedirs(output_dir, exist_ok=True)
-
-    def parsed(row, col):
-        try:
-            return ast.literal_eval(row[col])
-        except Exception:
-            return []
-
-    for keyword in os.listdir(base_dir):
-        keyword_path = os.path.join(base_dir, keyword)
-        if not os.path.isdir(keyword_path):
-            continue
-
-        print(f"\n📁 Keyword: {keyword}")
-
-        # Prepare all model data for this keyword
-        venn_data = {
-            "classified": [],
-            "unclassified": []
-        }
-
-        for model in model_names:
-            file_path = os.path.join(keyword_path, f"{keyword}_comparison_{model}.csv")
-            if not os.path.exists(file_path):
-                print(f"⚠️ Missing file: {file_path}")
-                continue
-
-            df = pd.read_csv(file_path)
-
-            auto_issues_df = df[df["issue_type"] == "auto_issues"]
-            issues_df = df[df["issue_type"] == "issues"]
-
-            # Baseline
-            BL_classified = set(auto_issues_df['segment_id'])
-            BL_unclassified = set(issues_df['segment_id'])
-
-            # Model outcomes
-            TP = {row['segment_id'] for _, row in auto_issues_df.iterrows()
-                  if len(parsed(row, 'llm_response')) > 0 and len(parsed(row, 'manual_response')) > 0}
-            TN = {row['segment_id'] for _, row in issues_df.iterrows()
-                  if len(parsed(row, 'llm_response')) == 0 and len(parsed(row, 'manual_response')) == 0}
-            FP = {row['segment_id'] for _, row in df.iterrows()
-                  if len(parsed(row, 'manual_response')) == 0 and len(parsed(row, 'llm_response')) > 0}
-            FN = {row['segment_id'] for _, row in df.iterrows()
-                  if len(parsed(row, 'manual_response')) > 0 and len(parsed(row, 'llm_response')) == 0}
-
-            venn_data["classified"].append((BL_classified, TP.union(FP), model))
-            venn_data["unclassified"].append((BL_unclassified, TN.union(FN), model))
-
-        # Create grid of subplots (2 rows: classified/unclassified, N columns for N models)
-        fig, axes = plt.subplots(2, len(model_names), figsize=(6 * len(model_names), 10))
-
-        for col, (bl_set, model_set, model_name) in enumerate(venn_data["classified"]):
-            ax = axes[0, col] if len(model_names) > 1 else axes[0]
-            plt.sca(ax)
-            venn2([bl_set, model_set], set_labels=("BL_classified", "TP ∪ FP"))
-            ax.set_title(f"{model_name} — Classified")
-
-        for col, (bl_set, model_set, model_name) in enumerate(venn_data["unclassified"]):
-            ax = axes[1, col] if len(model_names) > 1 else axes[1]
-            plt.sca(ax)
-            venn2([bl_set, model_set], set_labels=("BL_unclassified", "TN ∪ FN"))
-            ax.set_title(f"{model_name} — Unclassified")
-
-        plt.tight_layout()
-        plot_path = os.path.join(output_dir, f"{keyword}_venn_comparison_grid.png")
-        plt.savefig(plot_path)
-        plt.close()
-        print(f"✅ Saved grid Venn diagram: {plot_path}")
\ No newline at end of file
+    keywords = _keywords(base_dir)
+    args = (repeat(base_dir), keywords, repeat(model_names), repeat(output_dir))
+
+    serial = max_processes == 1 or len(keywords) <= 1
+    with nullcontext() if serial else ProcessPoolExecutor(max_workers=max_processes, initializer=_use_agg) as pool:
+        # map keeps keyword order, so the log reads the same as a serial run
+        plot_paths = map(render_keyword_venn, *args) if serial else pool.map(render_keyword_venn, *args)
+        for keyword, plot_path in zip(keywords, plot_paths):
+            print(f"\n📁 Keyword: {keyword}")
+            print(f"✅ Saved grid Venn diagram: {plot_path}")
+
+def generate_evaluation_reports(model_names, base_dir, output_dir, tables_only=False, max_processes=None):
+    """
+    Writes the comparison tables and, unless `tables_only`, the Venn diagram
+    grids. Table-only runs never import the plotting stack.
+    """
+    generate_model_comparisons(model_names, base_dir, output_dir)
+    if not tables_only:
+        generate_model_venn_diagrams(model_names, base_dir, output_dir, max_processes)
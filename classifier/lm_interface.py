@@ -1,23 +1,295 @@
+import time
+import random
 import requests
+from requests.adapters import HTTPAdapter
 from classifier.utils import extract_list_from_response
+from classifier.rate_limit import AdaptiveRateLimiter
+from classifier.streaming import JSONScanner, StreamStats, iter_sse_text
+from classifier.endpoints import normalize_base_url
+from classifier.telemetry import Telemetry
 
-def call_lm_studio(prompt, model_name, server_url="http://localhost:1234/v1/completions"):
-    try:
-        response = requests.post(
-            server_url,
-            headers={"Content-Type": "application/json"},
-            json={
-                "model": model_name,
-                "prompt": prompt,
-                "temperature": 0,
-                "stop": ["\n", "</s>"]
-            },
-            timeout=1000
-        )
-        response.raise_for_status()
+DEFAULT_SERVER_URL = "http://localhost:1234/v1/completions"
+
+def is_transient_error(error):
+    """Returns True for failures worth retrying (429, 5xx, timeouts, dropped connections)."""
+    if isinstance(error, (requests.exceptions.Timeout, requests.exceptions.ConnectionError,
+                          requests.exceptions.ChunkedEncodingError)):
+        return True
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        return status == 429 or status >= 500
+    return False
+
+def chat_endpoint(server_url):
+    """Maps a /v1/completions URL to the matching /v1/chat/completions URL."""
+    if server_url.endswith("/chat/completions"):
+        return server_url
+    return server_url.rsplit("/completions", 1)[0] + "/chat/completions"
+
+class LMStudioClient:
+    """
+    Reusable HTTP client for an OpenAI-compatible LM Studio server.
+
+    Holds a pooled keep-alive session so consecutive requests reuse TCP
+    connections, and retries transient failures with jittered exponential
+    backoff. Share one instance across all segments and keywords of a run.
+
+    Args:
+        server_url (str): Completions endpoint of the LM Studio server; the chat
+            endpoint is derived from it.
+        connect_timeout (float): Seconds allowed to establish a connection.
+        read_timeout (float): Seconds allowed to wait for the model's answer.
+        max_retries (int): Retries after the first attempt for transient errors.
+        backoff_base (float): Base delay in seconds for the exponential backoff.
+        backoff_max (float): Upper bound for a single backoff delay.
+        pool_size (int): Maximum number of pooled keep-alive connections.
+        rate_limiter (AdaptiveRateLimiter, optional): Request pacer; a new one
+            is created when omitted.
+        cache (ResponseCache, optional): Response cache consulted before the
+            network; successful responses are written back to it.
+        endpoints (EndpointPool, optional): Pool of servers to route requests
+            across; when given, `server_url` is not used.
+        stream (bool): Stream generations by default and cancel them as soon
+            as a complete JSON list or object has arrived (see `complete`).
+        telemetry (Telemetry, optional): Where every attempt's latency, token
+            usage and outcome is recorded; a new one is created when omitted.
+    """
+
+    def __init__(self, server_url=DEFAULT_SERVER_URL, connect_timeout=10, read_timeout=600,
+                 max_retries=4, backoff_base=1.0, backoff_max=30.0, pool_size=16,
+                 rate_limiter=None, cache=None, endpoints=None, stream=False, telemetry=None):
+        self.server_url = server_url
+        self.endpoints = endpoints
+        self.chat_url = chat_endpoint(server_url)
+        self.cache = cache
+        self.stream = stream
+        self.stream_stats = StreamStats()
+        self.telemetry = telemetry if telemetry is not None else Telemetry()
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.rate_limiter = rate_limiter if rate_limiter is not None else AdaptiveRateLimiter()
+
+        self.session = requests.Session()
+        self.session.headers.update({"Content-Type": "application/json"})
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _backoff_delay(self, attempt, error):
+        # Honour Retry-After on 429/503 when the server sends one
+        response = getattr(error, "response", None)
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after is not None:
+                try:
+                    return min(float(retry_after), self.backoff_max)
+                except ValueError:
+                    pass
+        # Full jitter: uniform in [0, base * 2^attempt]
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def post(self, payload, path="completions"):
+        """
+        Posts a JSON payload and returns the decoded JSON response.
+
+        `path` is relative to the server's /v1 base, e.g. "completions",
+        "chat/completions" or "embeddings". With an endpoint pool the
+        request goes to the least-loaded healthy server for the payload's model,
+        and a retry may land on a different server.
+
+        Transient errors are retried up to `max_retries` times; the last error is
+        re-raised once retries are exhausted or for non-transient failures.
+        """
+        return self._send(payload, path, self._read_json)
+
+    @staticmethod
+    def _read_json(response, started, info):
         result = response.json()
-        return extract_list_from_response(result.get("choices", [{}])[0].get("text", "").strip())
+        info["usage"] = result.get("usage")
+        return result
+
+    def _send(self, payload, path, read, stream=False):
+        # `read(response, started, info)` turns a successful response into the
+        # result and may add usage and stream timings to `info` for telemetry;
+        # `requests` exceptions it raises are retried like a failed request, and
+        # anything else still releases the endpoint and is recorded before it propagates
+        model = payload.get("model")
+        for attempt in range(self.max_retries + 1):
+            wait_started = time.perf_counter()
+            self.rate_limiter.acquire()
+            wait = time.perf_counter() - wait_started
+            endpoint = None
+            info = {}
+            started = None
+            try:
+                if self.endpoints is not None:
+                    endpoint = self.endpoints.acquire(payload.get("model"), self.session)
+                    url = endpoint.url(path)
+                elif path == "completions":
+                    url = self.server_url
+                elif path == "chat/completions":
+                    url = self.chat_url
+                else:
+                    url = f"{normalize_base_url(self.server_url)}/{path}"
+                self.telemetry.request_started()
+                started = time.perf_counter()
+                response = self.session.post(url, json=payload, timeout=self.timeout, stream=stream)
+                response.raise_for_status()
+                result = read(response, started, info)
+            except requests.exceptions.RequestException as e:
+                if endpoint is not None:
+                    self.endpoints.release(endpoint, success=not is_transient_error(e))
+                retrying = is_transient_error(e) and attempt < self.max_retries
+                if started is not None:
+                    self.telemetry.record_request(
+                        model, path, time.perf_counter() - started, "retry" if retrying else "error",
+                        attempt=attempt, wait=wait, endpoint=url, error=str(e)
+                    )
+                if not is_transient_error(e):
+                    raise
+                rate_limited = (isinstance(e, requests.exceptions.HTTPError) and e.response is not None
+                                and e.response.status_code == 429)
+                self.rate_limiter.record_throttle(rate_limited=rate_limited)
+                if attempt == self.max_retries:
+                    raise
+                delay = self._backoff_delay(attempt, e)
+                print(f"🔁 Retry {attempt + 1}/{self.max_retries} in {delay:.1f}s after: {e}")
+                time.sleep(delay)
+                continue
+            except Exception as e:
+                if endpoint is not None:
+                    self.endpoints.release(endpoint, success=False)
+                if started is not None:
+                    self.telemetry.record_request(
+                        model, path, time.perf_counter() - started, "error",
+                        attempt=attempt, wait=wait, endpoint=url, error=str(e)
+                    )
+                raise
+            if endpoint is not None:
+                self.endpoints.release(endpoint, success=True)
+            self.rate_limiter.record_success()
+            self.telemetry.record_request(
+                model, path, time.perf_counter() - started, "ok", attempt=attempt, wait=wait,
+                endpoint=url, **info
+            )
+            return result
+
+    def _read_stream(self, response, started, is_chat, info):
+        scanner = JSONScanner()
+        pieces = []
+        ttft = time_to_list = None
+        finished = False
+        try:
+            for piece, usage, finished in iter_sse_text(response, is_chat):
+                if usage:
+                    info["usage"] = usage
+                if not piece:
+                    continue
+                now = time.perf_counter()
+                if ttft is None:
+                    ttft = now - started
+                pieces.append(piece)
+                if scanner.feed(piece):
+                    time_to_list = now - started
+                    break
+        except ValueError as e:
+            # A malformed chunk is a broken transfer: retry it like a dropped connection
+            raise requests.exceptions.ChunkedEncodingError(f"Malformed stream chunk: {e}") from e
+        finally:
+            # Closing mid-stream drops the connection, which makes the server
+            # abort the rest of the generation
+            response.close()
+
+        text = "".join(pieces)
+        # Only a break before the server's finish event actually cut the generation short
+        stopped_early = scanner.complete and not finished
+        self.stream_stats.record(
+            ttft, time_to_list, time.perf_counter() - started, len(pieces),
+            stopped_early=stopped_early
+        )
+        info.update(ttft=ttft, chunks=len(pieces), stopped_early=stopped_early)
+        return text[:scanner.end] if scanner.complete else text
+
+    def complete(self, prompt, model_name, stop=("\n", "</s>"), max_tokens=None, stream=None,
+                 response_format=None):
+        """
+        Sends a generation request and returns the stripped response text.
+
+        A prompt string goes to /v1/completions; a list of chat messages goes to
+        /v1/chat/completions.
+
+        When streaming, tokens are parsed as they arrive and the generation is
+        cancelled once the first JSON list or object in the answer is complete,
+        so text a model adds after its answer is never waited for. Timings of
+        every streamed request are recorded in `stream_stats`.
+
+        Args:
+            prompt (str or List[dict]): Full prompt text or chat messages.
+            model_name (str): Model to run.
+            stop (Sequence[str]): Stop sequences; the default ends at the first newline.
+            max_tokens (int, optional): Cap on generated tokens.
+            stream (bool, optional): Override the client's `stream` setting.
+            response_format (dict, optional): Structured-output constraint, e.g.
+                from `KeywordPrompt.response_format`.
+        """
+        stream = self.stream if stream is None else stream
+        is_chat = not isinstance(prompt, str)
+        params = {"temperature": 0, "stop": list(stop)}
+        if max_tokens is not None:
+            params["max_tokens"] = max_tokens
+        if response_format is not None:
+            params["response_format"] = response_format
+        if self.cache is not None:
+            key = self.cache.make_key(model_name, prompt, params)
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.telemetry.record_cache_hit(model_name)
+                return cached
+
+        if stream:
+            payload = {"model": model_name, "stream": True, **params}
+            payload["messages" if is_chat else "prompt"] = prompt
+            text = self._send(
+                payload, "chat/completions" if is_chat else "completions",
+                lambda response, started, info: self._read_stream(response, started, is_chat, info),
+                stream=True
+            )
+        elif is_chat:
+            result = self.post({"model": model_name, "messages": prompt, **params}, path="chat/completions")
+            choice = result.get("choices", [{}])[0]
+            text = (choice.get("message") or {}).get("content") or ""
+        else:
+            result = self.post({"model": model_name, "prompt": prompt, **params})
+            text = result.get("choices", [{}])[0].get("text", "")
+        text = text.strip()
+
+        if self.cache is not None:
+            self.cache.put(key, model_name, text)
+        return text
+
+    def embed(self, texts, model_name):
+        """Returns one embedding (list of floats) per text from /v1/embeddings."""
+        result = self.post({"model": model_name, "input": list(texts)}, path="embeddings")
+        data = sorted(result.get("data", []), key=lambda item: item.get("index", 0))
+        return [item["embedding"] for item in data]
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def call_lm_studio(prompt, model_name, server_url=DEFAULT_SERVER_URL, client=None, max_tokens=None):
+    if client is None:
+        with LMStudioClient(server_url) as client:
+            return call_lm_studio(prompt, model_name, client=client, max_tokens=max_tokens)
+    try:
+        return extract_list_from_response(client.complete(prompt, model_name, max_tokens=max_tokens))
     except requests.exceptions.RequestException as e:
         print("❌ Request error:", e)
         return "ERROR"
-        
\ No newline at end of file
@@ -0,0 +1,159 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+from utils.formatting import parse_label_column
+from utils.lookup import load_lookup_dict, reverse_translation_dict
+from utils.storage import read_table
+from classifier.embeddings import cached_embeddings
+
+EMBEDDING_CACHE_DIR_NAME = ".embedding_cache"
+
+def neighbour_copies_path(folder, keyword, model_name):
+    return os.path.join(folder, f"{keyword}_neighbour_copies_{model_name}.csv")
+
+def load_labelled_segments(base_dir, keyword, lookup_path='lookup_dictionaries.json'):
+    """
+    Loads the manually labelled segments of `{keyword}_classified.csv`.
+
+    Labels are mapped back to guidance codes with the reverse lookup, as in
+    `merge_classifications`, so they can stand in for a model answer.
+
+    Returns:
+        pd.DataFrame: segment_id, segment_text and labels (list of codes).
+    """
+    df = read_table(os.path.join(base_dir, keyword, f"{keyword}_classified.csv"))
+    df = df.dropna(subset=["auto_issues"])
+    labels = parse_label_column(df["auto_issues"])
+    if os.path.exists(lookup_path):
+        rev_dict = reverse_translation_dict(load_lookup_dict(lookup_path))
+        labels = labels.apply(lambda codes: [rev_dict.get(code, code) for code in codes])
+    return pd.DataFrame({
+        "segment_id": df["segment_id"].to_numpy(),
+        "segment_text": df["segment_text"].astype(str).to_numpy(),
+        "labels": labels.to_numpy(),
+    })
+
+class NeighbourShortcut:
+    """
+    Nearest labelled neighbours of every segment of a keyword.
+
+    Segment and labelled-segment embeddings come from /v1/embeddings and are
+    cached on disk (see `cached_embeddings`). The top neighbours of each
+    segment are found once, in chunks, when the shortcut is built. A segment
+    never counts as its own neighbour, so labelled segments are still
+    classified by the model and the comparison stays honest.
+
+    Args:
+        segment_ids (Sequence): IDs of the segments to classify.
+        segment_texts (Sequence[str]): Their texts.
+        labelled (pd.DataFrame): Output of `load_labelled_segments`.
+        client (LMStudioClient): Shared client.
+        embedding_model (str): Embedding model loaded in LM Studio.
+        cache_dir (str): Where embeddings are cached.
+        threshold (float, optional): Cosine similarity at or above which the
+            nearest neighbour's labels are copied instead of calling the model.
+        few_shot (int): Neighbours added to single-segment prompts as examples.
+        chunk_size (int): Segments compared against the index at once.
+    """
+
+    def __init__(self, segment_ids, segment_texts, labelled, client, embedding_model, cache_dir,
+                 threshold=None, few_shot=0, chunk_size=1024):
+        self.threshold = threshold
+        self.few_shot = few_shot
+        self.labelled = labelled.reset_index(drop=True)
+        self.signature = f"{embedding_model}:{threshold}:{few_shot}"
+        self.rows = {str(segment_id): row for row, segment_id in enumerate(segment_ids)}
+        self.copies = {}
+        self._lock = threading.Lock()
+
+        n_neighbours = min(max(few_shot, 1), len(self.labelled))
+        self.neighbours = np.zeros((len(self.rows), n_neighbours), dtype=np.int64)
+        self.similarity = np.full((len(self.rows), n_neighbours), -np.inf, dtype=np.float32)
+        if not n_neighbours or not len(self.rows):
+            return
+
+        segment_vectors = cached_embeddings(
+            client, [str(text) for text in segment_texts], embedding_model, cache_dir
+        )
+        labelled_vectors = np.asarray(
+            cached_embeddings(client, list(self.labelled["segment_text"]), embedding_model, cache_dir)
+        )
+        # Row of each labelled segment among the segments (-1 if absent), to exclude self-matches
+        self_rows = np.array([
+            self.rows.get(str(segment_id), -1) for segment_id in self.labelled["segment_id"]
+        ])
+
+        for start in range(0, len(self.rows), chunk_size):
+            similarity = np.asarray(segment_vectors[start:start + chunk_size]) @ labelled_vectors.T
+            inside = (self_rows >= start) & (self_rows < start + len(similarity))
+            similarity[self_rows[inside] - start, np.flatnonzero(inside)] = -np.inf
+
+            top = np.argpartition(-similarity, n_neighbours - 1, axis=1)[:, :n_neighbours]
+            top_similarity = np.take_along_axis(similarity, top, axis=1)
+            order = np.argsort(-top_similarity, axis=1, kind="stable")
+            end = start + len(similarity)
+            self.neighbours[start:end] = np.take_along_axis(top, order, axis=1)
+            self.similarity[start:end] = np.take_along_axis(top_similarity, order, axis=1)
+
+    def match(self, segment_id):
+        """
+        Returns the nearest neighbour's labels if it is similar enough, else
+        None. Matches are recorded in `copies`.
+        """
+        row = self.rows.get(str(segment_id))
+        if self.threshold is None or row is None or not self.similarity.shape[1]:
+            return None
+        similarity = float(self.similarity[row, 0])
+        if similarity < self.threshold:
+            return None
+        neighbour = self.labelled.iloc[self.neighbours[row, 0]]
+        with self._lock:
+            self.copies[str(segment_id)] = (neighbour["segment_id"], similarity)
+        return list(neighbour["labels"])
+
+    def examples(self, segment_id):
+        """Returns up to `few_shot` (text, codes) pairs from the closest labelled segments."""
+        row = self.rows.get(str(segment_id))
+        if not self.few_shot or row is None:
+            return None
+        picked = [i for i, s in zip(self.neighbours[row], self.similarity[row]) if np.isfinite(s)]
+        return [
+            (self.labelled.at[i, "segment_text"], list(self.labelled.at[i, "labels"]))
+            for i in picked[:self.few_shot]
+        ] or None
+
+    def save_copies(self, path):
+        """
+        Appends this run's copied segments to `path`, keeping the latest entry
+        per segment. `classification` removes the file when a run starts
+        afresh, so it only accumulates across resumes of the same run.
+        """
+        copies = pd.DataFrame(
+            [(segment_id, neighbour_id, round(similarity, 4))
+             for segment_id, (neighbour_id, similarity) in self.copies.items()],
+            columns=["segment_id", "neighbour_id", "similarity"]
+        )
+        if os.path.exists(path):
+            previous = pd.read_csv(path, dtype={"segment_id": str})
+            copies = pd.concat([previous, copies], ignore_index=True)
+        copies["segment_id"] = copies["segment_id"].astype(str)
+        copies.drop_duplicates("segment_id", keep="last").to_csv(path, index=False)
+
+def build_neighbour_shortcut(base_dir, keyword, segments_df, client, embedding_model, threshold=None,
+                             few_shot=0, lookup_path='lookup_dictionaries.json'):
+    """
+    Builds a `NeighbourShortcut` for a keyword from its `_classified.csv`, or
+    returns None when the keyword has no labelled segments.
+    """
+    if not os.path.exists(os.path.join(base_dir, keyword, f"{keyword}_classified.csv")):
+        print(f"⚠️ [{keyword}] No {keyword}_classified.csv; neighbour shortcut disabled")
+        return None
+    labelled = load_labelled_segments(base_dir, keyword, lookup_path)
+    if labelled.empty:
+        print(f"⚠️ [{keyword}] No labelled segments; neighbour shortcut disabled")
+        return None
+    return NeighbourShortcut(
+        segments_df["segment_id"], segments_df["segment_text"], labelled, client, embedding_model,
+        os.path.join(base_dir, keyword, EMBEDDING_CACHE_DIR_NAME), threshold=threshold, few_shot=few_shot
+    )
@@ -0,0 +1,216 @@
+import json
+import time
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, InvalidStateError, wait
+from classifier.batching import classify_batch
+from classifier.dedup import dedup_key, DedupStats
+
+def classify_segments(segments, model_name, keyword_prompt, client, executor,
+                      max_workers=4, batch_size=1, dedup=True, dedup_index=None, dedup_stats=None,
+                      structured=False, parse_stats=None, retriever=None, shortcut=None, ordered=True):
+    """
+    Classifies a stream of segments and yields the results in input order,
+    or as they complete with `ordered=False`.
+
+    A bounded window of segments is read ahead and sent to `executor` in
+    batches of `batch_size`, so memory stays flat however long `segments` is.
+    Batch timings, queue depths and the time spent waiting for results are
+    recorded in `client.telemetry`.
+    With `dedup`, segments whose normalized text was already seen under the
+    same guidance and model reuse that answer instead of being sent again.
+
+    If `segments` has a `ready()` method (see `classifier.api`), reading
+    stops while it returns False and results are pending, so a slow source
+    does not hold back answers that are already in.
+
+    Closing the generator early cancels the segments that are still waiting:
+    batches that have not started are skipped, and their dedup entries are
+    dropped so a shared `dedup_index` never holds an unfinished answer.
+
+    Args:
+        segments (Iterable[Tuple]): (segment_id, segment_text) pairs.
+        model_name (str): Model to run.
+        keyword_prompt (KeywordPrompt): Prepared prompt for the keyword.
+        client (LMStudioClient): Shared client.
+        executor (Executor): Pool the requests run on.
+        max_workers (int): Number of workers in `executor`; sizes the read-ahead window.
+        batch_size (int): Segments per request.
+        dedup (bool): Send each unique (text, guidance, model) only once.
+        dedup_index (dict, optional): Dedup key -> Future; pass the same dict to
+            share answers across keywords of a run.
+        dedup_stats (DedupStats, optional): Counters updated as segments are read.
+        structured (bool): Constrain answers to the keyword's codes (see `classify_batch`).
+        parse_stats (ParseStats, optional): Counters for retries and invalid codes.
+        retriever (GuidanceRetriever, optional): Sends only each batch's
+            candidate guidance rows.
+        shortcut (NeighbourShortcut, optional): Copies the labels of a close
+            enough labelled neighbour instead of calling the model, and adds
+            neighbours as few-shot examples otherwise.
+        ordered (bool): Yield in input order; otherwise each result is yielded
+            as soon as it is ready, so one slow request does not hold back
+            the rest of the window.
+
+    Yields:
+        Tuple: (segment_id, segment_text, response) where response is a list
+        of codes or "ERROR".
+    """
+    ready = getattr(segments, "ready", None)
+    segments = iter(segments)
+    seen = dedup_index if dedup_index is not None else {}
+    stats = dedup_stats if dedup_stats is not None else DedupStats()
+    cache = client.cache
+    telemetry = client.telemetry
+    window = max_workers * 4 * batch_size
+    # Constrained and free-form answers must not stand in for each other
+    fingerprint = keyword_prompt.fingerprint + ("/structured" if structured else "")
+    if retriever is not None:
+        fingerprint += f"/retrieval:{retriever.signature}"
+    if shortcut is not None:
+        fingerprint += f"/neighbours:{shortcut.signature}"
+    pending = deque()
+    current = []
+    # Batches submitted and started, for the executor's queue depth
+    batch_counts = {"submitted": 0, "started": 0}
+    counts_lock = threading.Lock()
+    # Futures this call sent to the model; only these are cancelled on close,
+    # since a shared dedup_index may hand out another call's futures
+    owned = set()
+
+    def run_batch(batch):
+        with counts_lock:
+            batch_counts["started"] += 1
+        # Every segment was cancelled while the batch sat in the queue
+        if all(future.cancelled() for _, _, future in batch):
+            return
+        started = time.perf_counter()
+        try:
+            responses = classify_batch(
+                [(segment_id, segment_text) for segment_id, segment_text, _ in batch],
+                model_name, keyword_prompt, client,
+                structured=structured, parse_stats=parse_stats, retriever=retriever, shortcut=shortcut
+            )
+        except Exception as e:
+            for _, _, future in batch:
+                settle(future, exception=e)
+            return
+        finally:
+            telemetry.record_batch(model_name, len(batch), time.perf_counter() - started)
+        for (_, _, future), response in zip(batch, responses):
+            settle(future, response)
+
+    def settle(future, response=None, exception=None):
+        try:
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(response)
+        except InvalidStateError:
+            pass  # Cancelled by a closed generator
+
+    def submit_current():
+        if current:
+            with counts_lock:
+                batch_counts["submitted"] += 1
+            executor.submit(run_batch, list(current))
+            current.clear()
+
+    def fill():
+        exhausted = False
+        while len(pending) < window:
+            if pending and ready is not None and not ready():
+                break
+            segment = next(segments, None)
+            if segment is None:
+                exhausted = True
+                break
+            segment_id, segment_text = segment
+
+            # Copied segments never reach the model, so they stay out of the dedup counts
+            copied = shortcut.match(segment_id) if shortcut is not None else None
+            if copied is not None:
+                future = Future()
+                future.set_result(copied)
+                pending.append((segment_id, segment_text, future, None, None))
+                continue
+
+            stats.total += 1
+
+            key = None
+            if dedup:
+                # A batch's guidance is narrowed to the union of its segments'
+                # candidates, so the segment's own candidate codes join the key
+                key_fingerprint = fingerprint
+                if retriever is not None:
+                    key_fingerprint += f"/candidates:{retriever.candidate_codes(segment_text)}"
+                key = dedup_key(segment_text, key_fingerprint, model_name)
+            future = seen.get(key) if dedup else None
+            store_key = None
+            if future is None:
+                stats.unique += 1
+                future = Future()
+                cached = cache.get_answer(key) if dedup and cache is not None else None
+                if cached is not None:
+                    future.set_result(json.loads(cached))
+                else:
+                    current.append((segment_id, segment_text, future))
+                    owned.add(future)
+                    if len(current) >= batch_size:
+                        submit_current()
+                    store_key = key
+                if dedup:
+                    seen[key] = future
+            pending.append((segment_id, segment_text, future, key, store_key))
+
+        # Never wait on a segment whose batch has not been sent yet, but
+        # otherwise let a partial batch fill up as the window advances
+        if exhausted or (current and blocked_on_current()):
+            submit_current()
+        with counts_lock:
+            queued = batch_counts["submitted"] - batch_counts["started"]
+        telemetry.record_queue(len(pending), queued)
+
+    def blocked_on_current():
+        unsent = {id(future) for _, _, future in current}
+        if ordered:
+            return id(pending[0][2]) in unsent
+        # Out of order, waiting only stalls when nothing sent is still outstanding
+        return all(future.done() or id(future) in unsent for _, _, future, _, _ in pending)
+
+    def next_entry():
+        if ordered:
+            return pending.popleft()
+        entry = next((entry for entry in pending if entry[2].done()), None)
+        if entry is None:
+            wait({entry[2] for entry in pending}, return_when=FIRST_COMPLETED)
+            entry = next(entry for entry in pending if entry[2].done())
+        pending.remove(entry)
+        return entry
+
+    try:
+        fill()
+        while pending:
+            waited = time.perf_counter()
+            segment_id, segment_text, future, key, store_key = next_entry()
+            try:
+                response = future.result()
+            except Exception as e:
+                print(f"❌ Error on Segment ID {segment_id}: {e}")
+                response = "ERROR"
+            telemetry.record_result_wait(time.perf_counter() - waited)
+
+            if response == "ERROR":
+                # Let a later copy try again rather than inherit the failure
+                if key is not None and seen.get(key) is future:
+                    del seen[key]
+            elif store_key is not None and cache is not None:
+                cache.put_answer(store_key, model_name, json.dumps(response))
+
+            owned.discard(future)
+            yield segment_id, segment_text, response
+            fill()
+    finally:
+        # Reached with segments left only when the consumer stopped early
+        for _, _, future, key, _ in pending:
+            if future in owned and future.cancel() and key is not None and seen.get(key) is future:
+                del seen[key]
@@ -0,0 +1,74 @@
+import time
+import threading
+
+class AdaptiveRateLimiter:
+    """
+    Spaces out request start times and adapts the spacing to server feedback.
+
+    An explicit rate limit (HTTP 429), or `failure_threshold` transient failures
+    in a row (5xx, timeouts), multiplies the interval between requests by
+    `backoff_factor`. A one-off error does not slow every worker down, since
+    the request's own jittered retry already covers it. Every success shrinks
+    the interval by `recovery_factor`, and `reset_after` successes in a row
+    put it back at `min_interval`.
+
+    Args:
+        min_interval (float): Smallest gap in seconds between two request starts.
+        max_interval (float): Largest gap the limiter will back off to.
+        initial_backoff (float): Interval used on the first throttle when the
+            current interval is zero.
+        backoff_factor (float): Multiplier applied on throttling.
+        recovery_factor (float): Multiplier applied on success.
+        failure_threshold (int): Transient failures in a row that count as
+            the server being overloaded.
+        reset_after (int): Successes in a row after which the backoff is dropped.
+    """
+
+    def __init__(self, min_interval=0.0, max_interval=30.0, initial_backoff=0.5,
+                 backoff_factor=2.0, recovery_factor=0.5, failure_threshold=3, reset_after=8):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.initial_backoff = initial_backoff
+        self.backoff_factor = backoff_factor
+        self.recovery_factor = recovery_factor
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.interval = min_interval
+        self._failures = 0
+        self._successes = 0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until the caller is allowed to start its next request."""
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_slot)
+            self._next_slot = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._successes += 1
+            interval = self.interval * self.recovery_factor
+            # Snap back to the floor after a run of successes or once the backoff has mostly decayed
+            if (self._successes >= self.reset_after
+                    or interval < max(self.min_interval, self.initial_backoff / 10)):
+                interval = self.min_interval
+            self.interval = interval
+
+    def record_throttle(self, rate_limited=False):
+        """
+        Records a transient failure; `rate_limited` marks an HTTP 429, which
+        backs off at once rather than after `failure_threshold` failures.
+        """
+        with self._lock:
+            self._successes = 0
+            self._failures += 1
+            if not rate_limited and self._failures < self.failure_threshold:
+                return
+            interval = max(self.interval * self.backoff_factor, self.initial_backoff)
+            self.interval = min(interval, self.max_interval)
+            self._next_slot = max(self._next_slot, time.monotonic() + self.interval)
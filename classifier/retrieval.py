@@ -0,0 +1,256 @@
+import os
+import re
+import threading
+import numpy as np
+import pandas as pd
+from processing.guidance import load_guidance_csv
+from processing.segment import load_segment_csv
+from processing.compare import merge_classifications
+from utils.prompt import KeywordPrompt, get_guidance_table
+from classifier.embeddings import cached_embeddings, embed_texts
+
+RETRIEVAL_METHODS = ("bm25", "embedding", "hybrid")
+RETRIEVAL_CACHE_DIR_NAME = ".retrieval_cache"
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were with".split()
+)
+# Reciprocal-rank-fusion constant for the hybrid method
+RRF_K = 60
+
+def tokenize(text):
+    return [token for token in TOKEN_PATTERN.findall(str(text).lower()) if token not in STOPWORDS]
+
+def guidance_documents(guidance_df):
+    """One retrieval document per guidance row: code, descriptor and include notes."""
+    return [
+        f"{code} {descriptor} {include}"
+        for code, descriptor, include in zip(
+            guidance_df['Code'], guidance_df['Descriptor'].fillna(""), guidance_df['Include'].fillna("")
+        )
+    ]
+
+class BM25Index:
+    """
+    Okapi BM25 over a small document set, with every term weight precomputed.
+
+    Scoring a query sums the weight columns of its terms, so it costs one
+    vectorized pass over the documents per query term.
+    """
+
+    def __init__(self, documents, k1=1.5, b=0.75):
+        tokenized = [tokenize(document) for document in documents]
+        self.vocabulary = {}
+        for tokens in tokenized:
+            for token in tokens:
+                self.vocabulary.setdefault(token, len(self.vocabulary))
+
+        tf = np.zeros((len(documents), len(self.vocabulary)), dtype=np.float32)
+        for row, tokens in enumerate(tokenized):
+            columns = np.fromiter((self.vocabulary[token] for token in tokens), dtype=np.int64,
+                                  count=len(tokens))
+            np.add.at(tf[row], columns, 1)
+
+        n_docs = len(documents)
+        df = (tf > 0).sum(axis=0)
+        idf = np.log1p((n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        lengths = tf.sum(axis=1, keepdims=True)
+        norm = k1 * (1 - b + b * lengths / max(float(lengths.mean()), 1.0))
+        self.weights = idf * tf * (k1 + 1) / (tf + norm)
+
+    def scores(self, query):
+        columns = [self.vocabulary[token] for token in tokenize(query) if token in self.vocabulary]
+        if not columns:
+            return np.zeros(self.weights.shape[0], dtype=np.float32)
+        return self.weights[:, columns].sum(axis=1)
+
+def _ranks(scores):
+    # Rank of each column per row (0 = best); stable so ties keep guidance order
+    order = np.argsort(-scores, axis=1, kind="stable")
+    ranks = np.empty_like(order)
+    np.put_along_axis(ranks, order, np.arange(scores.shape[1])[None, :], axis=1)
+    return ranks
+
+class GuidanceRetriever:
+    """
+    Picks the top-K guidance rows for segments so prompts only carry likely codes.
+
+    Methods:
+        "bm25": lexical BM25 over each row's code, descriptor and include notes.
+        "embedding": cosine similarity of /v1/embeddings vectors; guidance
+            vectors are cached as memory-mapped .npy files in `cache_dir`.
+        "hybrid": reciprocal-rank fusion of both rankings.
+
+    Args:
+        guidance_df (pd.DataFrame): The keyword's guidance table.
+        top_k (int): Candidate codes kept per segment.
+        method (str): One of RETRIEVAL_METHODS.
+        client (LMStudioClient, optional): Needed for "embedding" and "hybrid".
+        embedding_model (str, optional): Embedding model loaded in LM Studio.
+        cache_dir (str, optional): Where guidance embeddings are cached.
+    """
+
+    def __init__(self, guidance_df, top_k=20, method="bm25", client=None, embedding_model=None,
+                 cache_dir=None):
+        if method not in RETRIEVAL_METHODS:
+            raise ValueError(f"Unknown retrieval method '{method}', expected one of {RETRIEVAL_METHODS}")
+        if method != "bm25" and (client is None or embedding_model is None):
+            raise ValueError(f"Retrieval method '{method}' needs a client and an embedding_model")
+
+        self.guidance_df = guidance_df.dropna(subset=['Code']).reset_index(drop=True)
+        self.top_k = top_k
+        self.method = method
+        self.client = client
+        self.embedding_model = embedding_model
+        self.signature = f"{method}:{top_k}:{embedding_model or ''}"
+
+        documents = guidance_documents(self.guidance_df)
+        self.bm25 = BM25Index(documents) if method != "embedding" else None
+        self.vectors = None
+        if method != "bm25":
+            self.vectors = cached_embeddings(
+                client, documents, embedding_model, cache_dir or RETRIEVAL_CACHE_DIR_NAME
+            )
+        self._prompts = {}
+        self._rows = {}
+        self._lock = threading.Lock()
+
+    def scores(self, texts):
+        """Returns a (segments x guidance rows) relevance matrix; higher is better."""
+        bm25 = np.vstack([self.bm25.scores(text) for text in texts]) if self.bm25 is not None else None
+        if self.vectors is None:
+            return bm25
+        dense = embed_texts(self.client, list(texts), self.embedding_model) @ np.asarray(self.vectors).T
+        if bm25 is None:
+            return dense
+        return 1.0 / (RRF_K + _ranks(bm25)) + 1.0 / (RRF_K + _ranks(dense))
+
+    def rank(self, texts):
+        """Returns guidance row indices ordered best-first, one row per text."""
+        return np.argsort(-self.scores(texts), axis=1, kind="stable")
+
+    def top_rows(self, texts):
+        """
+        Returns each text's top-K guidance rows as a sorted tuple. Rows are
+        memoized per text, so the dedup key and the batch's narrowing rank a
+        segment (and embed it) only once.
+        """
+        with self._lock:
+            found = {text: self._rows.get(text) for text in texts}
+        missing = [text for text, rows in found.items() if rows is None]
+        if missing:
+            ranked = self.rank(missing)[:, :self.top_k]
+            with self._lock:
+                if len(self._rows) + len(missing) > 4096:
+                    self._rows.clear()
+                for text, rows in zip(missing, ranked):
+                    found[text] = self._rows[text] = tuple(sorted(int(row) for row in rows))
+        return [found[text] for text in texts]
+
+    def candidates(self, texts):
+        """Union of the top-K rows of each text, in guidance order."""
+        return np.unique(np.concatenate([np.asarray(rows, dtype=int) for rows in self.top_rows(texts)]))
+
+    def candidate_codes(self, text):
+        """Sorted codes of one text's top-K rows as a string for dedup keys ("*" when every row is kept)."""
+        if self.top_k >= len(self.guidance_df):
+            return "*"
+        codes = self.guidance_df['Code'].astype(str).iloc[list(self.top_rows([text])[0])]
+        return ",".join(sorted(codes))
+
+    def narrow(self, keyword_prompt, texts):
+        """
+        Returns a `KeywordPrompt` whose guidance table holds only the candidate
+        rows for `texts`, or `keyword_prompt` itself when every row would be kept.
+        Narrowed prompts are memoized per candidate set.
+        """
+        if self.top_k >= len(self.guidance_df):
+            return keyword_prompt
+        rows = tuple(self.candidates(texts))
+        if len(rows) == len(self.guidance_df):
+            return keyword_prompt
+
+        key = (keyword_prompt.fingerprint, rows)
+        with self._lock:
+            cached = self._prompts.get(key)
+        if cached is not None:
+            return cached
+
+        subset = self.guidance_df.iloc[list(rows)]
+        narrowed = KeywordPrompt(
+            get_guidance_table(subset), keyword_prompt.instruction_text, keyword_prompt.layout,
+            codes=subset['Code'].astype(str)
+        )
+        with self._lock:
+            if len(self._prompts) >= 1024:
+                self._prompts.clear()
+            self._prompts[key] = narrowed
+        return narrowed
+
+def build_retriever(base_dir, keyword, top_k=20, method="bm25", client=None, embedding_model=None):
+    """Builds a `GuidanceRetriever` for a keyword, caching embeddings under its folder."""
+    return GuidanceRetriever(
+        load_guidance_csv(base_dir, keyword), top_k=top_k, method=method, client=client,
+        embedding_model=embedding_model,
+        cache_dir=os.path.join(base_dir, keyword, RETRIEVAL_CACHE_DIR_NAME)
+    )
+
+def retrieval_recall(base_dir, keyword, ks=(5, 10, 20, 50), method="bm25", client=None,
+                     embedding_model=None, lookup_path='lookup_dictionaries.json'):
+    """
+    Measures how often the manual labels survive the top-K pre-filter.
+
+    Manual labels come from `merge_classifications`, so they are translated
+    and cleared for unclassified rows exactly as in the comparison; only
+    labels that are valid guidance codes are counted.
+
+    Args:
+        base_dir (str): Path to the categories directory.
+        keyword (str): Keyword to evaluate.
+        ks (Iterable[int]): Candidate counts to evaluate.
+        method (str): Retrieval method (see `GuidanceRetriever`).
+        client (LMStudioClient, optional): Needed for embedding methods.
+        embedding_model (str, optional): Embedding model loaded in LM Studio.
+        lookup_path (str): Lookup dictionary used by `merge_classifications`.
+
+    Returns:
+        pd.DataFrame: Indexed by K, with `label_recall` (share of manual labels
+        among the candidates), `segment_recall` (share of labelled segments
+        whose labels are all kept) and `rows_kept` (share of the guidance table
+        sent per segment).
+    """
+    guidance_df = load_guidance_csv(base_dir, keyword)
+    segments_df = load_segment_csv(base_dir, keyword)
+    no_llm = pd.DataFrame({"Segment ID": segments_df['segment_id'].iloc[:0], "Response": []})
+    manual = merge_classifications(no_llm, segments_df, guidance_df.copy(), lookup_path)
+
+    retriever = build_retriever(base_dir, keyword, max(ks), method, client, embedding_model)
+    code_rows = {code: row for row, code in enumerate(retriever.guidance_df['Code'])}
+
+    texts = dict(zip(segments_df['segment_id'], segments_df['segment_text'].astype(str)))
+    labelled = [
+        (texts[segment_id], [code_rows[label] for label in labels if label in code_rows])
+        for segment_id, labels in zip(manual['segment_id'], manual['manual_response'])
+        if segment_id in texts
+    ]
+    labelled = [(text, rows) for text, rows in labelled if rows]
+    if not labelled:
+        print(f"⚠️ [{keyword}] No manually labelled segments with valid codes")
+        return pd.DataFrame(columns=["label_recall", "segment_recall", "rows_kept"])
+
+    # Position of each guidance row in each segment's ranking
+    ranks = _ranks(retriever.scores([text for text, _ in labelled]))
+    label_ranks = [ranks[i, rows] for i, (_, rows) in enumerate(labelled)]
+    all_ranks = np.concatenate(label_ranks)
+    worst_ranks = np.array([r.max() for r in label_ranks])
+
+    n_codes = len(retriever.guidance_df)
+    report = pd.DataFrame({
+        "label_recall": [(all_ranks < k).mean() for k in ks],
+        "segment_recall": [(worst_ranks < k).mean() for k in ks],
+        "rows_kept": [min(k, n_codes) / n_codes for k in ks],
+    }, index=pd.Index(list(ks), name="K")).round(3)
+    print(f"🎯 [{keyword}] Recall@K over {len(labelled)} labelled segments ({method}, {n_codes} codes):")
+    print(report)
+    return report
@@ -1,59 +1,221 @@
 import os
 import time
-import pandas as pd
-from processing.guidance import load_guidance_csv
-from processing.segment import load_segment_csv
-from utils.prompt import load_prompt, get_guidance_table, build_prompt
-from classifier.lm_interface import call_lm_studio
+from concurrent.futures import ThreadPoolExecutor
+from processing.segment import SEGMENT_COLUMNS, iter_segment_ids, iter_segments, load_segment_csv, segment_stats
+from utils.prompt import load_keyword_prompt
+from classifier.lm_interface import LMStudioClient
+from classifier.batching import auto_batch_size
+from classifier.pipeline import classify_segments
+from classifier.dedup import DedupStats
+from classifier.utils import ParseStats
+from classifier.retrieval import build_retriever
+from classifier.neighbours import build_neighbour_shortcut, neighbour_copies_path
+from classifier.checkpoint import CheckpointWriter, load_completed_ids, partial_output_path, finalize_checkpoint
+from utils.storage import table_path, table_exists
+
+def classification(base_dir, keyword, model_name, max_workers=4, client=None, cache=None,
+                   batch_size=1, context_tokens=8192, prompt_layout="legacy",
+                   dedup=True, dedup_index=None, endpoints=None, stream=False, structured=False,
+                   top_k_codes=None, retrieval_method="bm25", embedding_model=None,
+                   neighbour_threshold=None, few_shot=0, telemetry_dir=None, instruction_path="prompt.txt"):
+    """
+    Classifies every segment of a keyword with the given model and saves the
+    responses to `<keyword>_classified_segments_<model_name>.csv`.
+
+    Up to `max_workers` requests are in flight at once. Requests go through a
+    shared `LMStudioClient`, which keeps connections alive, retries transient
+    failures and paces request starts with an adaptive rate limiter.
+
+    Segments with the same normalized text are sent once and the answer is
+    copied to every copy (see `dedup`). With `batch_size` > 1 several segments
+    share one prompt, so the instruction text and guidance table are sent once
+    per batch; segments missing from a batched answer are retried one at a time.
+
+    Segments are streamed from the keyword's table in chunks (see
+    `processing.segment.iter_segments`) and only a bounded window of them is
+    in flight, so memory does not grow with the size of the table.
+
+    Results are appended to `<output>.partial` as they complete and the file is
+    renamed to the final output at the end. If a run is interrupted, calling
+    this again skips the segments already in the partial file and retries
+    the ones that failed with "ERROR".
+
+    Args:
+        base_dir (str): Root directory containing keyword folders.
+        keyword (str): Keyword folder to classify.
+        model_name (str): Name of the model loaded in LM Studio.
+        max_workers (int): Maximum number of concurrent requests.
+        client (LMStudioClient, optional): Shared client; a new one is created
+            (and closed) for this keyword when omitted.
+        cache (ResponseCache, optional): Response cache for a client created
+            here; ignored when `client` is given.
+        batch_size (int or "auto"): Segments packed into each request. With
+            "auto" the size is picked from `context_tokens`.
+        context_tokens (int): Context window used to size batches automatically.
+        prompt_layout (str): "legacy", "prefix" or "chat" (see `KeywordPrompt`).
+            "prefix" and "chat" keep a byte-stable per-keyword prefix so the
+            server can reuse its KV cache; "chat" uses /v1/chat/completions.
+        dedup (bool): Send each unique (normalized text, guidance, model) once
+            and copy the answer to every segment ID that shares it.
+        dedup_index (dict, optional): Shared dedup index so keywords with the
+            same guidance reuse each other's answers within a run.
+        endpoints (EndpointPool, optional): Servers for a client created here
+            to route across; ignored when `client` is given.
+        stream (bool): Stream answers with a client created here, cancelling
+            each generation once its list of codes is complete; ignored when
+            `client` is given.
+        structured (bool): Send a `response_format` that restricts answers to
+            the keyword's codes, and drop any code that is not in the guidance.
+        top_k_codes (int, optional): Only put each batch's top-K candidate
+            guidance rows in the prompt (see `GuidanceRetriever`); check
+            `retrieval_recall` before picking K.
+        retrieval_method (str): "bm25", "embedding" or "hybrid".
+        embedding_model (str, optional): Embedding model for the embedding
+            retrieval methods and the neighbour shortcut.
+        neighbour_threshold (float, optional): Copy the labels of the nearest
+            segment in `<keyword>_classified.csv` instead of calling the model
+            when their embeddings' cosine similarity reaches this value. Copied
+            segments are listed in `<keyword>_neighbour_copies_<model_name>.csv`.
+        few_shot (int): Add this many nearest labelled segments to each
+            single-segment prompt as examples.
+        telemetry_dir (str, optional): Write a JSONL trace of every request
+            of this run to `<telemetry_dir>/<keyword>_<model_name>_<time>.jsonl`
+            and a Prometheus-text snapshot of the client's metrics to
+            `<keyword>_<model_name>.prom`. A telemetry summary is printed
+            either way.
+        instruction_path (str): Instruction text put before the guidance table.
+
+    Returns:
+        dict: Segments classified in this call, total segments and elapsed seconds.
+    """
+    if client is None:
+        with LMStudioClient(pool_size=max_workers, cache=cache, endpoints=endpoints, stream=stream) as client:
+            return classification(
+                base_dir, keyword, model_name, max_workers=max_workers, client=client,
+                batch_size=batch_size, context_tokens=context_tokens, prompt_layout=prompt_layout,
+                dedup=dedup, dedup_index=dedup_index, structured=structured,
+                top_k_codes=top_k_codes, retrieval_method=retrieval_method, embedding_model=embedding_model,
+                neighbour_threshold=neighbour_threshold, few_shot=few_shot, telemetry_dir=telemetry_dir,
+                instruction_path=instruction_path
+            )
 
-def classification(base_dir, keyword, model_name):
     folder = os.path.join(base_dir, keyword)
+    output_stem = f"{keyword}_classified_segments_{model_name}"
+    output_file = table_path(folder, output_stem)
+    # The checkpoint is always CSV so it can be appended to
+    partial_file = partial_output_path(table_path(folder, output_stem, "csv"))
+
+    # Load guidance and prompt (memoized per keyword)
+    keyword_prompt = load_keyword_prompt(base_dir, keyword, prompt_layout, instruction_path)
+
+    retriever = None
+    if top_k_codes:
+        retriever = build_retriever(base_dir, keyword, top_k_codes, retrieval_method, client, embedding_model)
+        print(f"🔍 [{keyword}] Sending the top {top_k_codes} of {len(retriever.guidance_df)} "
+              f"guidance rows per request ({retrieval_method})")
 
-    # Load guidance and prompt
-    guidance_df = load_guidance_csv(base_dir, keyword)
-    guidance_string = get_guidance_table(guidance_df)
-    prompt_instruction = load_prompt("prompt.txt")
-
-    # Load segments to classify
-    label_df = load_segment_csv(base_dir, keyword)
-    results = []
-    total = len(label_df)
-
-    for i, (idx, row) in enumerate(label_df.iterrows(), start=1):
-        prompt = build_prompt(
-            segment_id=row['segment_id'],
-            segment_text=row['segment_text'],
-            guidance_string=guidance_string,
-            instruction_text=prompt_instruction
+    # Load segments to classify, skipping any already checkpointed
+    # (streamed from the table in chunks, so memory does not grow with its size)
+    total, avg_chars = segment_stats(base_dir, keyword)
+    completed = load_completed_ids(partial_file)
+    if completed:
+        print(f"⏩ [{keyword}] Resuming: {len(completed)}/{total} segments already classified")
+    else:
+        # Copies from an earlier run (or threshold) would be counted by `neighbour_impact`
+        copies_path = neighbour_copies_path(folder, keyword, model_name)
+        if os.path.exists(copies_path):
+            os.remove(copies_path)
+    segments = (
+        (segment_id, segment_text)
+        for segment_id, segment_text in iter_segments(base_dir, keyword)
+        if str(segment_id) not in completed
+    )
+
+    shortcut = None
+    if neighbour_threshold is not None or few_shot:
+        if embedding_model is None:
+            raise ValueError("neighbour_threshold and few_shot need an embedding_model")
+        # Neighbour search needs every segment's embedding, so only this path loads the texts
+        shortcut = build_neighbour_shortcut(
+            base_dir, keyword, load_segment_csv(base_dir, keyword, SEGMENT_COLUMNS), client, embedding_model,
+            threshold=neighbour_threshold, few_shot=few_shot
         )
 
-        try:
-            result_text = call_lm_studio(prompt, model_name)
-            results.append({
-                "Segment ID": row['segment_id'],
-                "Segment Text": row['segment_text'],
+    if batch_size == "auto":
+        batch_size = auto_batch_size(keyword_prompt, avg_chars, context_tokens)
+        print(f"📦 [{keyword}] Using batches of {batch_size} segments")
+
+    dedup_stats = DedupStats()
+    parse_stats = ParseStats()
+    streamed_before = len(client.stream_stats)
+    telemetry = client.telemetry
+    telemetry_before = telemetry.snapshot()
+    if telemetry_dir is not None:
+        os.makedirs(telemetry_dir, exist_ok=True)
+        run_name = f"{keyword}_{model_name}"
+        telemetry.open_trace(os.path.join(telemetry_dir, f"{run_name}_{time.strftime('%Y%m%d-%H%M%S')}.jsonl"))
+        telemetry.event("run_start", keyword=keyword, model=model_name, total=total,
+                        resumed=len(completed), batch_size=batch_size, max_workers=max_workers)
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor, \
+            CheckpointWriter(partial_file) as writer:
+        results = classify_segments(
+            segments, model_name, keyword_prompt, client, executor,
+            max_workers=max_workers, batch_size=batch_size,
+            dedup=dedup, dedup_index=dedup_index, dedup_stats=dedup_stats,
+            structured=structured, parse_stats=parse_stats, retriever=retriever, shortcut=shortcut
+        )
+        # Results arrive in input order, so each run appends its rows
+        # as one ordered stretch (see `sort_checkpoint`)
+        for i, (segment_id, segment_text, result_text) in enumerate(results, start=len(completed) + 1):
+            if result_text == "ERROR":
+                print(f"❌ [{i}/{total}] [{keyword}] Error on Segment ID {segment_id}")
+            else:
+                print(f"✅ [{i}/{total}] [{keyword}] Processed Segment ID {segment_id}")
+            writer.write({
+                "Segment ID": segment_id,
+                "Segment Text": segment_text,
                 "Response": result_text
             })
-            print(f"✅ [{i}/{total}] [{keyword}] Processed Segment ID {row['segment_id']}")
-        except Exception as e:
-            print(f"❌ [{i}/{total}] [{keyword}] Error on Segment ID {row['segment_id']}: {e}")
-            results.append({
-                "Segment ID": row['segment_id'],
-                "Segment Text": row['segment_text'],
-                "Response": "ERROR"
-            })
 
-        time.sleep(1.0)  # Rate limit requests
+    elapsed = time.perf_counter() - start_time
+    if telemetry_dir is not None:
+        telemetry.event("run_end", keyword=keyword, model=model_name, seconds=round(elapsed, 3),
+                        segments=dedup_stats.total)
+        telemetry.close_trace()
+        telemetry.write_prometheus(os.path.join(telemetry_dir, f"{run_name}.prom"))
 
-    # Save results
-    output_file = os.path.join(folder, f"{keyword}_classified_segments_{model_name}.csv")
-    pd.DataFrame(results).to_csv(output_file, index=False)
+    # Promote the checkpoint to the final output; a resumed run appended the
+    # rows it retried at the end, so those are put back in input order
+    order = iter_segment_ids(base_dir, keyword) if completed else None
+    finalize_checkpoint(partial_file, output_file, order=order)
     print(f"🎉 Done! Results saved to '{output_file}'")
+    if dedup:
+        print(f"🧬 [{keyword}] Dedup: {dedup_stats.summary()}")
+    print(f"🧾 [{keyword}] Parsing: {parse_stats.summary()}")
+    if shortcut is not None and shortcut.threshold is not None:
+        shortcut.save_copies(neighbour_copies_path(folder, keyword, model_name))
+        print(f"🧲 [{keyword}] Neighbours: {len(shortcut.copies)} segments copied from a labelled "
+              f"neighbour (LLM calls avoided)")
+    if client.stream:
+        print(f"📡 [{keyword}] Streaming: {client.stream_stats.summary(since=streamed_before)}")
+    summary = telemetry.summary(since=telemetry_before).replace("\n", "\n   ")
+    print(f"📈 [{keyword}] Telemetry over {elapsed:.1f} s: {summary}")
+    if client.cache is not None:
+        stats = client.cache.stats()
+        print(f"🗄️ Cache: {stats['hits']} hits, {stats['misses']} misses "
+              f"({stats['hit_rate']:.0%} hit rate), {stats['entries']} entries; "
+              f"dedup answers: {stats['answer_hits']} hits, {stats['answer_misses']} misses "
+              f"({stats['answer_hit_rate']:.0%} hit rate), {stats['answer_entries']} entries")
+
+    copied = len(shortcut.copies) if shortcut is not None else 0
+    return {"segments": dedup_stats.total + copied, "total": total, "seconds": elapsed}
 
 def find_unclassified_keywords(base_dir, model_name):
     """
     Scans category folders and returns a list of keywords that do not have
-    the expected classification output file.
+    the expected classification output file. Partially classified keywords
+    (only a `.partial` checkpoint on disk) count as missing and are resumed.
 
     Args:
         base_dir (str): Root directory containing keyword folders.
@@ -70,22 +232,35 @@ def find_unclassified_keywords(base_dir, model_name):
         if not os.path.isdir(keyword_path):
             continue  # skip files
 
-        expected_file = os.path.join(
-            keyword_path, f"{keyword}_classified_segments_{model_name}.csv"
-        )
-
-        if not os.path.exists(expected_file):
+        if not table_exists(keyword_path, f"{keyword}_classified_segments_{model_name}"):
             missing.append(keyword)
 
     return missing
 
-def classify_all_missing_keywords(base_dir, model_name):
+def classify_all_missing_keywords(base_dir, model_name, max_workers=4, cache=None, batch_size=1,
+                                  prompt_layout="legacy", endpoints=None, stream=False,
+                                  structured=False, top_k_codes=None, retrieval_method="bm25",
+                                  embedding_model=None, neighbour_threshold=None, few_shot=0,
+                                  telemetry_dir=None):
     """
     Runs classification on all keyword folders missing model output.
 
     Args:
         base_dir (str): Path to the categories directory
         model_name (str): Name of the model used in classification
+        max_workers (int): Maximum number of concurrent requests per keyword
+        cache (ResponseCache, optional): Response cache shared by all keywords
+        batch_size (int or "auto"): Segments packed into each request
+        prompt_layout (str): "legacy", "prefix" or "chat"
+        endpoints (EndpointPool, optional): Servers to spread requests across
+        stream (bool): Stream answers and stop each one once its list is complete
+        structured (bool): Restrict answers to each keyword's guidance codes
+        top_k_codes (int, optional): Guidance rows sent per request after retrieval
+        retrieval_method (str): "bm25", "embedding" or "hybrid"
+        embedding_model (str, optional): Embedding model for retrieval and neighbours
+        neighbour_threshold (float, optional): Similarity for copying a labelled neighbour's codes
+        few_shot (int): Labelled neighbours added to prompts as examples
+        telemetry_dir (str, optional): Where per-keyword traces and metrics snapshots are written
     """
     missing_keywords = find_unclassified_keywords(base_dir, model_name)
 
@@ -95,8 +270,15 @@ def classify_all_missing_keywords(base_dir, model_name):
 
     print(f"🚀 Running classification for {len(missing_keywords)} missing keywords...\n")
 
-    for i, keyword in enumerate(missing_keywords, start=1):
-        print(f"🔎 [{i}/{len(missing_keywords)}] Classifying '{keyword}'")
-        classification(base_dir, keyword, model_name)
+    dedup_index = {}
+    with LMStudioClient(pool_size=max_workers, cache=cache, endpoints=endpoints, stream=stream) as client:
+        for i, keyword in enumerate(missing_keywords, start=1):
+            print(f"🔎 [{i}/{len(missing_keywords)}] Classifying '{keyword}'")
+            classification(base_dir, keyword, model_name, max_workers=max_workers, client=client,
+                           batch_size=batch_size, prompt_layout=prompt_layout, dedup_index=dedup_index,
+                           structured=structured, top_k_codes=top_k_codes,
+                           retrieval_method=retrieval_method, embedding_model=embedding_model,
+                           neighbour_threshold=neighbour_threshold, few_shot=few_shot,
+                           telemetry_dir=telemetry_dir)
 
     print("🎉 Finished classifying all missing keywords.")
\ No newline at end of file
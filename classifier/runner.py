@@ -0,0 +1,275 @@
+"""
+Incremental pipeline over the categories tree.
+
+Runs merge → classify → compare → evaluate, but only rebuilds an output when
+the content of one of its inputs (segment tables, guidance CSV, prompt.txt,
+lookup JSON) or its parameters (model, classification options) changed since
+the last run. Content hashes are kept in `<base_dir>/pipeline_manifest.json`.
+Merge and compare are CPU-bound and run across a process pool, one keyword
+(and model) per task.
+
+Usage (from the repository root):
+    python -m classifier.runner categories --models model-a model-b
+"""
+import os
+import json
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from processing.guidance import rename_guidance_files
+from processing.merge import merge_keyword_files
+from processing.compare import compare_keyword
+from classifier.lm_interface import LMStudioClient
+from classifier.checkpoint import partial_output_path
+from classifier.run import classification
+from classifier.evaluation import generate_model_comparisons
+from utils.storage import find_table, table_exists, table_path
+
+MANIFEST_NAME = "pipeline_manifest.json"
+STAGES = ("merge", "classify", "compare", "evaluate")
+
+class Manifest:
+    """
+    Content hashes of each stage's inputs, stored as JSON.
+
+    File hashes are memoized by (mtime_ns, size), so unchanged files are not
+    read again on the next run. `partials` records the digest each
+    classification checkpoint was started under, so an interrupted run is
+    resumed only when its inputs are unchanged.
+
+    Args:
+        path (str): Location of the manifest file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        self.stages = {}
+        self.partials = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.files = data.get("files", {})
+            self.stages = data.get("stages", {})
+            self.partials = data.get("partials", {})
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"files": self.files, "stages": self.stages, "partials": self.partials},
+                      f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def file_hash(self, path):
+        stat = os.stat(path)
+        entry = self.files.get(path)
+        if entry and entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+            return entry["sha256"]
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        self.files[path] = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "sha256": digest.hexdigest()}
+        return digest.hexdigest()
+
+    def digest(self, inputs, params=None):
+        """Combined hash of the input files' contents and the parameters."""
+        parts = {path: self.file_hash(path) if os.path.exists(path) else None for path in inputs}
+        blob = json.dumps({"inputs": parts, "params": params}, sort_keys=True, default=str)
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def is_current(self, key, digest, outputs):
+        entry = self.stages.get(key)
+        return (
+            entry is not None and entry["digest"] == digest
+            and all(os.path.exists(path) for path in outputs)
+        )
+
+    def record(self, key, digest, outputs):
+        self.stages[key] = {"digest": digest, "outputs": list(outputs)}
+
+def _table(folder, stem):
+    # The existing table in either format, or where a new one would be written
+    return find_table(folder, stem) if table_exists(folder, stem) else table_path(folder, stem)
+
+def _run_pool(jobs, max_processes):
+    """Runs (key, function, args) jobs across processes; yields (key, error or None)."""
+    if not jobs:
+        return
+    with ProcessPoolExecutor(max_workers=max_processes) as pool:
+        futures = {pool.submit(function, *args): key for key, function, args in jobs}
+        for future in as_completed(futures):
+            try:
+                future.result()
+                yield futures[future], None
+            except Exception as e:
+                yield futures[future], e
+
+def run_pipeline(base_dir, model_names, output_dir="evaluation", prompt_path="prompt.txt",
+                 lookup_path="lookup_dictionaries.json", stages=STAGES, max_processes=None,
+                 client=None, classify_options=None, force=False):
+    """
+    Brings every output of the categories tree up to date with its inputs.
+
+    An output is rebuilt when it is missing, when the hash of any of its
+    inputs or parameters differs from the manifest, or with `force`. A
+    classified output that already exists but is not in the manifest yet is
+    adopted as current rather than re-run, since classification is the
+    expensive stage; the other stages are rebuilt on their first run.
+
+    Args:
+        base_dir (str): Path to the categories directory.
+        model_names (List[str]): Models to classify and compare.
+        output_dir (str): Where `generate_model_comparisons` writes its tables.
+        prompt_path (str): Instruction text used for classification.
+        lookup_path (str): Lookup dictionary used for comparison.
+        stages (Iterable[str]): Subset of STAGES to run.
+        max_processes (int, optional): Processes for merge and compare.
+        client (LMStudioClient, optional): Shared client for classification.
+        classify_options (dict, optional): Extra keyword arguments for
+            `classification`; they are part of the classify stage's hash.
+        force (bool): Rebuild everything.
+
+    Returns:
+        dict: Stage name -> list of rebuilt keys.
+    """
+    manifest = Manifest(os.path.join(base_dir, MANIFEST_NAME))
+    classify_options = dict(classify_options or {})
+    rebuilt = {stage: [] for stage in STAGES}
+
+    rename_guidance_files(base_dir)
+    keywords = sorted(
+        keyword for keyword in os.listdir(base_dir) if os.path.isdir(os.path.join(base_dir, keyword))
+        and not keyword.startswith(".")
+    )
+
+    def stale(key, digest, outputs):
+        return force or not manifest.is_current(key, digest, outputs)
+
+    def finish(stage, key, digest, outputs, error):
+        if error is not None:
+            print(f"❌ [{stage}] {key} failed: {error}")
+            return
+        manifest.record(key, digest, outputs)
+        manifest.save()
+        rebuilt[stage].append(key)
+
+    # Merge raw exports into segment tables
+    if "merge" in stages:
+        jobs, pending = [], {}
+        for keyword in keywords:
+            folder = os.path.join(base_dir, keyword)
+            inputs = [
+                os.path.join(folder, f"{keyword}_{part}.csv") for part in ("classified", "unclassified")
+            ]
+            if not all(os.path.exists(path) for path in inputs):
+                continue
+            key, digest = f"merge:{keyword}", manifest.digest(inputs)
+            outputs = [table_path(folder, keyword)]
+            if stale(key, digest, outputs):
+                pending[key] = (digest, outputs)
+                jobs.append((key, merge_keyword_files, (folder, keyword)))
+        for key, error in _run_pool(jobs, max_processes):
+            finish("merge", key, *pending[key], error)
+
+    # Classify (network-bound, so one keyword at a time with concurrent requests)
+    if "classify" in stages:
+        owns_client = client is None
+        if owns_client:
+            client = LMStudioClient(pool_size=classify_options.get("max_workers", 4))
+        try:
+            for keyword in keywords:
+                folder = os.path.join(base_dir, keyword)
+                guidance_path = os.path.join(folder, f"{keyword}_guidance.csv")
+                if not table_exists(folder, keyword) or not os.path.exists(guidance_path):
+                    continue
+                inputs = [_table(folder, keyword), guidance_path, prompt_path]
+                for model_name in model_names:
+                    stem = f"{keyword}_classified_segments_{model_name}"
+                    key = f"classify:{keyword}:{model_name}"
+                    digest = manifest.digest(inputs, {"model": model_name, **classify_options})
+                    if table_exists(folder, stem) and key not in manifest.stages and not force:
+                        manifest.record(key, digest, [find_table(folder, stem)])
+                        continue
+                    outputs = [_table(folder, stem)]
+                    if not stale(key, digest, outputs):
+                        continue
+                    # A checkpoint from different inputs must not be resumed. One with
+                    # no recorded digest is only trusted before the key was ever built
+                    partial_file = partial_output_path(table_path(folder, stem, "csv"))
+                    started_under = manifest.partials.get(key)
+                    if os.path.exists(partial_file) and (
+                        started_under != digest if started_under is not None else key in manifest.stages
+                    ):
+                        os.remove(partial_file)
+                    manifest.partials[key] = digest
+                    manifest.save()
+                    print(f"🔎 [classify] {keyword} with '{model_name}'")
+                    try:
+                        classification(base_dir, keyword, model_name, client=client,
+                                       instruction_path=prompt_path, **classify_options)
+                        manifest.partials.pop(key, None)
+                        finish("classify", key, digest, [find_table(folder, stem)], None)
+                    except Exception as e:
+                        finish("classify", key, digest, outputs, e)
+            manifest.save()
+        finally:
+            if owns_client:
+                client.close()
+
+    # Compare each model's output against the manual labels
+    if "compare" in stages:
+        jobs, pending = [], {}
+        for keyword in keywords:
+            folder = os.path.join(base_dir, keyword)
+            guidance_path = os.path.join(folder, f"{keyword}_guidance.csv")
+            for model_name in model_names:
+                stem = f"{keyword}_classified_segments_{model_name}"
+                if not table_exists(folder, stem) or not table_exists(folder, keyword):
+                    continue
+                inputs = [find_table(folder, stem), find_table(folder, keyword), guidance_path, lookup_path]
+                key, digest = f"compare:{keyword}:{model_name}", manifest.digest(inputs)
+                outputs = [table_path(folder, f"{keyword}_comparison_{model_name}")]
+                if stale(key, digest, outputs):
+                    pending[key] = (digest, outputs)
+                    jobs.append((key, compare_keyword, (base_dir, keyword, model_name, lookup_path)))
+        for key, error in _run_pool(jobs, max_processes):
+            finish("compare", key, *pending[key], error)
+
+    # Cross-keyword report, rebuilt when any comparison changed
+    if "evaluate" in stages:
+        inputs = [
+            find_table(os.path.join(base_dir, keyword), f"{keyword}_comparison_{model_name}")
+            for keyword in keywords for model_name in model_names
+            if table_exists(os.path.join(base_dir, keyword), f"{keyword}_comparison_{model_name}")
+        ]
+        key = "evaluate"
+        digest = manifest.digest(inputs, {"models": list(model_names), "output_dir": output_dir})
+        if inputs and stale(key, digest, [output_dir]):
+            try:
+                generate_model_comparisons(list(model_names), base_dir, output_dir)
+                finish("evaluate", key, digest, [output_dir], None)
+            except Exception as e:
+                finish("evaluate", key, digest, [output_dir], e)
+
+    summary = ", ".join(f"{stage}: {len(keys)}" for stage, keys in rebuilt.items() if stage in stages)
+    print(f"🧮 Rebuilt {summary}")
+    return rebuilt
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Incrementally run merge, classification, comparison and evaluation."
+    )
+    parser.add_argument("base_dir", help="Path to the categories folder")
+    parser.add_argument("--models", nargs="+", required=True, help="Model names to classify and compare")
+    parser.add_argument("--output-dir", default="evaluation", help="Where evaluation tables are written")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES), help="Stages to run")
+    parser.add_argument("--processes", type=int, default=None, help="Processes for merge and compare")
+    parser.add_argument("--force", action="store_true", help="Rebuild everything")
+    args = parser.parse_args()
+    run_pipeline(args.base_dir, args.models, args.output_dir, stages=args.stages,
+                 max_processes=args.processes, force=args.force)
+
+if __name__ == "__main__":
+    main()
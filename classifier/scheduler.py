@@ -0,0 +1,186 @@
+import os
+import json
+import time
+import pandas as pd
+from classifier.run import classification, find_unclassified_keywords
+from classifier.lm_interface import LMStudioClient
+
+PENDING, DONE, FAILED = "pending", "done", "failed"
+
+class JobQueue:
+    """
+    Persistent (model, keyword) job list for a multi-model campaign.
+
+    The queue is a JSON file rewritten atomically after every status change,
+    so an interrupted campaign resumes with the jobs that are not yet done.
+
+    Args:
+        path (str): Location of the queue file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.jobs = []
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.jobs = json.load(f)["jobs"]
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"jobs": self.jobs}, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def add(self, model_name, keyword):
+        """
+        Queues a keyword whose output is missing. A job that already failed,
+        or that is marked done but whose output has since gone, is run again.
+        """
+        for job in self.jobs:
+            if job["model"] == model_name and job["keyword"] == keyword:
+                job["status"] = PENDING
+                return
+        self.jobs.append({"model": model_name, "keyword": keyword, "status": PENDING})
+
+    def pending(self):
+        return [job for job in self.jobs if job["status"] == PENDING]
+
+    def mark(self, job, status, **details):
+        job["status"] = status
+        job.update(details)
+        self.save()
+
+def plan_jobs(base_dir, model_names, queue, loaded_model=None):
+    """
+    Adds every missing (model, keyword) pair to the queue and orders the
+    pending jobs so that each model's work runs back to back.
+
+    Grouping by model means LM Studio loads each model's weights once; the
+    model that is already loaded (if known) goes first.
+
+    Args:
+        base_dir (str): Path to the categories directory.
+        model_names (List[str]): Models to run.
+        queue (JobQueue): Queue to fill.
+        loaded_model (str, optional): Model currently loaded in LM Studio.
+
+    Returns:
+        List[dict]: Pending jobs in execution order.
+    """
+    for model_name in model_names:
+        for keyword in sorted(find_unclassified_keywords(base_dir, model_name)):
+            queue.add(model_name, keyword)
+
+    model_order = list(model_names)
+    # Models only present in a resumed queue run after the requested ones
+    for job in queue.jobs:
+        if job["model"] not in model_order:
+            model_order.append(job["model"])
+    if loaded_model in model_order:
+        model_order.remove(loaded_model)
+        model_order.insert(0, loaded_model)
+
+    rank = {model: i for i, model in enumerate(model_order)}
+    queue.jobs.sort(key=lambda job: (rank[job["model"]], job["keyword"]))
+    queue.save()
+    return queue.pending()
+
+def warm_up_model(client, model_name):
+    """Sends a one-token request so the model is loaded before timing starts."""
+    start = time.perf_counter()
+    client.post({"model": model_name, "prompt": "Hello", "max_tokens": 1, "temperature": 0})
+    seconds = time.perf_counter() - start
+    print(f"🔥 Warmed up '{model_name}' in {seconds:.1f}s")
+    return seconds
+
+def run_campaign(base_dir, model_names, queue_path=None, warmup=True, loaded_model=None,
+                 max_workers=4, cache=None, batch_size=1, prompt_layout="legacy", endpoints=None,
+                 stream=False, structured=False, top_k_codes=None, retrieval_method="bm25",
+                 embedding_model=None, neighbour_threshold=None, few_shot=0, telemetry_dir=None):
+    """
+    Classifies every missing keyword for every model, one model at a time.
+
+    Jobs are recorded in a persistent queue (by default
+    `<base_dir>/classification_queue.json`); running this again after an
+    interruption picks up the pending jobs, and each keyword resumes from its
+    checkpoint.
+
+    Args:
+        base_dir (str): Path to the categories directory.
+        model_names (List[str]): Models to run.
+        queue_path (str, optional): Location of the job queue file.
+        warmup (bool): Load each model with a tiny request before timing it.
+        loaded_model (str, optional): Model already loaded in LM Studio; it runs first.
+        max_workers (int): Maximum number of concurrent requests.
+        cache (ResponseCache, optional): Response cache shared by all jobs.
+        batch_size (int or "auto"): Segments packed into each request.
+        prompt_layout (str): "legacy", "prefix" or "chat".
+        endpoints (EndpointPool, optional): Servers to spread requests across.
+        stream (bool): Stream answers and stop each one once its list is complete.
+        structured (bool): Restrict answers to each keyword's guidance codes.
+        top_k_codes (int, optional): Guidance rows sent per request after retrieval.
+        retrieval_method (str): "bm25", "embedding" or "hybrid".
+        embedding_model (str, optional): Embedding model for retrieval and neighbours.
+        neighbour_threshold (float, optional): Similarity for copying a labelled neighbour's codes.
+        few_shot (int): Labelled neighbours added to prompts as examples.
+        telemetry_dir (str, optional): Where per-job traces and metrics snapshots are written.
+
+    Returns:
+        pd.DataFrame: Per-model keywords, segments, seconds and segments/sec.
+    """
+    queue = JobQueue(queue_path or os.path.join(base_dir, "classification_queue.json"))
+    jobs = plan_jobs(base_dir, model_names, queue, loaded_model)
+
+    if not jobs:
+        print("✅ All keywords are already classified for every model.")
+        return pd.DataFrame()
+
+    models_in_order = list(dict.fromkeys(job["model"] for job in jobs))
+    print(f"🚀 Campaign: {len(jobs)} jobs across {len(models_in_order)} models "
+          f"({len(models_in_order) - 1} model switches)\n")
+
+    throughput = {}
+    with LMStudioClient(pool_size=max_workers, cache=cache, endpoints=endpoints, stream=stream) as client:
+        for model_name in models_in_order:
+            model_jobs = [job for job in jobs if job["model"] == model_name]
+            if warmup:
+                try:
+                    warm_up_model(client, model_name)
+                except Exception as e:
+                    # e.g. the model is not available; the other models still run
+                    print(f"❌ [{model_name}] Warm-up failed, skipping its {len(model_jobs)} jobs: {e}")
+                    for job in model_jobs:
+                        queue.mark(job, FAILED, error=f"warm-up failed: {e}")
+                    continue
+
+            dedup_index = {}
+            totals = throughput.setdefault(model_name, {"keywords": 0, "segments": 0, "seconds": 0.0})
+            for i, job in enumerate(model_jobs, start=1):
+                print(f"🔎 [{model_name}] [{i}/{len(model_jobs)}] Classifying '{job['keyword']}'")
+                try:
+                    summary = classification(
+                        base_dir, job["keyword"], model_name, max_workers=max_workers, client=client,
+                        batch_size=batch_size, prompt_layout=prompt_layout, dedup_index=dedup_index,
+                        structured=structured, top_k_codes=top_k_codes,
+                        retrieval_method=retrieval_method, embedding_model=embedding_model,
+                        neighbour_threshold=neighbour_threshold, few_shot=few_shot,
+                        telemetry_dir=telemetry_dir
+                    )
+                except Exception as e:
+                    print(f"❌ [{model_name}] Failed on '{job['keyword']}': {e}")
+                    queue.mark(job, FAILED, error=str(e))
+                    continue
+
+                queue.mark(job, DONE, segments=summary["segments"], seconds=round(summary["seconds"], 3))
+                totals["keywords"] += 1
+                totals["segments"] += summary["segments"]
+                totals["seconds"] += summary["seconds"]
+
+    if not throughput:
+        print("\n❌ No model could be warmed up.")
+        return pd.DataFrame()
+    report = pd.DataFrame(throughput).T.astype({"keywords": int, "segments": int, "seconds": float})
+    report["segments_per_sec"] = (report["segments"] / report["seconds"].where(report["seconds"] > 0)).round(2)
+    print("\n📈 Per-model throughput:")
+    print(report)
+    return report
@@ -0,0 +1,131 @@
+import json
+import threading
+import statistics
+from collections import deque
+
+# Streamed requests kept by StreamStats; older ones drop out of summaries
+MAX_STREAM_RECORDS = 10_000
+
+class JSONScanner:
+    """
+    Finds where the first complete JSON list or object ends in text that
+    arrives in pieces.
+
+    Brackets inside quoted strings are ignored and every character is looked
+    at once, so feeding a whole response costs linear time however it is split.
+    Text before the opening bracket (a model's preamble) is skipped.
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.length = 0
+        self.end = None  # Offset just past the closing bracket, once seen
+
+    @property
+    def complete(self):
+        return self.end is not None
+
+    def feed(self, piece):
+        """Consumes the next piece of text; returns True once the structure is closed."""
+        if self.end is not None:
+            return True
+        for i, char in enumerate(piece):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char in "[{":
+                self.depth += 1
+            elif char in "]}":
+                if self.depth:
+                    self.depth -= 1
+                    if self.depth == 0:
+                        self.end = self.length + i + 1
+                        return True
+            elif char == '"' and self.depth:
+                self.in_string = True
+        self.length += len(piece)
+        return False
+
+def iter_sse_text(response, is_chat):
+    """
+    Yields (text piece, usage, finished) from a streamed completion response.
+
+    Completion chunks carry `choices[0].text`, chat chunks
+    `choices[0].delta.content`; `usage` is only present on the final chunk
+    for servers that report it, and None otherwise. `finished` is True for
+    the chunk that carries a `finish_reason`, i.e. the generation has ended.
+    """
+    for line in response.iter_lines():
+        if not line.startswith(b"data:"):
+            continue
+        data = line[5:].strip()
+        if data == b"[DONE]":
+            return
+        event = json.loads(data)
+        choice = (event.get("choices") or [{}])[0]
+        if is_chat:
+            piece = (choice.get("delta") or {}).get("content") or ""
+        else:
+            piece = choice.get("text") or ""
+        yield piece, event.get("usage"), choice.get("finish_reason") is not None
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[round(fraction * (len(ordered) - 1))]
+
+class StreamStats:
+    """
+    Per-request timings of streamed generations, shared by all worker threads.
+
+    Each record holds `ttft` (seconds to the first generated text),
+    `time_to_list` (seconds until the answer's list or object was complete,
+    None if it never was), `total` seconds, the number of text `chunks` and
+    whether the generation was cancelled before the server finished it.
+    Only the last `max_records` records are kept; `len()` counts every record,
+    so it can still be passed to `summary(since=...)`.
+    """
+
+    def __init__(self, max_records=MAX_STREAM_RECORDS):
+        self.records = deque(maxlen=max_records)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def record(self, ttft, time_to_list, total, chunks, stopped_early):
+        with self._lock:
+            self.count += 1
+            self.records.append({
+                "ttft": ttft,
+                "time_to_list": time_to_list,
+                "total": total,
+                "chunks": chunks,
+                "stopped_early": stopped_early,
+            })
+
+    def __len__(self):
+        return self.count
+
+    def summary(self, since=0):
+        """One-line summary of the records from index `since` onwards (of those still kept)."""
+        with self._lock:
+            dropped = self.count - len(self.records)
+            records = list(self.records)[max(since - dropped, 0):]
+        if not records:
+            return "no streamed requests"
+        ttfts = [r["ttft"] for r in records if r["ttft"] is not None]
+        to_list = [r["time_to_list"] for r in records if r["time_to_list"] is not None]
+        early = sum(r["stopped_early"] for r in records)
+        parts = [f"{len(records)} streamed"]
+        if ttfts:
+            parts.append(f"TTFT median {statistics.median(ttfts) * 1000:.0f} ms, "
+                         f"p95 {_percentile(ttfts, 0.95) * 1000:.0f} ms")
+        if to_list:
+            parts.append(f"time-to-list median {statistics.median(to_list) * 1000:.0f} ms, "
+                         f"p95 {_percentile(to_list, 0.95) * 1000:.0f} ms")
+        parts.append(f"{early} cancelled early")
+        return "; ".join(parts)
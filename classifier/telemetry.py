@@ -0,0 +1,389 @@
+"""
+Request-level telemetry for classification runs.
+
+Every HTTP attempt made by `LMStudioClient` is recorded with its latency,
+time to first token (when streamed), the `usage` token counts the server
+reports, the rate-limiter wait and whether it succeeded, was retried or
+failed. The pipeline adds per-batch timings and queue depths. Metrics are
+kept as Prometheus-style counters, gauges and histograms; each event can
+also be appended to a JSONL trace.
+"""
+import os
+import copy
+import json
+import math
+import time
+import threading
+
+# Upper bounds in seconds (Prometheus `le` labels)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300, math.inf)
+METRIC_PREFIX = "lmsc_"
+HELP = {
+    "requests_total": "HTTP attempts by outcome (ok, retry, error).",
+    "cache_hits_total": "Answers served from the response cache.",
+    "prompt_tokens_total": "Prompt tokens reported in the response usage field.",
+    "completion_tokens_total": "Completion tokens reported in the response usage field.",
+    "request_seconds": "Wall time of an HTTP attempt, from sending to the parsed answer.",
+    "ttft_seconds": "Time to the first generated text of a streamed request.",
+    "decode_seconds": "Time from the first generated text to the end of a streamed request.",
+    "rate_limit_wait_seconds": "Time spent waiting for the rate limiter before an attempt.",
+    "batch_seconds": "Wall time of a whole batch, including retries, parsing and fallbacks.",
+    "result_wait_seconds": "Time the writer waited for the next in-order result.",
+    "pending_segments": "Segments read ahead and not yet written.",
+    "queued_batches": "Batches submitted to the executor that no worker has started.",
+    "in_flight_requests": "HTTP requests currently awaiting a response.",
+}
+
+class Histogram:
+    """Cumulative-bucket histogram with a running sum, as exported by Prometheus."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def minus(self, other):
+        """Histogram of the observations made since `other` was copied from this one."""
+        delta = Histogram(self.buckets)
+        delta.counts = [a - b for a, b in zip(self.counts, other.counts)]
+        delta.sum = self.sum - other.sum
+        delta.count = self.count - other.count
+        return delta
+
+    def quantile(self, q):
+        """Estimates a quantile by linear interpolation inside its bucket, like `histogram_quantile`."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, (bound, n) in enumerate(zip(self.buckets, self.counts)):
+            if n and seen + n >= rank:
+                lower = self.buckets[i - 1] if i else 0.0
+                if math.isinf(bound):
+                    return lower
+                return lower + (bound - lower) * (rank - seen) / n
+            seen += n
+        return self.buckets[-2]
+
+class Gauge:
+    """
+    Current value of a level such as a queue depth, with its peak and mean
+    over samples. Peaks are also kept per epoch (the span between two
+    `Telemetry.snapshot` calls), so a run can report its own peak.
+    """
+
+    def __init__(self, epoch=0):
+        self.value = 0
+        self.peak = 0
+        self.total = 0
+        self.samples = 0
+        self.epoch = epoch
+        self.peaks = {}
+
+    def set(self, value):
+        self.value = value
+        self.peak = max(self.peak, value)
+        self.peaks[self.epoch] = max(self.peaks.get(self.epoch, value), value)
+        self.total += value
+        self.samples += 1
+
+    def peak_since(self, epoch):
+        """Highest value sampled since `epoch` started, like the mean."""
+        return max((peak for start, peak in self.peaks.items() if start >= epoch), default=0)
+
+def _format_labels(labels):
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}" if labels else ""
+
+class Telemetry:
+    """
+    Thread-safe metrics for one client, optionally traced to a JSONL file.
+
+    Metrics accumulate for the lifetime of the client. Take a `snapshot()`
+    before a run and pass it to `summary` to report that run alone.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self._epoch = 0
+        self._trace = None
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def _count(self, name, labels=(), amount=1):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def _observe(self, name, value, labels=()):
+        key = (name, labels)
+        if key not in self.histograms:
+            self.histograms[key] = Histogram()
+        self.histograms[key].observe(value)
+
+    def _set(self, name, value):
+        if name not in self.gauges:
+            self.gauges[name] = Gauge(self._epoch)
+        self.gauges[name].set(value)
+
+    def _write(self, event):
+        if self._trace is not None:
+            self._trace.write(json.dumps({"ts": round(time.time(), 6), **event}) + "\n")
+
+    def request_started(self):
+        with self._lock:
+            self._in_flight += 1
+            self._set("in_flight_requests", self._in_flight)
+
+    def record_request(self, model, path, seconds, status, attempt=0, wait=0.0, endpoint=None,
+                       usage=None, ttft=None, chunks=None, stopped_early=None, error=None):
+        """
+        Records one HTTP attempt.
+
+        Args:
+            model (str): Model of the request.
+            path (str): API path relative to /v1, e.g. "completions".
+            seconds (float): Wall time from sending to the parsed answer.
+            status (str): "ok", "retry" (transient failure, retried) or "error".
+            attempt (int): 0 for the first attempt.
+            wait (float): Seconds spent waiting for the rate limiter.
+            endpoint (str, optional): Server the request went to.
+            usage (dict, optional): The response's `usage` field.
+            ttft (float, optional): Time to the first generated text, if streamed.
+            chunks (int, optional): Streamed text chunks received.
+            stopped_early (bool, optional): Whether a stream was cancelled early.
+            error (str, optional): Error message for failed attempts.
+        """
+        labels = (("model", model),)
+        usage = usage or {}
+        with self._lock:
+            self._in_flight -= 1
+            self._set("in_flight_requests", self._in_flight)
+            self._count("requests_total", labels + (("status", status),))
+            self._observe("request_seconds", seconds, labels)
+            self._observe("rate_limit_wait_seconds", wait, labels)
+            if ttft is not None:
+                self._observe("ttft_seconds", ttft, labels)
+                self._observe("decode_seconds", max(seconds - ttft, 0.0), labels)
+            for field in ("prompt_tokens", "completion_tokens"):
+                if usage.get(field) is not None:
+                    self._count(f"{field}_total", labels, usage[field])
+            event = {
+                "event": "request", "model": model, "path": path, "endpoint": endpoint,
+                "attempt": attempt, "status": status, "seconds": round(seconds, 6),
+                "wait": round(wait, 6), "ttft": None if ttft is None else round(ttft, 6),
+                "prompt_tokens": usage.get("prompt_tokens"),
+                "completion_tokens": usage.get("completion_tokens"),
+            }
+            if chunks is not None:
+                event.update(chunks=chunks, stopped_early=stopped_early)
+            if error is not None:
+                event["error"] = error
+            self._write(event)
+
+    def record_cache_hit(self, model):
+        with self._lock:
+            self._count("cache_hits_total", (("model", model),))
+
+    def record_batch(self, model, size, seconds):
+        with self._lock:
+            self._observe("batch_seconds", seconds, (("model", model),))
+            self._write({"event": "batch", "model": model, "size": size, "seconds": round(seconds, 6)})
+
+    def record_result_wait(self, seconds):
+        with self._lock:
+            self._observe("result_wait_seconds", seconds)
+
+    def record_queue(self, pending_segments, queued_batches):
+        with self._lock:
+            self._set("pending_segments", pending_segments)
+            self._set("queued_batches", queued_batches)
+
+    def event(self, name, **fields):
+        """Writes a free-form event (e.g. the start and end of a run) to the trace."""
+        with self._lock:
+            self._write({"event": name, **fields})
+
+    def open_trace(self, path):
+        """Appends every following event to the JSONL file at `path` until `close_trace`."""
+        with self._lock:
+            if self._trace is not None:
+                self._trace.close()
+            # Line-buffered so an interrupted run keeps every event written so far
+            self._trace = open(path, "a", encoding="utf-8", buffering=1)
+
+    def close_trace(self):
+        with self._lock:
+            if self._trace is not None:
+                self._trace.close()
+                self._trace = None
+
+    def snapshot(self):
+        """
+        Copy of the current metrics, to diff against in `summary`. Each
+        snapshot starts a new epoch, so gauge peaks can be reported from it on.
+        """
+        with self._lock:
+            snapshot = self._copy()
+            self._epoch += 1
+            for gauge in self.gauges.values():
+                gauge.epoch = self._epoch
+            return snapshot + (self._epoch,)
+
+    def _copy(self):
+        return copy.deepcopy((self.counters, self.histograms, self.gauges))
+
+    def prometheus(self):
+        """Renders every metric in the Prometheus text exposition format."""
+        with self._lock:
+            counters, histograms, gauges = self._copy()
+
+        lines = []
+        def header(name, kind):
+            lines.append(f"# HELP {METRIC_PREFIX}{name} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {METRIC_PREFIX}{name} {kind}")
+
+        for name in sorted({name for name, _ in counters}):
+            header(name, "counter")
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{METRIC_PREFIX}{name}{_format_labels(labels)} {value}")
+        for name in sorted({name for name, _ in histograms}):
+            header(name, "histogram")
+            for (metric, labels), histogram in sorted(histograms.items(), key=lambda item: item[0]):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, n in zip(histogram.buckets, histogram.counts):
+                    cumulative += n
+                    le = "+Inf" if math.isinf(bound) else f"{bound:g}"
+                    lines.append(f"{METRIC_PREFIX}{name}_bucket{_format_labels(labels + (('le', le),))} "
+                                 f"{cumulative}")
+                lines.append(f"{METRIC_PREFIX}{name}_sum{_format_labels(labels)} {histogram.sum:.6f}")
+                lines.append(f"{METRIC_PREFIX}{name}_count{_format_labels(labels)} {histogram.count}")
+        for name, gauge in sorted(gauges.items()):
+            header(name, "gauge")
+            lines.append(f"{METRIC_PREFIX}{name} {gauge.value}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.prometheus())
+        os.replace(tmp_path, path)
+
+    def count(self, name, since=None, **labels):
+        """
+        Total of a counter (full name, e.g. "requests_total") over every label
+        set matching `labels`, since the `since` snapshot.
+        """
+        with self._lock:
+            counters = copy.deepcopy(self.counters)
+        before = since[0] if since else {}
+        return sum(
+            value - before.get((metric, metric_labels), 0)
+            for (metric, metric_labels), value in counters.items()
+            if metric == name and all(dict(metric_labels).get(k) == v for k, v in labels.items())
+        )
+
+    def histogram(self, name, since=None):
+        """
+        The observations of a histogram since the `since` snapshot, merged
+        across label sets, or None if there were none.
+        """
+        with self._lock:
+            histograms = copy.deepcopy(self.histograms)
+        before = since[1] if since else {}
+        result = None
+        for (metric, labels), histogram in histograms.items():
+            if metric != name:
+                continue
+            previous = before.get((metric, labels))
+            delta = histogram.minus(previous) if previous is not None else histogram
+            if result is None:
+                result = delta
+            else:
+                result.counts = [a + b for a, b in zip(result.counts, delta.counts)]
+                result.sum += delta.sum
+                result.count += delta.count
+        return result if result is not None and result.count else None
+
+    def summary(self, since=None):
+        """
+        Multi-line summary of the metrics recorded since the `since` snapshot
+        (or since the client was created).
+        """
+        with self._lock:
+            gauges = copy.deepcopy(self.gauges)
+        before_gauges = since[2] if since else {}
+        since_epoch = since[3] if since else 0
+
+        def total(name, **labels):
+            return self.count(name, since, **labels)
+
+        def merged(name):
+            return self.histogram(name, since)
+
+        ok, retried, failed = total("requests_total", status="ok"), total(
+            "requests_total", status="retry"), total("requests_total", status="error")
+        if not ok + retried + failed:
+            return f"no requests ({total('cache_hits_total')} cache hits)"
+
+        def quantiles(histogram, unit=1000, suffix="ms"):
+            return ", ".join(
+                f"p{int(q * 100)} {histogram.quantile(q) * unit:.0f} {suffix}" for q in (0.5, 0.95, 0.99)
+            )
+
+        lines = [f"{ok} ok, {retried} retried, {failed} failed, {total('cache_hits_total')} cache hits"]
+        request = merged("request_seconds")
+        lines.append(f"latency {quantiles(request)}")
+        ttft, decode = merged("ttft_seconds"), merged("decode_seconds")
+        if ttft is not None:
+            lines.append(f"TTFT (prefill + queueing) {quantiles(ttft)}; decode {quantiles(decode)}")
+
+        prompt_tokens, completion_tokens = total("prompt_tokens_total"), total("completion_tokens_total")
+        if prompt_tokens or completion_tokens:
+            # Rates per request (summed request time, not wall time, so
+            # concurrency does not inflate them); prefill and decode share it
+            tokens = [f"{prompt_tokens} prompt and {completion_tokens} completion tokens"]
+            if request.sum:
+                tokens.append(f"per request {completion_tokens / request.sum:.1f} completion tok/s, "
+                              f"{(prompt_tokens + completion_tokens) / request.sum:.0f} total tok/s")
+            lines.append("; ".join(tokens))
+
+        wait = merged("rate_limit_wait_seconds")
+        batch = merged("batch_seconds")
+        client_parts = []
+        if batch is not None:
+            # Batch time not spent inside HTTP attempts: backoff sleeps, parsing, prompt building
+            overhead = max(batch.sum - request.sum, 0.0)
+            client_parts.append(f"client overhead {overhead:.1f} s of {batch.sum:.1f} s batch time "
+                                f"({overhead / batch.sum:.0%})" if batch.sum else "client overhead 0 s")
+        if wait is not None and wait.sum:
+            client_parts.append(f"rate-limit wait {wait.sum:.1f} s")
+        result_wait = merged("result_wait_seconds")
+        if result_wait is not None:
+            client_parts.append(f"writer waited {result_wait.sum:.1f} s for results")
+        if client_parts:
+            lines.append("; ".join(client_parts))
+
+        queue_parts = []
+        for name in ("pending_segments", "queued_batches", "in_flight_requests"):
+            if name not in gauges:
+                continue
+            gauge, before = gauges[name], before_gauges.get(name, Gauge())
+            samples = gauge.samples - before.samples
+            mean = (gauge.total - before.total) / samples if samples else 0
+            queue_parts.append(f"{name.replace('_', ' ')} mean {mean:.1f}, peak {gauge.peak_since(since_epoch)}")
+        if queue_parts:
+            lines.append("; ".join(queue_parts))
+        return "\n".join(lines)
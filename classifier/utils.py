@@ -1,17 +1,135 @@
 import re
 import json
+import threading
+from collections import Counter
+from classifier.streaming import JSONScanner
+
+# Quoted items inside a list span; each quote is scanned once, so matching is linear
+QUOTED_ITEM = re.compile(r'"([^"\\]*)"|\'([^\'\\]*)\'')
+# Legacy fallback for answers without a list: bare quoted words
+QUOTED_WORD = re.compile(r'"([A-Za-z]+)"')
+
+def first_list_span(response):
+    """Returns the first balanced `[...]` in the response, or None if there is none."""
+    start = response.find("[")
+    if start == -1:
+        return None
+    scanner = JSONScanner()
+    if not scanner.feed(response[start:]):
+        return None  # Truncated or unbalanced
+    return response[start:start + scanner.end]
+
+def parse_code_list(response, valid_codes=None, strict=False):
+    """
+    Parses a model answer into a list of codes in a single linear pass.
+
+    The first balanced list is decoded as JSON, falling back to its quoted
+    items (single-quoted Python-style lists, stray commas). Codes are checked
+    against `valid_codes` when it is given.
+
+    Args:
+        response (str): Raw model output.
+        valid_codes (Collection[str], optional): The keyword's guidance codes.
+        strict (bool): Require a list and drop codes that are not valid. When
+            False, answers without any list fall back to their quoted words and
+            invalid codes are kept (but still reported), as before. A list that
+            is opened but never closed (a truncated answer) is unparseable
+            either way.
+
+    Returns:
+        Tuple[List[str] or None, List[str]]: The codes (None if the answer
+        could not be parsed) and the invalid codes found in it.
+    """
+    span = first_list_span(response)
+    if span is not None:
+        try:
+            items = json.loads(span)
+        except (json.JSONDecodeError, RecursionError):
+            items = [double or single for double, single in QUOTED_ITEM.findall(span)]
+        items = [item.strip() for item in items if isinstance(item, str)]
+    elif strict or "[" in response:
+        return None, []
+    else:
+        items = QUOTED_WORD.findall(response)
+        if not items:
+            return None, []
+
+    if valid_codes is None:
+        return items, []
+    invalid = [code for code in items if code not in valid_codes]
+    if strict and invalid:
+        items = [code for code in items if code in valid_codes]
+    return items, invalid
 
 def extract_list_from_response(response):
-    # Try to extract a JSON-style list
-    pattern = r'\[(?:[^\[\]]*(?:"[^"]*"[^\[\]]*)*)*\]'
-    match = re.search(pattern, response)
+    codes, _ = parse_code_list(response)
+    return codes if codes is not None else []
+
+class ParseStats:
+    """Counts unparseable answers, retries and invalid codes across worker threads."""
+
+    def __init__(self):
+        self.answers = 0
+        self.retried = 0
+        self.unparseable = 0
+        self.invalid = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, invalid_codes=(), retried=False, unparseable=False):
+        with self._lock:
+            self.answers += 1
+            self.retried += retried
+            self.unparseable += unparseable
+            self.invalid.update(invalid_codes)
+
+    def summary(self):
+        invalid_total = sum(self.invalid.values())
+        text = (f"{self.answers} answers, {self.retried} retried, {self.unparseable} unparseable, "
+                f"{invalid_total} invalid codes")
+        if self.invalid:
+            common = ", ".join(f"{code!r}×{count}" for code, count in self.invalid.most_common(5))
+            text += f" (most common: {common})"
+        return text
+
+def extract_batch_from_response(response, segment_ids):
+    """
+    Matches a batched JSON-object response back to its segments.
+
+    Scans the response for the first decodable JSON object and keeps the
+    entries whose key is one of `segment_ids` and whose value is a list of
+    strings. Segments that are missing or malformed are left out so the
+    caller can retry them individually.
+
+    Args:
+        response (str): Raw model output.
+        segment_ids (Iterable): Segment IDs that were sent in the batch.
+
+    Returns:
+        dict: Segment ID (as str) -> list of codes.
+    """
+    expected = {str(segment_id) for segment_id in segment_ids}
+    decoder = json.JSONDecoder()
 
-    if match:
+    start = response.find("{")
+    while start != -1:
         try:
-            return json.loads(match.group())
+            obj, _ = decoder.raw_decode(response, start)
         except json.JSONDecodeError:
-            pass
+            start = response.find("{", start + 1)
+            continue
+        except RecursionError:
+            # Nested deeper than the decoder can go: not a batch answer, so the
+            # caller falls back to single-segment requests
+            return {}
+        if isinstance(obj, dict):
+            break
+        start = response.find("{", start + 1)
+    else:
+        return {}
 
-    # Fallback: extract quoted codes individually
-    codes = re.findall(r'"([A-Za-z]+)"', response)
-    return codes if codes else []
+    answers = {}
+    for key, codes in obj.items():
+        key = str(key).strip()
+        if key in expected and isinstance(codes, list) and all(isinstance(c, str) for c in codes):
+            answers[key] = codes
+    return answers
@@ -1,16 +1,17 @@
 import os
+import numpy as np
 import pandas as pd
 from itertools import chain
 from utils.formatting import parse_label_column
 from utils.lookup import load_lookup_dict, reverse_translation_dict
 from processing.guidance import load_guidance_csv
+from processing.scoring import score_classifications
+from utils.storage import find_table, read_table, write_table, table_path
 
 def load_classification_outputs(folder, keyword, model_name):
-    llm_path = os.path.join(folder, f"{keyword}_classified_segments_{model_name}.csv")
-    manual_path = os.path.join(folder, f"{keyword}.csv")
-
-    llm_df = pd.read_csv(llm_path)
-    manual_df = pd.read_csv(manual_path)
+    # Each table may be stored as .parquet or .csv (see utils.storage)
+    llm_df = read_table(find_table(folder, f"{keyword}_classified_segments_{model_name}"))
+    manual_df = read_table(find_table(folder, keyword))
     return llm_df, manual_df
 
 def merge_classifications(llm_df, manual_df, guidance_df, lookup_path='lookup_dictionaries.json'):
@@ -23,6 +24,8 @@ def merge_classifications(llm_df, manual_df, guidance_df, lookup_path='lookup_di
     df = df[["segment_id", "llm_response", "manual_response", "issue_type"]].copy()
 
     # ✅ Clear manual labels for unclassified rows (baseline fix)
+    # (object dtype so list cells can be assigned whether read from CSV or Parquet)
+    df["manual_response"] = df["manual_response"].astype(object)
     df.loc[df["issue_type"] == "issues", "manual_response"] = [[""]]
 
     # Parse responses into lists
@@ -48,10 +51,42 @@ def summarise_labels(df):
     print(f"🧾 Manual Labels: {manual_labels}")
     print(f"🤖 LLM Labels: {llm_labels}")
 
+def neighbour_impact(df, folder, keyword, model_name):
+    """
+    Splits TP/FP/FN between rows whose labels were copied from a labelled
+    neighbour (listed in `<keyword>_neighbour_copies_<model_name>.csv`) and
+    rows answered by the model.
+
+    Returns:
+        pd.DataFrame or None: Rows, TP, FP, FN, precision and recall per
+        source, or None when no neighbour copies were recorded.
+    """
+    copies_path = os.path.join(folder, f"{keyword}_neighbour_copies_{model_name}.csv")
+    if not os.path.exists(copies_path):
+        return None
+
+    copied_ids = set(pd.read_csv(copies_path, dtype={"segment_id": str})["segment_id"])
+    source = np.where(df["segment_id"].astype(str).isin(copied_ids), "neighbour", "model")
+    impact = df.groupby(source)[["TP", "FP", "FN"]].sum()
+    impact.insert(0, "rows", pd.Series(source).value_counts())
+    with np.errstate(divide="ignore", invalid="ignore"):
+        impact["precision"] = (impact["TP"] / (impact["TP"] + impact["FP"])).round(3)
+        impact["recall"] = (impact["TP"] / (impact["TP"] + impact["FN"])).round(3)
+    impact.index.name = "source"
+    print(f"🧲 {len(copied_ids)} LLM calls avoided by neighbour copies:\n{impact}")
+    return impact
+
 def compute_classification_comparison(df, valid_codes, folder, keyword, model_name):
     """
     Computes TP, TN, FP, FN for each row in the classification DataFrame,
-    saves the result to a comparison CSV.
+    saves the result to a comparison CSV. When some labels were copied from
+    labelled neighbours, their TP/FP/FN are reported separately
+    (see `neighbour_impact`).
+
+    Both label columns are encoded once as multi-hot matrices over the codes
+    (see `processing.scoring`), so the counts, plus per-code precision, recall
+    and F1 saved to `<keyword>_code_metrics_<model_name>.csv`, come from array
+    operations rather than a Python loop over rows.
 
     Args:
         df (pd.DataFrame): The merged classification DataFrame
@@ -63,28 +98,35 @@ def compute_classification_comparison(df, valid_codes, folder, keyword, model_na
     Returns:
         pd.DataFrame: Updated DataFrame with TP, TN, FP, FN columns
     """
+    row_counts, per_code, totals = score_classifications(df, valid_codes)
+    df[["TP", "TN", "FP", "FN"]] = row_counts
 
-    def count_classification_outcomes(row):
-        llm_set = set(row['llm_response'])
-        manual_set = set(row['manual_response'])
-        all_codes = valid_codes
+    # Save result
+    output_path = table_path(folder, f"{keyword}_comparison_{model_name}")
+    write_table(df, output_path)
+    print(f"📄 Comparison saved to: {output_path}")
 
-        tp = len(llm_set & manual_set)
-        fp = len(llm_set - manual_set)
-        fn = len(manual_set - llm_set)
-        tn = len(all_codes - (llm_set | manual_set))
+    metrics_path = os.path.join(folder, f"{keyword}_code_metrics_{model_name}.csv")
+    per_code.to_csv(metrics_path)
+    print(f"📐 Totals: TP={totals['TP']} FP={totals['FP']} FN={totals['FN']} TN={totals['TN']}")
+    neighbour_impact(df, folder, keyword, model_name)
 
-        return pd.Series([tp, tn, fp, fn], index=["TP", "TN", "FP", "FN"])
+    return df
 
-    # Apply row-wise comparison
-    df[["TP", "TN", "FP", "FN"]] = df.apply(count_classification_outcomes, axis=1)
+def compare_keyword(base_dir, keyword, model_name, lookup_path='lookup_dictionaries.json'):
+    """
+    Loads, merges and scores one keyword's classification for one model.
 
-    # Save result
-    output_path = os.path.join(folder, f"{keyword}_comparison_{model_name}.csv")
-    df.to_csv(output_path, index=False)
-    print(f"📄 Comparison saved to: {output_path}")
+    Raises:
+        FileNotFoundError: If the classified output or segment table is missing.
+    """
+    guidance_df = load_guidance_csv(base_dir, keyword)
+    valid_codes = set(guidance_df['Code'].dropna().unique())
+    folder = os.path.join(base_dir, keyword)
 
-    return df
+    llm_df, manual_df = load_classification_outputs(folder, keyword, model_name)
+    final_df = merge_classifications(llm_df, manual_df, guidance_df, lookup_path)
+    return compute_classification_comparison(final_df, valid_codes, folder, keyword, model_name)
 
 def compare_all_keywords_for_models(base_dir, model_names):
     """
@@ -101,15 +143,9 @@ def compare_all_keywords_for_models(base_dir, model_names):
     ]
 
     for keyword in keywords:
-        guidance_df = load_guidance_csv(base_dir, keyword)
-        valid_codes = set(guidance_df['Code'].dropna().unique())
-        folder = os.path.join(base_dir, keyword)
-
         for model_name in model_names:
             try:
-                llm_df, manual_df = load_classification_outputs(folder, keyword, model_name)
-                final_df = merge_classifications(llm_df, manual_df, guidance_df)
-                compute_classification_comparison(final_df, valid_codes, folder, keyword, model_name)
+                compare_keyword(base_dir, keyword, model_name)
                 print(f"✅ Compared {keyword} using model '{model_name}'")
             except FileNotFoundError as e:
                 print(f"⚠️  Skipped {keyword} ({model_name}) — {e}")
@@ -1,9 +1,80 @@
 import os
 import pandas as pd
+from utils.storage import (
+    CHUNK_ROWS, TableWriter, iter_table, promote_dtype, scan_csv_dtypes, table_path
+)
+
+UNCLASSIFIED_RENAMES = {"issues": "auto_issues"}
+
+def merge_keyword_files(category_path, keyword, chunksize=CHUNK_ROWS):
+    """
+    Merges `<keyword>_classified.csv` and `<keyword>_unclassified.csv` in one
+    category folder into the `<keyword>` table.
+
+    Both files are streamed `chunksize` rows at a time, so peak memory does
+    not grow with the size of the exports. A first pass over each file finds
+    the column dtypes a whole-file read would give, so every chunk is written
+    with the same types.
+
+    Returns:
+        str or None: Path of the merged table, or None if the unclassified
+        file is missing.
+    """
+    classified_path = os.path.join(category_path, f"{keyword}_classified.csv")
+    unclassified_path = os.path.join(category_path, f"{keyword}_unclassified.csv")
+    merged_path = table_path(category_path, keyword)
+
+    if not os.path.exists(unclassified_path):
+        print(f"⚠️  Missing unclassified file for '{keyword}' in '{os.path.basename(category_path)}'")
+        return None
+
+    # Rename 'issues' in unclassified to 'auto_issues'
+    classified_dtypes = scan_csv_dtypes(classified_path, chunksize)
+    unclassified_dtypes = scan_csv_dtypes(unclassified_path, chunksize)
+    renamed_dtypes = {UNCLASSIFIED_RENAMES.get(col, col): dtype for col, dtype in unclassified_dtypes.items()}
+
+    # Dtype of each merged column as pd.concat would give it; columns missing
+    # from the unclassified file are added as pd.NA (object) columns
+    dtypes = {
+        col: promote_dtype(dtype, renamed_dtypes.get(col, "object")) or "float64"
+        for col, dtype in classified_dtypes.items()
+    }
+    columns = list(dtypes)
+    # Type of each column's values for the Parquet schema: a merged "object"
+    # column may hold the floats or ints of a column only one file has
+    value_dtypes = {}
+    for col, dtype in classified_dtypes.items():
+        present = [d for d in (dtype, renamed_dtypes.get(col)) if d is not None]
+        value_dtypes[col] = promote_dtype(*present) if len(present) == 2 else (present[0] if present else None)
+
+    def read_chunks(path, file_dtypes):
+        # Each file is read with its own whole-file dtypes, then cast to the merged ones
+        read_dtypes = {col: dtype or "object" for col, dtype in file_dtypes.items()}
+        return iter_table(path, chunksize=chunksize, dtype=read_dtypes)
+
+    with TableWriter(merged_path, dtypes=value_dtypes) as writer:
+        for chunk in read_chunks(classified_path, classified_dtypes):
+            chunk = chunk.astype(dtypes)
+            chunk['issue_type'] = 'auto_issues'
+            writer.write(chunk)
+
+        for chunk in read_chunks(unclassified_path, unclassified_dtypes):
+            # Add missing columns
+            chunk = chunk.rename(columns=UNCLASSIFIED_RENAMES).reindex(columns=columns).astype(dtypes)
+            chunk['issue_type'] = 'issues'
+            writer.write(chunk)
+
+        if writer.rows == 0:
+            empty = pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in dtypes.items()})
+            writer.write(empty.assign(issue_type=pd.Series(dtype=object)))
+
+    print(f"📁 Merged file saved to: {merged_path}")
+    return merged_path
 
 def merge_classified_and_unclassified(base_dir):
     """
     Merges classified and unclassified CSV files in subdirectories under the given base directory.
+    The merged table is written in the default storage format (see `utils.storage`).
 
     Args:
         base_dir (str): Path to the base directory containing category subfolders.
@@ -21,37 +92,7 @@ def merge_classified_and_unclassified(base_dir):
         for file in os.listdir(category_path):
             if file.endswith("_classified.csv"):
                 keyword = file.replace("_classified.csv", "")
-                classified_path = os.path.join(category_path, f"{keyword}_classified.csv")
-                unclassified_path = os.path.join(category_path, f"{keyword}_unclassified.csv")
-                merged_path = os.path.join(category_path, f"{keyword}.csv")
-
-                if not os.path.exists(unclassified_path):
-                    print(f"⚠️  Missing unclassified file for '{keyword}' in '{category}'")
-                    continue
-
                 try:
-                    classified_df = pd.read_csv(classified_path)
-                    unclassified_df = pd.read_csv(unclassified_path)
-
-                    # Rename 'issues' in unclassified to 'auto_issues'
-                    unclassified_df_renamed = unclassified_df.rename(columns={"issues": "auto_issues"})
-
-                    # Add missing columns
-                    for col in classified_df.columns:
-                        if col not in unclassified_df_renamed.columns:
-                            unclassified_df_renamed[col] = pd.NA
-                    unclassified_df_renamed = unclassified_df_renamed[classified_df.columns]
-
-                    # Add issue_type
-                    classified_df['issue_type'] = 'auto_issues'
-                    unclassified_df_renamed['issue_type'] = 'issues'
-
-                    # Merge and save
-                    merged_df = pd.concat([classified_df, unclassified_df_renamed], ignore_index=True)
-                    merged_df.to_csv(merged_path, index=False)
-
-                    print(f"📁 Merged file saved to: {merged_path}")
-
+                    merge_keyword_files(category_path, keyword)
                 except Exception as e:
                     print(f"❌ Error processing '{keyword}' in '{category}': {e}")
-                    
\ No newline at end of file
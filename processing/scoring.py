@@ -0,0 +1,151 @@
+import numpy as np
+import pandas as pd
+from itertools import chain
+
+try:
+    from scipy import sparse
+except ImportError:  # scipy is optional; dense matrices are used without it
+    sparse = None
+
+# Above this many label columns the multi-hot matrices are stored sparse
+SPARSE_MIN_CODES = 512
+
+def build_vocabulary(valid_codes, *label_columns):
+    """
+    Orders the label vocabulary with the valid codes first.
+
+    Labels that are not valid codes (hallucinated codes, the empty-string
+    placeholder used for unclassified rows) get columns after them, so they
+    still count towards FP/FN but never towards TN.
+
+    Returns:
+        Tuple[pd.Index, int]: The vocabulary and the number of valid codes.
+    """
+    valid = sorted(valid_codes)
+    valid_set = set(valid)
+    extra = sorted(
+        {label for labels in chain.from_iterable(label_columns) for label in labels} - valid_set,
+        key=str
+    )
+    return pd.Index(valid + extra), len(valid)
+
+def encode_multi_hot(label_lists, vocabulary, use_sparse=None):
+    """
+    Encodes a sequence of label lists as a boolean rows x codes matrix.
+
+    Args:
+        label_lists (Sequence[list]): One list of labels per row.
+        vocabulary (pd.Index): Column labels from `build_vocabulary`.
+        use_sparse (bool, optional): Force sparse/dense storage; by default
+            sparse is used for large vocabularies when scipy is installed.
+
+    Returns:
+        np.ndarray or scipy.sparse.csr_matrix: Boolean multi-hot matrix.
+    """
+    if use_sparse is None:
+        use_sparse = sparse is not None and len(vocabulary) >= SPARSE_MIN_CODES
+
+    lengths = np.fromiter((len(labels) for labels in label_lists), dtype=np.int64, count=len(label_lists))
+    rows = np.repeat(np.arange(len(label_lists)), lengths)
+    cols = vocabulary.get_indexer(list(chain.from_iterable(label_lists)))
+    shape = (len(label_lists), len(vocabulary))
+
+    if use_sparse:
+        matrix = sparse.csr_matrix((np.ones(len(rows), dtype=bool), (rows, cols)), shape=shape)
+        matrix.sum_duplicates()
+        return matrix.astype(bool)
+
+    matrix = np.zeros(shape, dtype=bool)
+    matrix[rows, cols] = True
+    return matrix
+
+def _and(a, b):
+    return a.multiply(b) if sparse is not None and sparse.issparse(a) else a & b
+
+def _sum(matrix, axis):
+    return np.asarray(matrix.sum(axis=axis)).ravel().astype(np.int64)
+
+def score_multi_hot(llm, manual, n_valid):
+    """
+    Computes TP/TN/FP/FN per row, per code and in total from multi-hot matrices.
+
+    Args:
+        llm: Multi-hot matrix of model labels.
+        manual: Multi-hot matrix of manual labels, same shape and vocabulary.
+        n_valid (int): Number of leading columns that are valid codes.
+
+    Returns:
+        dict: "rows" (TP, TN, FP, FN arrays per row), "codes" (the same per
+        vocabulary column) and "totals" (scalar sums).
+    """
+    both = _and(llm, manual)
+    llm_rows, manual_rows, both_rows = _sum(llm, 1), _sum(manual, 1), _sum(both, 1)
+    llm_codes, manual_codes, both_codes = _sum(llm, 0), _sum(manual, 0), _sum(both, 0)
+
+    # |L ∪ M| restricted to valid codes, for TN
+    valid_union_rows = (
+        _sum(llm[:, :n_valid], 1) + _sum(manual[:, :n_valid], 1) - _sum(both[:, :n_valid], 1)
+    )
+    n_rows = llm.shape[0]
+
+    rows = {
+        "TP": both_rows,
+        "TN": n_valid - valid_union_rows,
+        "FP": llm_rows - both_rows,
+        "FN": manual_rows - both_rows,
+    }
+    codes = {
+        "TP": both_codes,
+        "TN": n_rows - (llm_codes + manual_codes - both_codes),
+        "FP": llm_codes - both_codes,
+        "FN": manual_codes - both_codes,
+    }
+    # Non-valid columns never count as true negatives
+    codes["TN"][n_valid:] = 0
+    totals = {name: int(values.sum()) for name, values in rows.items()}
+    return {"rows": rows, "codes": codes, "totals": totals}
+
+def code_metrics(scores, vocabulary):
+    """
+    Builds a per-code table of TP/TN/FP/FN with precision, recall and F1.
+
+    Args:
+        scores (dict): Output of `score_multi_hot`.
+        vocabulary (pd.Index): Column labels used for the matrices.
+
+    Returns:
+        pd.DataFrame: One row per code, indexed by code.
+    """
+    metrics = pd.DataFrame(scores["codes"], index=vocabulary)
+    metrics.index.name = "Code"
+    tp, fp, fn = metrics["TP"], metrics["FP"], metrics["FN"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        metrics["precision"] = np.where(tp + fp > 0, tp / (tp + fp), 0.0)
+        metrics["recall"] = np.where(tp + fn > 0, tp / (tp + fn), 0.0)
+        precision, recall = metrics["precision"], metrics["recall"]
+        metrics["f1"] = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+    return metrics
+
+def score_classifications(df, valid_codes):
+    """
+    Scores a merged classification DataFrame in one vectorized pass.
+
+    Args:
+        df (pd.DataFrame): Output of `merge_classifications` with list-valued
+            `llm_response` and `manual_response` columns.
+        valid_codes (set): Set of all valid topic codes from guidance.
+
+    Returns:
+        Tuple[pd.DataFrame, pd.DataFrame, dict]: Per-row TP/TN/FP/FN (aligned
+        with `df.index`), per-code metrics and overall totals.
+    """
+    llm_lists = df["llm_response"].tolist()
+    manual_lists = df["manual_response"].tolist()
+    vocabulary, n_valid = build_vocabulary(valid_codes, llm_lists, manual_lists)
+
+    llm = encode_multi_hot(llm_lists, vocabulary)
+    manual = encode_multi_hot(manual_lists, vocabulary, use_sparse=sparse is not None and sparse.issparse(llm))
+    scores = score_multi_hot(llm, manual, n_valid)
+
+    row_counts = pd.DataFrame(scores["rows"], index=df.index)[["TP", "TN", "FP", "FN"]]
+    return row_counts, code_metrics(scores, vocabulary), scores["totals"]
@@ -1,6 +1,40 @@
 import os
-import pandas as pd
+from utils.storage import CHUNK_ROWS, find_table, iter_table, read_table
 
-def load_segment_csv(base_dir, keyword):
-    csv_path = os.path.join(base_dir, keyword, f"{keyword}.csv")
-    return pd.read_csv(csv_path)
\ No newline at end of file
+SEGMENT_COLUMNS = ["segment_id", "segment_text"]
+
+def load_segment_csv(base_dir, keyword, columns=None):
+    # Reads <keyword>.parquet when it exists, otherwise <keyword>.csv
+    return read_table(find_table(os.path.join(base_dir, keyword), keyword), columns=columns)
+
+def iter_segments(base_dir, keyword, chunksize=CHUNK_ROWS):
+    """
+    Yields (segment_id, segment_text) pairs of a keyword's segment table.
+
+    Only the two columns are read, `chunksize` rows at a time, so memory
+    stays bounded however many segments the table holds.
+    """
+    path = find_table(os.path.join(base_dir, keyword), keyword)
+    for chunk in iter_table(path, columns=SEGMENT_COLUMNS, chunksize=chunksize):
+        yield from zip(chunk["segment_id"].tolist(), chunk["segment_text"].tolist())
+
+def iter_segment_ids(base_dir, keyword, chunksize=CHUNK_ROWS):
+    """Yields a keyword's segment ids in table order, reading only that column."""
+    path = find_table(os.path.join(base_dir, keyword), keyword)
+    for chunk in iter_table(path, columns=["segment_id"], chunksize=chunksize):
+        yield from chunk["segment_id"].tolist()
+
+def segment_stats(base_dir, keyword, chunksize=CHUNK_ROWS):
+    """
+    Counts a keyword's segments and their average text length in one
+    streaming pass over the `segment_text` column.
+
+    Returns:
+        Tuple[int, float]: Number of segments and mean characters per segment.
+    """
+    path = find_table(os.path.join(base_dir, keyword), keyword)
+    count, chars = 0, 0
+    for chunk in iter_table(path, columns=["segment_text"], chunksize=chunksize):
+        count += len(chunk)
+        chars += int(chunk["segment_text"].astype(str).str.len().sum())
+    return count, chars / count if count else 0
@@ -0,0 +1,73 @@
+import pandas as pd
+import pytest
+from classifier.checkpoint import (
+    CheckpointWriter, finalize_checkpoint, load_completed_ids, partial_output_path
+)
+from utils.storage import read_table
+
+MULTILINE = 'first line\nsecond, "quoted" line'
+
+def write_rows(path, rows):
+    with CheckpointWriter(path) as writer:
+        for segment_id, text, response in rows:
+            writer.write({"Segment ID": segment_id, "Segment Text": text, "Response": response})
+
+@pytest.fixture
+def partial(tmp_path):
+    return partial_output_path(str(tmp_path / "kw_classified_segments_m.csv"))
+
+def test_missing_checkpoint_has_nothing_completed(partial):
+    assert load_completed_ids(partial) == set()
+
+def test_resume_drops_a_record_cut_off_inside_a_quoted_field(partial):
+    write_rows(partial, [(1, "a", "['A']"), (2, MULTILINE, "['B']")])
+    with open(partial, "ab") as f:
+        f.write(b'3,"cut off\ninside the')
+
+    assert load_completed_ids(partial) == {"1", "2"}
+    write_rows(partial, [(3, MULTILINE, "[]")])
+    df = pd.read_csv(partial)
+    assert df["Segment ID"].tolist() == [1, 2, 3]
+    assert df["Segment Text"].tolist() == ["a", MULTILINE, MULTILINE]
+
+def test_resume_drops_a_row_without_its_newline(partial):
+    write_rows(partial, [(1, "a", "['A']")])
+    with open(partial, "ab") as f:
+        f.write(b"2,b,['B']")
+
+    assert load_completed_ids(partial) == {"1"}
+    with open(partial, "rb") as f:
+        assert f.read().endswith(b"['A']\n")
+
+def test_resume_retries_error_rows(partial):
+    write_rows(partial, [(1, "a", "['A']"), (2, MULTILINE, "ERROR"), (3, "c", "[]")])
+
+    assert load_completed_ids(partial) == {"1", "3"}
+    assert pd.read_csv(partial)["Segment ID"].tolist() == [1, 3]
+
+def test_finalize_puts_retried_rows_back_in_input_order(tmp_path, partial):
+    order = [10, 20, 30, 40, 50, 60]
+    # First run stops after 50, with 20 and 40 failed
+    write_rows(partial, [(10, "a", "['A']"), (20, "b", "ERROR"), (30, MULTILINE, "['C']"),
+                         (40, "d", "ERROR"), (50, "e", "[]")])
+    completed = load_completed_ids(partial)
+    # The resumed run appends what is left, in input order
+    write_rows(partial, [(i, "x", "['X']") for i in order if str(i) not in completed])
+
+    output = str(tmp_path / "out.csv")
+    finalize_checkpoint(partial, output, order=iter(order))
+    df = pd.read_csv(output)
+    assert df["Segment ID"].tolist() == order
+    assert df.loc[df["Segment ID"] == 30, "Segment Text"].item() == MULTILINE
+
+def test_finalize_parquet_streams_in_chunks(tmp_path, partial):
+    pytest.importorskip("pyarrow")
+    rows = [(i, f"text {i}", "ERROR" if i == 3 else f"['C{i}']") for i in range(7)]
+    write_rows(partial, rows)
+
+    output = str(tmp_path / "out.parquet")
+    finalize_checkpoint(partial, output, chunksize=2)
+    df = read_table(output)
+    assert df["Segment ID"].tolist() == list(range(7))
+    assert str(df["Segment ID"].dtype) == "int64"
+    assert df["Response"].tolist()[2:5] == [["C2"], "ERROR", ["C4"]]
@@ -0,0 +1,38 @@
+from classifier.utils import extract_batch_from_response, extract_list_from_response, parse_code_list
+
+VALID = {"A1", "B2", "C3"}
+
+def test_parses_the_first_json_list():
+    assert parse_code_list('Codes: ["A1", "B2"] and later ["C3"]') == (["A1", "B2"], [])
+
+def test_falls_back_to_quoted_items_of_a_python_list():
+    assert parse_code_list("['A1', 'B2',]") == (["A1", "B2"], [])
+
+def test_reports_invalid_codes_and_drops_them_when_strict():
+    assert parse_code_list('["A1", "ZZ"]', VALID) == (["A1", "ZZ"], ["ZZ"])
+    assert parse_code_list('["A1", "ZZ"]', VALID, strict=True) == (["A1"], ["ZZ"])
+
+def test_truncated_list_is_unparseable():
+    assert parse_code_list('["A1", "B2"') == (None, [])
+    assert extract_list_from_response('["A1", "B2"') == []
+
+def test_bare_quoted_words_only_without_strict():
+    assert parse_code_list('The answer is "Safety"') == (["Safety"], [])
+    assert parse_code_list('The answer is "Safety"', strict=True) == (None, [])
+
+def test_deeply_nested_list_does_not_raise():
+    nested = "[" * 100_000 + "]" * 100_000
+    codes, invalid = parse_code_list(nested)
+    assert codes == [] and invalid == []
+
+def test_batch_answer_keeps_only_expected_well_formed_entries():
+    response = 'Sure: {"1": ["A1"], "2": "B2", "3": ["C3", 4], "9": ["A1"], " 4 ": []}'
+    assert extract_batch_from_response(response, [1, 2, 3, 4]) == {"1": ["A1"], "4": []}
+
+def test_batch_answer_skips_leading_braces_that_are_not_json():
+    response = 'Using {guidance} rules: {"7": ["B2"]}'
+    assert extract_batch_from_response(response, ["7"]) == {"7": ["B2"]}
+
+def test_batch_answer_nested_too_deep_falls_back_to_single_requests():
+    response = '{"1": ' + "[" * 100_000 + "]" * 100_000 + "}"
+    assert extract_batch_from_response(response, [1]) == {}
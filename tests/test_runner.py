@@ -0,0 +1,93 @@
+import os
+import pandas as pd
+import pytest
+import classifier.runner as runner
+import utils.storage as storage
+from classifier.checkpoint import partial_output_path
+from classifier.runner import Manifest, MANIFEST_NAME, run_pipeline
+
+MODEL = "model-a"
+
+@pytest.fixture
+def tree(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "_default_format", "csv")
+    base_dir = tmp_path / "categories"
+    folder = base_dir / "kw"
+    folder.mkdir(parents=True)
+    pd.DataFrame({"segment_id": [1, 2], "segment_text": ["a", "b"]}).to_csv(folder / "kw.csv", index=False)
+    pd.DataFrame({"Code": ["A"], "Descriptor": ["d"], "Include": [""], "Exclude": [""]}).to_csv(
+        folder / "kw_guidance.csv", index=False)
+    prompt_path = tmp_path / "prompt.txt"
+    prompt_path.write_text("Classify.", encoding="utf-8")
+    return str(base_dir), str(prompt_path)
+
+@pytest.fixture
+def calls(monkeypatch):
+    """Replaces classification with a fake that records whether a checkpoint was there to resume."""
+    calls = []
+
+    def fake_classification(base_dir, keyword, model_name, fail=False, instruction_path=None, **options):
+        stem = f"{keyword}_classified_segments_{model_name}"
+        partial = partial_output_path(os.path.join(base_dir, keyword, f"{stem}.csv"))
+        calls.append({"resumed": os.path.exists(partial), "instruction_path": instruction_path})
+        with open(partial, "a", encoding="utf-8") as f:
+            f.write("Segment ID,Segment Text,Response\n")
+        if fail:
+            raise RuntimeError("interrupted")
+        os.replace(partial, os.path.join(base_dir, keyword, f"{stem}.csv"))
+
+    monkeypatch.setattr(runner, "classification", fake_classification)
+    return calls
+
+def classify(base_dir, prompt_path, **options):
+    return run_pipeline(base_dir, [MODEL], prompt_path=prompt_path, stages=("classify",),
+                        client=object(), classify_options=options)["classify"]
+
+def test_unchanged_inputs_are_not_rebuilt(tree, calls):
+    base_dir, prompt_path = tree
+    assert classify(base_dir, prompt_path) == [f"classify:kw:{MODEL}"]
+    assert classify(base_dir, prompt_path) == []
+    assert len(calls) == 1
+    assert calls[0]["instruction_path"] == prompt_path
+
+@pytest.mark.parametrize("change", ["prompt", "guidance", "options", "output"])
+def test_changed_inputs_options_or_missing_output_rebuild(tree, calls, change):
+    base_dir, prompt_path = tree
+    classify(base_dir, prompt_path)
+    options = {}
+    if change == "prompt":
+        with open(prompt_path, "a", encoding="utf-8") as f:
+            f.write(" Be brief.")
+    elif change == "guidance":
+        with open(os.path.join(base_dir, "kw", "kw_guidance.csv"), "a", encoding="utf-8") as f:
+            f.write("B,e,,\n")
+    elif change == "options":
+        options = {"batch_size": 4}
+    else:
+        os.remove(os.path.join(base_dir, "kw", f"kw_classified_segments_{MODEL}.csv"))
+
+    assert classify(base_dir, prompt_path, **options) == [f"classify:kw:{MODEL}"]
+    assert len(calls) == 2
+
+def test_existing_output_is_adopted_without_classifying(tree, calls):
+    base_dir, prompt_path = tree
+    pd.DataFrame({"Segment ID": [1]}).to_csv(
+        os.path.join(base_dir, "kw", f"kw_classified_segments_{MODEL}.csv"), index=False)
+
+    assert classify(base_dir, prompt_path) == []
+    assert calls == []
+    assert f"classify:kw:{MODEL}" in Manifest(os.path.join(base_dir, MANIFEST_NAME)).stages
+
+def test_interrupted_run_resumes_only_under_the_same_inputs(tree, calls):
+    base_dir, prompt_path = tree
+    # The runner records the failure and leaves the checkpoint in place
+    assert classify(base_dir, prompt_path, fail=True) == []
+    assert calls[-1]["resumed"] is False
+
+    classify(base_dir, prompt_path, fail=True)
+    assert calls[-1]["resumed"] is True
+
+    with open(prompt_path, "a", encoding="utf-8") as f:
+        f.write(" Be brief.")
+    classify(base_dir, prompt_path, fail=True)
+    assert calls[-1]["resumed"] is False
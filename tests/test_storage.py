@@ -0,0 +1,94 @@
+import os
+import pandas as pd
+import pytest
+from utils.storage import (
+    TableWriter, find_table, iter_table, read_table, scan_csv_dtypes, write_table
+)
+
+pytest.importorskip("pyarrow")
+
+def test_label_columns_round_trip_through_parquet(tmp_path):
+    path = str(tmp_path / "kw_classified_segments_m.parquet")
+    df = pd.DataFrame({
+        "Segment ID": [1, 2, 3, 4, 5],
+        "Response": ["['A', 'B']", ["C"], "[]", "ERROR", "not a list ["],
+    })
+    write_table(df, path)
+
+    responses = read_table(path)["Response"].tolist()
+    # Failures read back as ERROR, never as an empty prediction
+    assert responses == [["A", "B"], ["C"], [], "ERROR", "ERROR"]
+
+def test_error_responses_are_stored_as_null(tmp_path):
+    import pyarrow.parquet as pq
+    path = str(tmp_path / "out.parquet")
+    write_table(pd.DataFrame({"Segment ID": [1, 2], "Response": ["ERROR", "['A']"]}), path)
+
+    column = pq.read_table(path).column("Response")
+    assert column.null_count == 1
+    assert column.to_pylist() == [None, ["A"]]
+
+def test_other_label_columns_keep_missing_values_null(tmp_path):
+    path = str(tmp_path / "kw_comparison_m.parquet")
+    df = pd.DataFrame({"segment_id": [1, 2], "manual_response": ["['A']", None]})
+    write_table(df, path)
+
+    restored = read_table(path)["manual_response"]
+    assert restored[0] == ["A"]
+    assert restored.isna()[1]
+
+def test_csv_round_trip_is_unchanged(tmp_path):
+    path = str(tmp_path / "out.csv")
+    df = pd.DataFrame({"Segment ID": [1, 2], "Response": ["['A']", "ERROR"]})
+    write_table(df, path)
+
+    pd.testing.assert_frame_equal(read_table(path), df)
+
+def test_find_table_reads_the_newer_format(tmp_path):
+    folder = str(tmp_path)
+    write_table(pd.DataFrame({"a": [1]}), os.path.join(folder, "kw.parquet"))
+    write_table(pd.DataFrame({"a": [2]}), os.path.join(folder, "kw.csv"))
+    os.utime(os.path.join(folder, "kw.parquet"), ns=(1, 1))
+
+    assert find_table(folder, "kw").endswith("kw.csv")
+    assert read_table(find_table(folder, "kw"))["a"].tolist() == [2]
+
+def test_scan_csv_dtypes_matches_a_whole_file_read(tmp_path):
+    path = str(tmp_path / "in.csv")
+    # Empty in the first chunk, floats in the second; ints then text
+    pd.DataFrame({
+        "late": [None, None, 1.5, 2.0],
+        "mixed": ["1", "2", "x", "y"],
+        "empty": [None] * 4,
+    }).to_csv(path, index=False)
+
+    assert scan_csv_dtypes(path, chunksize=2) == {"late": "float64", "mixed": "object", "empty": None}
+
+def test_table_writer_types_columns_from_dtypes_not_the_first_chunk(tmp_path):
+    source = str(tmp_path / "in.csv")
+    pd.DataFrame({
+        "segment_id": [1, 2, 3, 4],
+        "note": [None, None, "a", "b"],
+        "score": [None, None, 0.5, 1.0],
+    }).to_csv(source, index=False)
+    dtypes = scan_csv_dtypes(source, chunksize=2)
+
+    path = str(tmp_path / "out.parquet")
+    with TableWriter(path, dtypes=dtypes) as writer:
+        read_dtypes = {col: dtype or "object" for col, dtype in dtypes.items()}
+        for chunk in iter_table(source, chunksize=2, dtype=read_dtypes):
+            writer.write(chunk)
+
+    df = read_table(path)
+    assert df["note"].tolist()[2:] == ["a", "b"]
+    assert df["score"].tolist()[2:] == [0.5, 1.0]
+    assert writer.rows == 4
+
+def test_table_writer_leaves_nothing_behind_on_failure(tmp_path):
+    path = str(tmp_path / "out.parquet")
+    with pytest.raises(RuntimeError):
+        with TableWriter(path) as writer:
+            writer.write(pd.DataFrame({"a": [1]}))
+            raise RuntimeError("interrupted")
+
+    assert os.listdir(tmp_path) == []
@@ -1,4 +1,10 @@
-import pandas as pd
+import os
+import json
+import hashlib
+from functools import lru_cache
+from processing.guidance import load_guidance_csv
+
+PROMPT_LAYOUTS = ("legacy", "prefix", "chat")
 
 def load_prompt(file_path):
     with open(file_path, "r", encoding="utf-8") as f:
@@ -6,28 +12,32 @@ def load_prompt(file_path):
 
 def get_guidance_table(guidance_df):
     # Format the guidance data into a table format for the prompt
-    guidance_table = "# Classification Guidance Table\n\n"
-    guidance_table += "| Code | Descriptor | Include | Exclude |\n"
-    guidance_table += "|------|-----------|---------|----------|\n"
-    
-    for _, row in guidance_df.iterrows():
-        code = row['Code']
-        descriptor = row['Descriptor']
-        include = row['Include'] if not pd.isna(row['Include']) else ""
-        exclude = row['Exclude'] if not pd.isna(row['Exclude']) else ""
-        
-        guidance_table += f"| {code} | {descriptor} | {include} | {exclude} |\n"
-    return guidance_table
-
-def build_prompt(segment_id, segment_text, guidance_string, instruction_text):
-    return f"""{instruction_text}\n\n{guidance_string}
-
-Please classify the following text segment using the provided guidance:
+    header = (
+        "# Classification Guidance Table\n\n"
+        "| Code | Descriptor | Include | Exclude |\n"
+        "|------|-----------|---------|----------|\n"
+    )
+    rows = zip(
+        guidance_df['Code'],
+        guidance_df['Descriptor'],
+        guidance_df['Include'].fillna(""),
+        guidance_df['Exclude'].fillna("")
+    )
+    return header + "".join(
+        f"| {code} | {descriptor} | {include} | {exclude} |\n"
+        for code, descriptor, include, exclude in rows
+    )
 
-Segment ID: {segment_id}
-Segment Text: "{segment_text}"
+def build_examples_block(examples):
+    """Formats (segment text, codes) pairs from already-labelled segments as few-shot examples."""
+    if not examples:
+        return ""
+    shown = "\n\n".join(
+        f'Segment Text: "{text}"\nCodes: {json.dumps(list(codes))}' for text, codes in examples
+    )
+    return f"Here are similar segments that have already been classified:\n\n{shown}\n\n"
 
-For each text segment, return the list of topic codes that best match the semantic meaning of the segment.
+SINGLE_RESPONSE_RULES = """For each text segment, return the list of topic codes that best match the semantic meaning of the segment.
 If the segment doesn't match any topic codes, return an empty list.
 Example responses:
 - For a segment matching multiple codes: ["GChRhet","GChSubs"]
@@ -36,4 +46,152 @@ Example responses:
 
 Return only the list of code or empty list with no additional text or explanation.
 """
-    
\ No newline at end of file
+
+BATCH_RESPONSE_RULES = """For each text segment, return the list of topic codes that best match the semantic meaning of the segment.
+If a segment doesn't match any topic codes, return an empty list for it.
+Respond with a single JSON object that maps every Segment ID (as a string) to its list of codes.
+Example response for three segments:
+{"101": ["GChRhet","GChSubs"], "102": ["GChRhet"], "103": []}
+
+Return only the JSON object with no additional text or explanation.
+"""
+
+def build_prompt_prefix(guidance_string, instruction_text, response_rules=SINGLE_RESPONSE_RULES):
+    """
+    Builds the part of the prompt that is identical for every segment of a
+    keyword: instructions, guidance table and response rules. Keeping it
+    byte-stable lets the server reuse its KV cache across requests.
+    """
+    return f"{instruction_text}\n\n{guidance_string}\n\n{response_rules}\n"
+
+def build_segment_suffix(segment_id, segment_text, examples=None):
+    return f"""{build_examples_block(examples)}Please classify the following text segment using the provided guidance:
+
+Segment ID: {segment_id}
+Segment Text: "{segment_text}"
+"""
+
+def build_batch_suffix(segments):
+    segment_block = "\n\n".join(
+        f'Segment ID: {segment_id}\nSegment Text: "{segment_text}"'
+        for segment_id, segment_text in segments
+    )
+    return f"""Please classify each of the following {len(segments)} text segments using the provided guidance:
+
+{segment_block}
+"""
+
+def build_prompt(segment_id, segment_text, guidance_string, instruction_text, examples=None):
+    # The legacy layout puts the segment before the response rules; it shares
+    # its pieces with the prefix/chat layouts, so the wording cannot drift apart
+    return (f"{instruction_text}\n\n{guidance_string}\n\n"
+            f"{build_segment_suffix(segment_id, segment_text, examples)}\n{SINGLE_RESPONSE_RULES}")
+
+def build_batch_prompt(segments, guidance_string, instruction_text):
+    """
+    Builds one prompt that classifies several segments at once, so the
+    instruction text and guidance table are sent once per batch.
+
+    Args:
+        segments (List[Tuple]): (segment_id, segment_text) pairs.
+        guidance_string (str): Guidance table from `get_guidance_table`.
+        instruction_text (str): Contents of prompt.txt.
+    """
+    return (f"{instruction_text}\n\n{guidance_string}\n\n"
+            f"{build_batch_suffix(segments)}\n{BATCH_RESPONSE_RULES}")
+
+def code_list_schema(codes):
+    """JSON schema for an answer that is a list of distinct codes from `codes`."""
+    return {"type": "array", "items": {"type": "string", "enum": list(codes)}, "uniqueItems": True}
+
+class KeywordPrompt:
+    """
+    Prompt pieces for one keyword, prepared once and reused for every segment.
+
+    Layouts:
+        "legacy": the original `build_prompt` text sent to /v1/completions.
+        "prefix": the stable prefix followed by the segment, sent to /v1/completions.
+        "chat": the stable prefix as the system message and the segment as the
+            user message, sent to /v1/chat/completions.
+
+    `single()` (optionally with few-shot examples) and `batch()` return a prompt string for the completion layouts
+    and a list of chat messages for the chat layout. `codes` holds the valid
+    topic codes from the guidance, used to size answer token caps and to
+    constrain answers with `response_format`.
+    """
+
+    def __init__(self, guidance_string, instruction_text, layout="legacy", codes=()):
+        if layout not in PROMPT_LAYOUTS:
+            raise ValueError(f"Unknown prompt layout '{layout}', expected one of {PROMPT_LAYOUTS}")
+        self.guidance_string = guidance_string
+        self.instruction_text = instruction_text
+        self.layout = layout
+        self.codes = tuple(codes)
+        self.valid_codes = frozenset(self.codes)
+        self.prefix = build_prompt_prefix(guidance_string, instruction_text)
+        self.batch_prefix = build_prompt_prefix(guidance_string, instruction_text, BATCH_RESPONSE_RULES)
+        # Identifies everything except the segment, so equal fingerprints mean equal guidance
+        self.fingerprint = hashlib.sha256(
+            "\x1f".join([layout, instruction_text, guidance_string]).encode("utf-8")
+        ).hexdigest()
+
+    def _format(self, prefix, suffix):
+        if self.layout == "chat":
+            return [
+                {"role": "system", "content": prefix},
+                {"role": "user", "content": suffix},
+            ]
+        return prefix + suffix
+
+    def single(self, segment_id, segment_text, examples=None):
+        if self.layout == "legacy":
+            return build_prompt(segment_id, segment_text, self.guidance_string, self.instruction_text, examples)
+        return self._format(self.prefix, build_segment_suffix(segment_id, segment_text, examples))
+
+    def batch(self, segments):
+        if self.layout == "legacy":
+            return build_batch_prompt(segments, self.guidance_string, self.instruction_text)
+        return self._format(self.batch_prefix, build_batch_suffix(segments))
+
+    def response_format(self, segment_ids=None):
+        """
+        OpenAI-style `response_format` restricting the answer to the keyword's
+        codes: a list of codes, or with `segment_ids` an object mapping every
+        segment ID to such a list. LM Studio enforces it with a grammar.
+        """
+        code_list = code_list_schema(self.codes)
+        if segment_ids is None:
+            schema = code_list
+        else:
+            keys = [str(segment_id) for segment_id in segment_ids]
+            schema = {
+                "type": "object",
+                "properties": {key: code_list for key in keys},
+                "required": keys,
+                "additionalProperties": False,
+            }
+        return {
+            "type": "json_schema",
+            "json_schema": {"name": "topic_codes", "strict": True, "schema": schema},
+        }
+
+@lru_cache(maxsize=256)
+def _load_keyword_prompt(guidance_path, guidance_mtime, instruction_path, instruction_mtime, layout):
+    base_dir, keyword = os.path.split(os.path.dirname(guidance_path))
+    guidance_df = load_guidance_csv(base_dir, keyword)
+    return KeywordPrompt(
+        get_guidance_table(guidance_df), load_prompt(instruction_path), layout,
+        codes=guidance_df['Code'].dropna().astype(str)
+    )
+
+def load_keyword_prompt(base_dir, keyword, layout="legacy", instruction_path="prompt.txt"):
+    """
+    Returns the `KeywordPrompt` for a keyword, memoized until its guidance CSV
+    or the instruction file changes on disk.
+    """
+    guidance_path = os.path.join(base_dir, keyword, f"{keyword}_guidance.csv")
+    return _load_keyword_prompt(
+        guidance_path, os.path.getmtime(guidance_path),
+        instruction_path, os.path.getmtime(instruction_path),
+        layout
+    )
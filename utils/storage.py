@@ -0,0 +1,319 @@
+"""
+Table storage for the categories tree.
+
+Stage outputs can be stored as CSV (label lists as Python-repr strings, the
+original format) or as Parquet with native list<string> label columns, which
+avoids `ast.literal_eval` on every cell and is much smaller on disk. Parquet
+needs pyarrow; CSV works without it.
+
+The format written by default comes from the CLASSIFIER_TABLE_FORMAT
+environment variable ("csv" or "parquet") and can be changed with
+`set_default_format`. Readers accept either format; when both exist they
+read the more recently written one, so a stage that writes CSV after a
+conversion to Parquet (or the reverse) is never shadowed by the stale copy.
+Large tables can be read and written in chunks with `iter_table` and
+`TableWriter`, so memory stays bounded by the chunk size.
+
+One-shot conversion of an existing tree:
+    python -m utils.storage categories --to parquet
+"""
+import os
+import ast
+import argparse
+import pandas as pd
+
+FORMATS = {"csv": ".csv", "parquet": ".parquet"}
+# Raw exports that merge_classified_and_unclassified reads as CSV
+SOURCE_SUFFIXES = ("_classified.csv", "_unclassified.csv", "_guidance.csv")
+LABEL_COLUMNS = ("Response", "llm_response", "manual_response", "auto_issues", "issues")
+ERROR_RESPONSE = "ERROR"
+# Rows per chunk for the streaming readers and writers
+CHUNK_ROWS = 50_000
+
+_default_format = os.environ.get("CLASSIFIER_TABLE_FORMAT", "csv")
+
+def set_default_format(fmt):
+    global _default_format
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown table format '{fmt}', expected one of {list(FORMATS)}")
+    _default_format = fmt
+
+def get_default_format():
+    return _default_format
+
+def table_path(folder, stem, fmt=None):
+    """Path a table named `stem` is written to in the given (or default) format."""
+    return os.path.join(folder, stem + FORMATS[fmt or _default_format])
+
+def find_table(folder, stem):
+    """
+    Returns the path of an existing table named `stem`. When both formats
+    exist the newer file wins (Parquet on a tie), since `convert_tree` keeps
+    its sources and later stages may write either format.
+
+    Raises:
+        FileNotFoundError: If neither a .parquet nor a .csv file exists.
+    """
+    newest, newest_mtime = None, None
+    for ext in (".parquet", ".csv"):
+        path = os.path.join(folder, stem + ext)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            continue
+        if newest is None or mtime > newest_mtime:
+            newest, newest_mtime = path, mtime
+    if newest is None:
+        raise FileNotFoundError(f"No table '{stem}' (.parquet or .csv) in {folder}")
+    return newest
+
+def table_exists(folder, stem):
+    return any(os.path.exists(os.path.join(folder, stem + ext)) for ext in (".parquet", ".csv"))
+
+def _to_label_list(value):
+    if isinstance(value, list):
+        return [str(label) for label in value]
+    # "ERROR" and unparseable strings must stay null: `safe_eval` would turn
+    # them into [], which reads back as a real "no codes" prediction
+    if isinstance(value, str) and value != ERROR_RESPONSE:
+        try:
+            parsed = ast.literal_eval(value)
+        except (ValueError, SyntaxError, MemoryError, RecursionError):
+            return None
+        if isinstance(parsed, list):
+            return [str(label) for label in parsed]
+    return None  # Missing, "ERROR" or otherwise unparseable
+
+def _from_label_array(value):
+    return list(value)
+
+def _restore_labels(df):
+    for col in LABEL_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].map(_from_label_array, na_action="ignore")
+    if "Response" in df.columns:
+        df["Response"] = df["Response"].where(df["Response"].notna(), ERROR_RESPONSE)
+    return df
+
+def read_table(path, columns=None, memory_map=True):
+    """
+    Reads a CSV or Parquet table.
+
+    For Parquet, label columns come back as Python lists (null `Response`
+    cells as "ERROR"); for CSV they stay as strings, exactly as written, and
+    callers parse them with `utils.formatting.parse_label_column` as before.
+
+    Args:
+        path (str): .csv or .parquet file.
+        columns (List[str], optional): Subset of columns to read.
+        memory_map (bool): Memory-map Parquet files instead of reading them.
+    """
+    if path.endswith(".parquet"):
+        return _restore_labels(pd.read_parquet(path, columns=columns, memory_map=memory_map))
+    return pd.read_csv(path, usecols=columns)
+
+def iter_table(path, columns=None, chunksize=CHUNK_ROWS, dtype=None):
+    """
+    Reads a CSV or Parquet table as DataFrames of at most `chunksize` rows.
+
+    Chunks come back exactly as `read_table` would return those rows, so
+    only one chunk is held in memory at a time.
+
+    Args:
+        path (str): .csv or .parquet file.
+        columns (List[str], optional): Subset of columns to read.
+        chunksize (int): Rows per chunk.
+        dtype (dict, optional): Column dtypes for CSV files (see `scan_csv_dtypes`).
+    """
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(path, memory_map=True)
+        for batch in parquet_file.iter_batches(batch_size=chunksize, columns=columns):
+            yield _restore_labels(batch.to_pandas())
+        return
+    with pd.read_csv(path, usecols=columns, chunksize=chunksize, dtype=dtype) as reader:
+        yield from reader
+
+def promote_dtype(a, b):
+    """
+    Dtype pandas gives a column holding values of dtypes `a` and `b`, where
+    None stands for nulls only.
+    """
+    if a == b:
+        return a
+    if a is None or b is None:
+        # Nulls turn ints into floats and bools into objects
+        known = a or b
+        return {"int64": "float64", "bool": "object"}.get(known, known)
+    if {a, b} <= {"int64", "float64"}:
+        return "float64"
+    return "object"
+
+def scan_csv_dtypes(path, chunksize=CHUNK_ROWS):
+    """
+    Infers the dtype a single `pd.read_csv` would give each column, reading
+    the file one chunk at a time.
+
+    Per-chunk inference can disagree (a column that is empty in one chunk
+    reads as float64), so chunks read with these dtypes line up with each
+    other.
+
+    Returns:
+        dict: Column -> dtype name, None for columns that are empty throughout.
+    """
+    dtypes = dict.fromkeys(pd.read_csv(path, nrows=0).columns)
+    first = True
+    with pd.read_csv(path, chunksize=chunksize) as reader:
+        for chunk in reader:
+            for col in chunk.columns:
+                seen = str(chunk[col].dtype) if chunk[col].notna().any() else None
+                if seen is not None and seen not in ("int64", "float64", "bool"):
+                    seen = "object"
+                dtypes[col] = seen if first else promote_dtype(dtypes[col], seen)
+            first = False
+    return dtypes
+
+def write_table(df, path):
+    """
+    Writes a table as CSV or Parquet depending on the file extension.
+
+    For Parquet, label columns (lists or list strings) are stored as native
+    list<string> columns and low-cardinality text columns such as
+    `issue_type` are dictionary-encoded.
+    """
+    if not path.endswith(".parquet"):
+        df.to_csv(path, index=False)
+        return
+    _prepare_parquet(df).to_parquet(path, index=False, compression="zstd")
+
+def _prepare_parquet(df):
+    df = df.copy()
+    for col in LABEL_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].map(_to_label_list)
+    if "issue_type" in df.columns:
+        df["issue_type"] = df["issue_type"].astype("category")
+    return df
+
+def _arrow_type(dtype):
+    import pyarrow as pa
+    return {"float64": pa.float64(), "int64": pa.int64(), "bool": pa.bool_()}.get(dtype, pa.string())
+
+class TableWriter:
+    """
+    Writes a table chunk by chunk in the format given by the file extension.
+
+    Chunks go to a temporary file that replaces `path` on a clean close, so
+    a failed run never leaves a half-written table behind. Every chunk must
+    have the same columns. The Parquet type of a column comes from `dtypes`
+    when given, so a column that is empty (or object) in the first chunk
+    still gets the type of the values later chunks hold; other columns are
+    typed from the first chunk, with empty ones stored as strings. A Parquet
+    table is only created once a chunk (possibly empty) is written.
+
+    Args:
+        path (str): .csv or .parquet file to write.
+        dtypes (dict, optional): Column -> dtype name of the column's non-null
+            values ("float64", "int64", "bool", "object"), e.g. from
+            `scan_csv_dtypes`; None for columns with no values.
+    """
+
+    def __init__(self, path, dtypes=None):
+        self.path = path
+        self.dtypes = dict(dtypes or {})
+        self.rows = 0
+        self._tmp_path = f"{path}.tmp"
+        self._parquet = path.endswith(".parquet")
+        self._writer = None
+        self._schema = None
+        if not self._parquet:
+            self._writer = open(self._tmp_path, "w", newline="", encoding="utf-8")
+
+    def write(self, df):
+        if not self._parquet:
+            df.to_csv(self._writer, index=False, header=self.rows == 0)
+            self.rows += len(df)
+            return
+
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        df = _prepare_parquet(df)
+        if self._schema is None:
+            fields = []
+            for field in pa.Schema.from_pandas(df, preserve_index=False):
+                if field.name in LABEL_COLUMNS:
+                    field = field.with_type(pa.list_(pa.string()))
+                elif field.name in self.dtypes:
+                    field = field.with_type(_arrow_type(self.dtypes[field.name]))
+                elif pa.types.is_null(field.type):
+                    field = field.with_type(pa.string())
+                fields.append(field)
+            self._schema = pa.schema(fields)
+            self._writer = pq.ParquetWriter(self._tmp_path, self._schema, compression="zstd")
+        self._writer.write_table(pa.Table.from_pandas(df, schema=self._schema, preserve_index=False))
+        self.rows += len(df)
+
+    def close(self, discard=False):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if discard:
+            if os.path.exists(self._tmp_path):
+                os.remove(self._tmp_path)
+            return
+        if os.path.exists(self._tmp_path):
+            os.replace(self._tmp_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(discard=exc_type is not None)
+
+def convert_tree(base_dir, fmt="parquet", remove_source=False):
+    """
+    Converts every table in the categories tree that has label columns.
+
+    Args:
+        base_dir (str): Path to the categories folder.
+        fmt (str): Target format, "parquet" or "csv".
+        remove_source (bool): Delete the original file after converting.
+
+    Returns:
+        List[str]: Paths of the files written.
+    """
+    source_ext = ".csv" if fmt == "parquet" else ".parquet"
+    written = []
+
+    for keyword in sorted(os.listdir(base_dir)):
+        keyword_path = os.path.join(base_dir, keyword)
+        if not os.path.isdir(keyword_path):
+            continue
+
+        for file in sorted(os.listdir(keyword_path)):
+            if not file.endswith(source_ext) or file.endswith(SOURCE_SUFFIXES):
+                continue
+            source = os.path.join(keyword_path, file)
+            df = read_table(source)
+            if not any(col in df.columns for col in LABEL_COLUMNS):
+                continue
+
+            target = table_path(keyword_path, file[:-len(source_ext)], fmt)
+            write_table(df, target)
+            written.append(target)
+            if remove_source:
+                os.remove(source)
+            print(f"🔄 Converted {source} → {target}")
+
+    return written
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert label tables between CSV and Parquet.")
+    parser.add_argument("base_dir", help="Path to the categories folder")
+    parser.add_argument("--to", choices=list(FORMATS), default="parquet", help="Target format")
+    parser.add_argument("--remove-source", action="store_true", help="Delete converted source files")
+    args = parser.parse_args()
+    convert_tree(args.base_dir, args.to, args.remove_source)
+
+if __name__ == "__main__":
+    main()